@@ -0,0 +1,114 @@
+"""
+Microbenchmarks for the storage, session, prompt and round hot paths.
+
+  python -m bench --characters 50 --messages 500 --channels 20 -o bench.json
+  python -m bench --only storage. --compare bench.json
+
+Everything runs against synthetic data in a throwaway workspace, never the
+real data/ directory. Results are written as JSON (to stdout unless -o is
+given); a readable table goes to stderr.
+"""
+import argparse
+import fnmatch
+import json
+import os
+import platform
+import shutil
+import sys
+import time
+from typing import Any, Dict, List, Optional
+
+from bench.timing import measure
+from bench.workspace import ROOT, git_revision, make_workspace
+
+
+def selected(name: str, patterns: List[str]) -> bool:
+  return not patterns or any(name.startswith(p) or fnmatch.fnmatch(name, p) for p in patterns)
+
+
+def compare(results: List[Dict[str, Any]], baseline_path: str, threshold: float) -> int:
+  """Print median ratios against an earlier run; returns how many regressed past *threshold*."""
+  with open(baseline_path, "r") as f:
+    baseline = {r["name"]: r for r in json.load(f)["results"]}
+  regressions = 0
+  print(f"\n{'case':<36} {'baseline':>12} {'now':>12} {'ratio':>7}", file=sys.stderr)
+  for result in results:
+    before = baseline.get(result["name"])
+    if not before:
+      continue
+    ratio = result["median_us"] / before["median_us"]
+    flag = ""
+    if ratio > threshold:
+      regressions += 1
+      flag = "  <-- slower"
+    print(f"{result['name']:<36} {before['median_us']:>10.1f}us {result['median_us']:>10.1f}us {ratio:>6.2f}x{flag}", file=sys.stderr)
+  return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+  parser = argparse.ArgumentParser(prog="python -m bench", description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument("--characters", type=int, default=50, help="character templates, all in every scene's cast")
+  parser.add_argument("--messages", type=int, default=500, help="messages of history per scene")
+  parser.add_argument("--channels", type=int, default=20, help="channels, each with a session, narrative and scene")
+  parser.add_argument("--seed", type=int, default=1)
+  parser.add_argument("--repeat", type=int, default=5, help="timed runs per case")
+  parser.add_argument("--min-time", type=float, default=0.05, help="minimum seconds per timed run")
+  parser.add_argument("--only", action="append", default=[], help="case name prefix or glob; may be repeated")
+  parser.add_argument("-o", "--output", help="write the JSON results here instead of stdout")
+  parser.add_argument("--compare", metavar="BASELINE", help="JSON results of an earlier run to compare against")
+  parser.add_argument("--threshold", type=float, default=1.25, help="with --compare, exit non-zero if a case is this many times slower")
+  parser.add_argument("--keep", action="store_true", help="keep the scratch workspace")
+  args = parser.parse_args(argv)
+
+  workspace = make_workspace()
+  cwd = os.getcwd()
+  os.chdir(workspace)
+  sys.path.insert(0, ROOT)
+  try:
+    from bench.cases import CASES, Fixture, populate
+
+    fixture = Fixture(args.characters, args.messages, args.channels, args.seed)
+    started = time.perf_counter()
+    populate(fixture)
+    print(f"populated {args.channels} channels x {args.messages} messages, {args.characters} characters in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+
+    results = []
+    for name, make in CASES.items():
+      if not selected(name, args.only):
+        continue
+      result = {"name": name, **measure(make(fixture), repeat=args.repeat, min_time=args.min_time)}
+      results.append(result)
+      print(f"{name:<36} {result['median_us']:>10.1f}us  (best {result['best_us']:.1f}us, {result['number']} x {result['repeat']})", file=sys.stderr)
+
+    from db import db
+    db.flush()
+  finally:
+    os.chdir(cwd)
+    if not args.keep:
+      shutil.rmtree(workspace, ignore_errors=True)
+
+  report = {
+    "meta": {
+      "revision": git_revision(),
+      "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+      "python": platform.python_version(),
+      "platform": platform.platform(),
+      "sizes": {"characters": args.characters, "messages": args.messages, "channels": args.channels},
+      "seed": args.seed,
+    },
+    "results": results,
+  }
+  if args.output:
+    with open(args.output, "w") as f:
+      json.dump(report, f, indent=2)
+  else:
+    json.dump(report, sys.stdout, indent=2)
+    print()
+
+  if args.compare:
+    return 1 if compare(results, args.compare, args.threshold) else 0
+  return 0
+
+
+if __name__ == "__main__":
+  sys.exit(main())
@@ -0,0 +1,229 @@
+"""
+The benchmarked hot paths. Each case gets the synthetic Fixture and returns
+the zero-argument callable to time; anything done before returning is setup
+and isn't measured.
+
+These modules open data/ relative to the working directory on import, so
+bench/__main__.py only imports this after switching to a scratch workspace.
+"""
+import itertools
+import random
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List
+
+from db import DatabaseProvider, SqliteDatabaseProvider, db, message_log
+from narrative.models import Character, CharacterTemplate, Message, Scene
+from narrative.session_state import get_session_blocking, session_cache
+from utils.text import chunk_by_words, trim_pose
+
+SYLLABLES = ["an", "bel", "cor", "da", "el", "fin", "gra", "hal", "is", "jor", "ka", "lin", "mor", "na", "or", "pel", "ra", "sil", "tor", "val"]
+FILLER = "the a of and to in she he they glanced toward softly while rain fell across old stone walls lantern light".split()
+
+
+@dataclass
+class Fixture:
+  characters: int
+  messages: int
+  channels: int
+  seed: int
+  rng: random.Random = field(init=False)
+  templates: List[CharacterTemplate] = field(default_factory=list)
+  channel_ids: List[int] = field(default_factory=list)
+  scenes: List[Scene] = field(default_factory=list)
+
+  def __post_init__(self):
+    self.rng = random.Random(self.seed)
+
+  def name(self) -> str:
+    return " ".join(
+      "".join(self.rng.choice(SYLLABLES) for _ in range(self.rng.randint(2, 3))).title()
+      for _ in range(self.rng.randint(1, 2))
+    )
+
+  def pose(self, words: int = 60) -> str:
+    text = [self.rng.choice(FILLER) for _ in range(words)]
+    # Mention a couple of the cast, the way players do
+    for _ in range(2):
+      text.insert(self.rng.randrange(len(text)), self.rng.choice(self.templates).name.split()[0])
+    return " ".join(text)
+
+
+def populate(fixture: Fixture):
+  """Create the templates, and per channel a session, narrative and scene with its history."""
+  for _ in range(fixture.characters):
+    template = CharacterTemplate(
+      name=fixture.name(),
+      creator_id=fixture.rng.randint(1, 20),
+      creator_session_id=1,
+      personality="Curious and guarded. " * 8,
+      physical_description="Tall, with a weathered coat. " * 8,
+    )
+    db.insert(template)
+    fixture.templates.append(template)
+
+  # Appends are fsync'd in production; that's not what is being measured here
+  fsync, message_log.fsync = message_log.fsync, False
+  try:
+    for channel_id in range(1, fixture.channels + 1):
+      session = get_session_blocking(channel_id)
+      scene = session.active_scene()
+      for template in fixture.templates:
+        scene.characters.append(Character(template_id=template.id))
+      for _ in range(fixture.messages):
+        template = fixture.rng.choice(fixture.templates)
+        scene.append_message(Message(character_id=template.id, character_name=template.name, content=fixture.pose()))
+      db.update(scene)
+      fixture.channel_ids.append(channel_id)
+      fixture.scenes.append(scene)
+  finally:
+    message_log.fsync = fsync
+  db.flush()
+
+
+CASES: Dict[str, Callable[[Fixture], Callable[[], Any]]] = {}
+
+
+def case(name: str):
+  def register(fn):
+    CASES[name] = fn
+    return fn
+  return register
+
+
+# ──────────────────────────────────────────────────────────────────────────
+# Storage
+# ──────────────────────────────────────────────────────────────────────────
+def _provider_cases(prefix: str, make_provider: Callable[[], Any]):
+  @case(f"{prefix}.get_by_id")
+  def get_by_id(fixture: Fixture):
+    provider = make_provider(fixture)
+    ids = itertools.cycle([t.id for t in fixture.templates])
+    return lambda: provider.get_by_id(CharacterTemplate, next(ids))
+
+  @case(f"{prefix}.update")
+  def update(fixture: Fixture):
+    provider = make_provider(fixture)
+    templates = itertools.cycle(fixture.templates)
+    return lambda: provider.update(next(templates))
+
+
+_providers: Dict[str, Any] = {}
+
+def _tinydb(fixture: Fixture) -> DatabaseProvider:
+  if "tinydb" not in _providers:
+    provider = _providers["tinydb"] = DatabaseProvider()
+    for template in fixture.templates:
+      provider.insert(template)
+  return _providers["tinydb"]
+
+def _sqlite(fixture: Fixture) -> SqliteDatabaseProvider:
+  if "sqlite" not in _providers:
+    provider = _providers["sqlite"] = SqliteDatabaseProvider('data/bench.db')
+    for template in fixture.templates:
+      provider.insert(template)
+  return _providers["sqlite"]
+
+def _write_behind(fixture: Fixture):
+  return db
+
+_provider_cases("storage.tinydb", _tinydb)
+_provider_cases("storage.sqlite", _sqlite)
+_provider_cases("storage.write_behind", _write_behind)
+
+
+@case("storage.write_behind.flush")
+def write_behind_flush(fixture: Fixture):
+  scenes = itertools.cycle(fixture.scenes)
+  def run():
+    db.update(next(scenes))
+    db.flush()
+  return run
+
+
+def _codec_cases(spec: str):
+  from storage.serialization import get_codec, load_model
+
+  @case(f"storage.codec.{spec}.encode")
+  def encode(fixture: Fixture):
+    codec = get_codec(spec)
+    doc = fixture.scenes[0].model_dump()
+    return lambda: codec.encode(doc)
+
+  @case(f"storage.codec.{spec}.load")
+  def load(fixture: Fixture):
+    # Decode only; building a Scene would also hit the message log
+    stored = get_codec(spec).encode(fixture.templates[0].model_dump())
+    return lambda: load_model(CharacterTemplate, stored)
+
+for _spec in ["json", "orjson", "msgpack", "orjson+zlib"]:
+  _codec_cases(_spec)
+
+
+# ──────────────────────────────────────────────────────────────────────────
+# Sessions
+# ──────────────────────────────────────────────────────────────────────────
+@case("session.get_session.cached")
+def session_cached(fixture: Fixture):
+  channels = itertools.cycle(fixture.channel_ids)
+  return lambda: get_session_blocking(next(channels)).active_scene()
+
+@case("session.get_session.cold")
+def session_cold(fixture: Fixture):
+  from narrative.template_cache import template_cache
+  channels = itertools.cycle(fixture.channel_ids)
+  def run():
+    # Nothing cached: session, narrative, scene and templates all come from storage
+    session_cache.clear()
+    template_cache.clear()
+    get_session_blocking(next(channels)).active_scene()
+  return run
+
+@case("scene.load")
+def scene_load(fixture: Fixture):
+  # Metadata and cast only; should not grow with --messages
+  ids = itertools.cycle([scene.id for scene in fixture.scenes])
+  return lambda: db.provider.get_by_id(Scene, next(ids))
+
+
+# ──────────────────────────────────────────────────────────────────────────
+# Prompting
+# ──────────────────────────────────────────────────────────────────────────
+def _prompt_context(scene: Scene) -> Dict[str, Any]:
+  return {"characters": scene.characters, "acting_character": scene.characters[0], "users": "Lily"}
+
+@case("template.render")
+def template_render(fixture: Fixture):
+  from commands.roleplay import template
+  scene = fixture.scenes[0]
+  context = {**_prompt_context(scene), "summary": None, "messages": scene.tail(50)}
+  return lambda: template.render(context)
+
+@case("prompt.build")
+def prompt_build(fixture: Fixture):
+  from commands.roleplay import prompt_builder
+  scenes = itertools.cycle(fixture.scenes)
+  def run():
+    scene = next(scenes)
+    prompt_builder.build(scene, _prompt_context(scene))
+  return run
+
+
+# ──────────────────────────────────────────────────────────────────────────
+# Rounds
+# ──────────────────────────────────────────────────────────────────────────
+@case("round.activate_natural_order")
+def activate(fixture: Fixture):
+  from commands.roleplay import activate_natural_order
+  scene = fixture.scenes[0]
+  last_messages = scene.tail(min(len(fixture.templates), 16))
+  return lambda: activate_natural_order(scene, last_messages)
+
+@case("text.chunk_by_words")
+def chunk(fixture: Fixture):
+  text = " ".join(fixture.pose(400) for _ in range(5))
+  return lambda: chunk_by_words(text)
+
+@case("text.trim_pose")
+def trim(fixture: Fixture):
+  text = fixture.pose(300) + " <POSE_END>\n\nLily: " + fixture.pose(40)
+  return lambda: trim_pose(text)
@@ -0,0 +1,137 @@
+"""
+Just enough of discord.py's Interaction / channel / message surface to drive
+the command callbacks without a gateway connection. Every call can be given
+an artificial latency, to stand in for the Discord REST round trip.
+"""
+import asyncio
+import itertools
+import time
+from collections import deque
+from typing import Any, Deque, List, Optional
+
+_ids = itertools.count(1_000_000)
+
+
+class FakeMessage:
+  def __init__(self, channel: "FakeChannel", content: Optional[str] = None, embed: Any = None):
+    self.id = next(_ids)
+    self.channel = channel
+    self.content = content
+    self.embed = embed
+    self.created_at = time.monotonic()
+    self.edits = 0
+
+  async def edit(self, *, content: Optional[str] = None, embed: Any = None, **kwargs):
+    await self.channel.api_call()
+    if content is not None:
+      self.content = content
+    if embed is not None:
+      self.embed = embed
+    self.edits += 1
+    return self
+
+  async def delete(self, **kwargs):
+    await self.channel.api_call()
+    if self in self.channel.messages:
+      self.channel.messages.remove(self)
+
+
+class FakeChannel:
+  # Discord's per-channel budget: calls beyond this many in any window of
+  # this many seconds would have been answered with a 429
+  RATE_LIMIT = (5, 5.0)
+
+  def __init__(self, id: int, *, latency: float = 0.0, enforce_rate_limit: bool = False):
+    """
+    :param enforce_rate_limit: make calls past the budget wait for it, the
+                               way discord.py does after a 429
+    """
+    self.id = id
+    self.latency = latency
+    self.enforce_rate_limit = enforce_rate_limit
+    self.messages: List[FakeMessage] = []
+    self.api_calls = 0
+    self.rate_limited = 0
+    self.recent: Deque[float] = deque()
+
+  async def api_call(self, *, counted: bool = True):
+    self.api_calls += 1
+    delay = self._count_against_limit() if counted else 0.0
+    if delay and self.enforce_rate_limit:
+      await asyncio.sleep(delay)
+    if self.latency:
+      await asyncio.sleep(self.latency)
+
+  def _count_against_limit(self) -> float:
+    """Record a call; returns how long it would have to wait for the budget."""
+    now = time.monotonic()
+    limit, per = self.RATE_LIMIT
+    while self.recent and now - self.recent[0] >= per:
+      self.recent.popleft()
+    if len(self.recent) < limit:
+      self.recent.append(now)
+      return 0.0
+    self.rate_limited += 1
+    allowed_at = self.recent[-limit] + per
+    self.recent.append(allowed_at if self.enforce_rate_limit else now)
+    return allowed_at - now
+
+  async def send(self, content: Optional[str] = None, *, embed: Any = None, counted: bool = True, **kwargs) -> FakeMessage:
+    await self.api_call(counted=counted)
+    message = FakeMessage(self, content, embed)
+    self.messages.append(message)
+    return message
+
+
+class FakeUser:
+  def __init__(self, id: int, name: str):
+    self.id = id
+    self.name = name
+    self.display_name = name
+
+
+class FakeResponse:
+  """
+  Interaction.response. Unlike Discord it tolerates being used more than
+  once; `responded` counts how often it was.
+  """
+
+  def __init__(self, channel: FakeChannel):
+    self.channel = channel
+    self.responded = 0
+    self.deferred = False
+
+  def is_done(self) -> bool:
+    return self.responded > 0 or self.deferred
+
+  async def send_message(self, content: Optional[str] = None, *, embed: Any = None, ephemeral: bool = False, **kwargs):
+    self.responded += 1
+    # Interaction responses and followups aren't limited per channel
+    message = await self.channel.send(content, embed=embed, counted=False)
+    message.ephemeral = ephemeral
+
+  async def defer(self, **kwargs):
+    await self.channel.api_call(counted=False)
+    self.deferred = True
+
+
+class FakeFollowup:
+  def __init__(self, channel: FakeChannel):
+    self.channel = channel
+
+  async def send(self, content: Optional[str] = None, *, embed: Any = None, ephemeral: bool = False, **kwargs) -> FakeMessage:
+    return await self.channel.send(content, embed=embed, counted=False)
+
+
+class FakeInteraction:
+  def __init__(self, channel: FakeChannel, user: FakeUser, *, guild_id: Optional[int] = None):
+    self.channel = channel
+    self.channel_id = channel.id
+    self.user = user
+    self.guild_id = guild_id
+    self.guild = None
+    self.response = FakeResponse(channel)
+    self.followup = FakeFollowup(channel)
+
+  async def delete_original_response(self):
+    await self.channel.api_call(counted=False)
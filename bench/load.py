@@ -0,0 +1,298 @@
+"""
+End-to-end load test: many simulated channels playing scenes at once.
+
+  python -m bench.load --channels 200 --players 2 --npcs 3 --rounds 5
+  python -m bench.load --channels 100 --stream --ttft 0.5 --tokens-per-sec 30 -o load.json
+  python -m bench.load --channels 200 --workers 4
+
+Each channel goes through the real command callbacks with fake Interaction
+objects: its GM creates NPCs and adds them to the scene (/character add,
+/scene add), its players create and /switch to their characters, the scene
+is started with /scene start, and then every player /emotes each round. The
+last pose of a round triggers the AI turns. Completions come from local stub
+servers with a configurable time-to-first-token and tokens/sec, so neither
+Discord nor a model is involved.
+
+Reported: round throughput, p50/p95/p99 round latency (last player pose until
+the AI turns, played out in the background, are done), pose acknowledgement
+latency (until /emote returns), event-loop lag, Discord calls (and how many
+would have hit the per-channel rate limit), and the scheduler's and backend
+pool's counters. JSON goes to stdout (or -o), a
+summary to stderr.
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import logging
+import os
+import platform
+import random
+import shutil
+import sys
+import time
+from typing import Any, Dict, List, Optional
+
+import yaml
+
+from bench.fakes import FakeChannel, FakeInteraction, FakeUser
+from bench.stub_server import StubCompletionServer
+from bench.timing import percentiles
+from bench.workspace import ROOT, git_revision, make_workspace
+
+SYLLABLES = ["an", "bel", "cor", "da", "el", "fin", "gra", "hal", "is", "jor", "ka", "lin", "mor", "na", "or", "pel", "ra", "sil", "tor", "val"]
+
+
+class LoopLagMonitor:
+  """Samples how late the event loop wakes up a sleeping task."""
+
+  def __init__(self, interval: float = 0.05):
+    self.interval = interval
+    self.samples: List[float] = []
+    self.task: Optional[asyncio.Task] = None
+
+  async def _run(self):
+    loop = asyncio.get_running_loop()
+    while True:
+      started = loop.time()
+      await asyncio.sleep(self.interval)
+      self.samples.append(max(loop.time() - started - self.interval, 0.0))
+
+  def start(self):
+    self.task = asyncio.get_running_loop().create_task(self._run())
+
+  def stop(self):
+    if self.task:
+      self.task.cancel()
+
+
+class ErrorLog(logging.Handler):
+  """Collects errors that are only logged, like a failed background round."""
+
+  def __init__(self, errors: List[str]):
+    super().__init__(logging.ERROR)
+    self.errors = errors
+
+  def emit(self, record: logging.LogRecord):
+    self.errors.append(record.getMessage())
+
+
+class Stats:
+  def __init__(self):
+    self.round_latency: List[float] = []
+    self.ack_latency: List[float] = []
+    self.rounds = 0
+    self.errors: List[str] = []
+    self.channels: List[FakeChannel] = []
+
+
+def configure(workspace: str, args: argparse.Namespace, stubs: List[StubCompletionServer]):
+  """Point the workspace's model.yml at the stubs and apply the run's settings."""
+  path = os.path.join(workspace, "model.yml")
+  with open(path, "r") as f:
+    cfg = yaml.safe_load(f)
+  cfg["backends"] = [{"url": stub.url, "max_inflight": args.max_inflight} for stub in stubs]
+  cfg.setdefault("pool", {})["health_interval"] = 5
+  cfg.setdefault("scheduler", {}).update({"max_queue": args.max_queue, "max_queue_per_channel": args.max_queue_per_channel})
+  cfg["streaming"] = {**cfg.get("streaming", {}), "enabled": args.stream}
+  cfg["summary"] = {**cfg.get("summary", {}), "enabled": args.summaries}
+  cfg["workers"] = {**cfg.get("workers", {}), "enabled": args.workers > 0, "processes": max(args.workers, 1)}
+  with open(path, "w") as f:
+    yaml.safe_dump(cfg, f, sort_keys=False)
+
+
+def character_name(rng: random.Random) -> str:
+  return "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 3))).title()
+
+
+async def run_channel(index: int, args: argparse.Namespace, stats: Stats):
+  from discord import app_commands
+  from commands.characters import CharacterCommands, switch_character
+  from commands.roleplay import emote, rounds
+  from commands.scene import SceneCommands
+
+  rng = random.Random(args.seed * 100_003 + index)
+  channel = FakeChannel(10_000 + index, latency=args.discord_latency, enforce_rate_limit=args.discord_rate_limit)
+  stats.channels.append(channel)
+  guild_id = index % args.guilds
+  base_user = 1_000 * (index + 1)
+  gm = FakeUser(base_user, f"gm{index}")
+  players = [FakeUser(base_user + 1 + p, f"player{index}-{p}") for p in range(args.players)]
+  characters = CharacterCommands(name="character")
+  scene = SceneCommands(name="scene")
+
+  def interaction(user: FakeUser) -> FakeInteraction:
+    return FakeInteraction(channel, user, guild_id=guild_id)
+
+  await asyncio.sleep(rng.uniform(0, args.ramp))
+
+  npc_names = []
+  for _ in range(args.npcs):
+    name = character_name(rng)
+    npc_names.append(name)
+    await CharacterCommands.add.callback(characters, interaction(gm), name)
+    await SceneCommands.add.callback(scene, interaction(gm), name)
+  for player in players:
+    name = character_name(rng)
+    await CharacterCommands.add.callback(characters, interaction(player), name)
+    await switch_character.callback(interaction(player), name)
+  if args.mode != "sequential":
+    await SceneCommands.mode.callback(scene, interaction(gm), app_commands.Choice(name=args.mode, value=args.mode))
+  await SceneCommands.start.callback(scene, interaction(gm))
+
+  for _ in range(args.rounds):
+    order = list(players)
+    rng.shuffle(order)
+    for i, player in enumerate(order):
+      await asyncio.sleep(rng.uniform(0, args.think_time))
+      pose = f"{player.name} turns to {rng.choice(npc_names)} and waits for an answer."
+      started = time.perf_counter()
+      try:
+        await emote.callback(interaction(player), pose)
+      except Exception as e:
+        stats.errors.append(f"{type(e).__name__}: {e}")
+        return
+      stats.ack_latency.append(time.perf_counter() - started)
+      if i == len(order) - 1:
+        # The last pose sets the AI turns going in the background
+        round_task = rounds.get(channel.id)
+        if round_task:
+          await round_task
+        stats.round_latency.append(time.perf_counter() - started)
+        stats.rounds += 1
+
+
+async def run(args: argparse.Namespace, workspace: str) -> Dict[str, Any]:
+  stubs = [
+    StubCompletionServer(ttft=args.ttft, tokens_per_sec=args.tokens_per_sec, tokens=args.tokens, seed=args.seed + i, error_rate=args.error_rate)
+    for i in range(args.backends)
+  ]
+  for stub in stubs:
+    await stub.start()
+  configure(workspace, args, stubs)
+
+  from commands import roleplay
+  from db import db
+  from outbound import outbox
+  db.start()
+  roleplay.pool.start()
+  if roleplay.workers:
+    roleplay.workers.start()
+
+  monitor = LoopLagMonitor()
+  monitor.start()
+  stats = Stats()
+  errors = ErrorLog(stats.errors)
+  logging.getLogger().addHandler(errors)
+  started = time.perf_counter()
+  try:
+    await asyncio.gather(*(run_channel(i, args, stats) for i in range(args.channels)))
+  finally:
+    duration = time.perf_counter() - started
+    monitor.stop()
+    logging.getLogger().removeHandler(errors)
+    await roleplay.summarizer.close()
+    await roleplay.pool.close()
+    await outbox.close()
+    if roleplay.workers:
+      await roleplay.workers.close()
+    await db.stop()
+    for stub in stubs:
+      await stub.stop()
+
+  return {
+    "duration_s": duration,
+    "rounds": stats.rounds,
+    "rounds_per_sec": stats.rounds / duration if duration else None,
+    "completions": sum(stub.requests for stub in stubs),
+    "completion_errors": sum(stub.errors for stub in stubs),
+    "completions_per_sec": sum(stub.requests for stub in stubs) / duration if duration else None,
+    "round_latency_s": percentiles(stats.round_latency),
+    "pose_ack_latency_s": percentiles(stats.ack_latency),
+    "loop_lag_s": percentiles(monitor.samples),
+    "discord_api_calls": sum(channel.api_calls for channel in stats.channels),
+    # Calls past Discord's per-channel budget, which would have drawn a 429
+    "discord_over_limit": sum(channel.rate_limited for channel in stats.channels),
+    "backend_peak_inflight": [stub.peak_inflight for stub in stubs],
+    "scheduler": roleplay.scheduler.stats(),
+    "pool": roleplay.pool.stats(),
+    "workers": roleplay.workers.stats() if roleplay.workers else None,
+    "errors": stats.errors[:20],
+    "error_count": len(stats.errors),
+  }
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+  parser = argparse.ArgumentParser(prog="python -m bench.load", description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument("--channels", type=int, default=100)
+  parser.add_argument("--guilds", type=int, default=10, help="channels are spread round-robin over this many guilds")
+  parser.add_argument("--players", type=int, default=2, help="players per channel")
+  parser.add_argument("--npcs", type=int, default=3, help="AI characters per channel")
+  parser.add_argument("--rounds", type=int, default=5, help="pose rounds per channel")
+  parser.add_argument("--mode", choices=["sequential", "parallel"], default="sequential")
+  parser.add_argument("--stream", action="store_true", help="stream AI poses into placeholder messages")
+  parser.add_argument("--workers", type=int, default=0, help="render prompts in this many worker processes")
+  parser.add_argument("--summaries", action="store_true", help="keep background scene summaries enabled")
+  parser.add_argument("--think-time", type=float, default=0.5, help="max seconds a player waits before posing")
+  parser.add_argument("--ramp", type=float, default=2.0, help="channels join over this many seconds")
+  parser.add_argument("--discord-latency", type=float, default=0.0, help="simulated seconds per Discord API call")
+  parser.add_argument("--discord-rate-limit", action="store_true", help="make calls past Discord's per-channel limit wait, as after a 429")
+  parser.add_argument("--backends", type=int, default=1, help="stub completion servers")
+  parser.add_argument("--max-inflight", type=int, default=8, help="concurrent completions per backend")
+  parser.add_argument("--max-queue", type=int, default=1024)
+  parser.add_argument("--max-queue-per-channel", type=int, default=8)
+  parser.add_argument("--ttft", type=float, default=0.3, help="stub time to first token, seconds")
+  parser.add_argument("--tokens-per-sec", type=float, default=40.0)
+  parser.add_argument("--tokens", type=int, default=60, help="tokens per completion")
+  parser.add_argument("--error-rate", type=float, default=0.0, help="share of stub requests answered with a 503")
+  parser.add_argument("--seed", type=int, default=1)
+  parser.add_argument("-o", "--output", help="write the JSON report here instead of stdout")
+  parser.add_argument("--keep", action="store_true", help="keep the scratch workspace")
+  args = parser.parse_args(argv)
+
+  workspace = make_workspace()
+  cwd = os.getcwd()
+  os.chdir(workspace)
+  sys.path.insert(0, ROOT)
+  try:
+    # The handlers print prompts and diagnostics; keep them out of the report
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+      results = asyncio.run(run(args, workspace))
+  finally:
+    os.chdir(cwd)
+    if not args.keep:
+      shutil.rmtree(workspace, ignore_errors=True)
+
+  report = {
+    "meta": {
+      "revision": git_revision(),
+      "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+      "python": platform.python_version(),
+      "platform": platform.platform(),
+      "config": vars(args),
+    },
+    "results": results,
+  }
+  latency = results["round_latency_s"]
+  lag = results["loop_lag_s"]
+  print(
+    f"{results['rounds']} rounds in {results['duration_s']:.1f}s ({results['rounds_per_sec']:.2f}/s, "
+    f"{results['completions_per_sec']:.2f} completions/s); round latency "
+    f"p50 {latency['p50'] or 0:.2f}s p95 {latency['p95'] or 0:.2f}s p99 {latency['p99'] or 0:.2f}s; "
+    f"loop lag p99 {(lag['p99'] or 0) * 1000:.1f}ms max {(lag['max'] or 0) * 1000:.1f}ms; "
+    f"{results['discord_api_calls']} Discord calls, {results['discord_over_limit']} over the rate limit; "
+    f"{results['error_count']} errors",
+    file=sys.stderr,
+  )
+
+  if args.output:
+    with open(args.output, "w") as f:
+      json.dump(report, f, indent=2)
+  else:
+    json.dump(report, sys.stdout, indent=2)
+    print()
+  return 1 if results["error_count"] else 0
+
+
+if __name__ == "__main__":
+  sys.exit(main())
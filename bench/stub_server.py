@@ -0,0 +1,107 @@
+import asyncio
+import json
+import random
+from typing import Optional
+
+from aiohttp import web
+
+WORDS = "she steps closer and the lantern light catches on the blade as rain drums against the shutters".split()
+
+
+class StubCompletionServer:
+  """
+  A local stand-in for the OpenAI-style /v1/completions endpoint.
+
+  Every completion waits *ttft* seconds before its first token and then
+  produces *tokens_per_sec* tokens (one word each) until it has *tokens*.
+  Non-streamed requests get the whole text once it is done, like a real
+  server would. `inflight` and `peak_inflight` show how hard the bot pushes.
+
+  Faults can be injected, also while it runs: *error_rate* of the requests
+  (health probes included) are answered with a 503, and every request first
+  stalls for *stall* seconds, to run into the client's timeout.
+  """
+
+  def __init__(
+    self,
+    *,
+    ttft: float = 0.3,
+    tokens_per_sec: float = 40.0,
+    tokens: int = 60,
+    seed: Optional[int] = None,
+    error_rate: float = 0.0,
+    stall: float = 0.0,
+  ):
+    self.ttft = ttft
+    self.tokens_per_sec = tokens_per_sec
+    self.tokens = tokens
+    self.rng = random.Random(seed)
+    self.error_rate = error_rate
+    self.stall = stall
+    self.errors = 0
+    self.requests = 0
+    self.inflight = 0
+    self.peak_inflight = 0
+    self.runner: Optional[web.AppRunner] = None
+    self.port: Optional[int] = None
+
+  @property
+  def url(self) -> str:
+    return f"http://127.0.0.1:{self.port}"
+
+  def _words(self):
+    return [self.rng.choice(WORDS) + " " for _ in range(self.tokens)]
+
+  async def _fault(self) -> Optional[web.Response]:
+    """The injected failure for this request, if it gets one."""
+    if self.stall:
+      await asyncio.sleep(self.stall)
+    if self.error_rate and self.rng.random() < self.error_rate:
+      self.errors += 1
+      return web.json_response({"error": "injected failure"}, status=503)
+    return None
+
+  async def completions(self, request: web.Request) -> web.StreamResponse:
+    body = await request.json()
+    self.requests += 1
+    fault = await self._fault()
+    if fault is not None:
+      return fault
+    self.inflight += 1
+    self.peak_inflight = max(self.peak_inflight, self.inflight)
+    try:
+      words = self._words()
+      await asyncio.sleep(self.ttft)
+      if not body.get("stream"):
+        await asyncio.sleep(len(words) / self.tokens_per_sec)
+        return web.json_response({"choices": [{"text": "".join(words) + "<POSE_END>"}]})
+
+      response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+      await response.prepare(request)
+      for word in words:
+        await response.write(f"data: {json.dumps({'choices': [{'text': word}]})}\n\n".encode())
+        await asyncio.sleep(1 / self.tokens_per_sec)
+      await response.write(b"data: [DONE]\n\n")
+      return response
+    finally:
+      self.inflight -= 1
+
+  async def models(self, request: web.Request) -> web.Response:
+    fault = await self._fault()
+    if fault is not None:
+      return fault
+    return web.json_response({"object": "list", "data": [{"id": "stub"}]})
+
+  async def start(self, port: int = 0):
+    app = web.Application()
+    app.router.add_post("/v1/completions", self.completions)
+    app.router.add_get("/v1/models", self.models)
+    self.runner = web.AppRunner(app, access_log=None)
+    await self.runner.setup()
+    site = web.TCPSite(self.runner, "127.0.0.1", port)
+    await site.start()
+    self.port = site._server.sockets[0].getsockname()[1]
+
+  async def stop(self):
+    if self.runner:
+      await self.runner.cleanup()
@@ -0,0 +1,55 @@
+import gc
+import statistics
+import time
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+
+def measure(fn: Callable[[], Any], *, repeat: int = 5, min_time: float = 0.05, number: Optional[int] = None) -> Dict[str, Any]:
+  """
+  Time *fn* timeit-style: call it *number* times per run, *repeat* runs, and
+  report per-call times in microseconds. When *number* isn't given it is
+  raised until one run takes at least *min_time* seconds.
+  """
+  if number is None:
+    number = 1
+    while True:
+      elapsed = _run(fn, number)
+      if elapsed >= min_time or number >= 1_000_000:
+        break
+      number = number * 10 if elapsed < min_time / 10 else number * 2
+
+  runs = [_run(fn, number) / number * 1e6 for _ in range(repeat)]
+  median = statistics.median(runs)
+  return {
+    "number": number,
+    "repeat": repeat,
+    "best_us": min(runs),
+    "median_us": median,
+    "mean_us": statistics.fmean(runs),
+    "stdev_us": statistics.stdev(runs) if len(runs) > 1 else 0.0,
+    "ops_per_sec": 1e6 / median if median else None,
+  }
+
+
+def _run(fn: Callable[[], Any], number: int) -> float:
+  # Keep collector pauses out of the measurement, like timeit does
+  gc_was_enabled = gc.isenabled()
+  gc.disable()
+  try:
+    start = time.perf_counter()
+    for _ in range(number):
+      fn()
+    return time.perf_counter() - start
+  finally:
+    if gc_was_enabled:
+      gc.enable()
+
+
+def percentiles(samples: Sequence[float], points: Sequence[int] = (50, 95, 99)) -> Dict[str, Optional[float]]:
+  """Nearest-rank percentiles of *samples*, plus the max, keyed p50/p95/.../max."""
+  ordered: List[float] = sorted(samples)
+  if not ordered:
+    return {**{f"p{p}": None for p in points}, "max": None}
+  result = {f"p{p}": ordered[min(len(ordered) - 1, max(0, -(-p * len(ordered) // 100) - 1))] for p in points}
+  result["max"] = ordered[-1]
+  return result
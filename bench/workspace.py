@@ -0,0 +1,25 @@
+import os
+import shutil
+import subprocess
+import tempfile
+from typing import Optional
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# What the modules under test read relative to the working directory
+WORKSPACE_FILES = ["model.yml", "default_template.txt"]
+
+
+def git_revision() -> Optional[str]:
+  try:
+    return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+  except (OSError, subprocess.CalledProcessError):
+    return None
+
+
+def make_workspace() -> str:
+  """A throwaway working directory with an empty data/ and copies of the config files."""
+  workspace = tempfile.mkdtemp(prefix="storyteller-bench-")
+  os.makedirs(os.path.join(workspace, "data"))
+  for name in WORKSPACE_FILES:
+    shutil.copy(os.path.join(ROOT, name), workspace)
+  return workspace
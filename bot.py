@@ -1,24 +1,124 @@
-from typing import List, Sequence
+import time
+# Before anything heavy is imported, so the import phase is measured too
+_started = time.perf_counter()
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+from contextlib import contextmanager
+from typing import Dict, Optional
+
 import discord
-import yaml
-import re
-import random
-from db import db
-from client import AgentClient
 from discord.ext import commands
 
-from narrative.session_state import PoseRoundInfo, SessionModel, get_session
-from narrative.models import Character, Message, Scene
+from db import async_db, db
 from commands import characters, general, roleplay, scene
-from template import Template
-from utils.text import trim_pose, chunk_by_words
+from outbound import outbox
+from utils.metrics import STARTUP, start_metrics_server
+
+# application id -> hash of the command tree last synced for it. Delete the
+# file to force a sync.
+COMMAND_TREE_STATE = 'data/command_tree.json'
+
+
+def command_tree_hash(tree: discord.app_commands.CommandTree) -> str:
+  """Fingerprint of the global commands, exactly as they'd be sent to Discord."""
+  payload = [command.to_dict(tree) for command in tree.get_commands()]
+  # Registration order doesn't matter to Discord
+  payload.sort(key=lambda c: (c.get("type", 1), c["name"]))
+  return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
 
 class NymphoBot(commands.Bot):
+  metrics_server = None
+  sync_task: Optional[asyncio.Task] = None
+  # When setup_hook finished; cleared by the first on_ready
+  setup_done: Optional[float] = None
+
+  def __init__(self, *args, **kwargs):
+    super().__init__(*args, **kwargs)
+    # phase -> seconds, reported once the bot is first ready
+    self.startup: Dict[str, float] = {}
+
+  @contextmanager
+  def startup_phase(self, phase: str):
+    started = time.perf_counter()
+    try:
+      yield
+    finally:
+      self.startup[phase] = time.perf_counter() - started
+      STARTUP.observe(self.startup[phase], phase=phase)
+
   async def setup_hook(self):
-    await characters.setup(self)
-    await general.setup(self)
-    await scene.setup(self)
-    await roleplay.setup(self)
+    with self.startup_phase("services"):
+      db.start()
+      roleplay.pool.start()
+      if roleplay.workers:
+        roleplay.workers.start()
+      metrics_cfg = roleplay.cfg.get("metrics", {})
+      if metrics_cfg.get("enabled"):
+        self.metrics_server = await start_metrics_server(metrics_cfg.get("host", "127.0.0.1"), metrics_cfg.get("port", 9108))
+    with self.startup_phase("commands"):
+      await characters.setup(self)
+      await general.setup(self)
+      await scene.setup(self)
+      await roleplay.setup(self)
+    # Only talks to the REST API, so it runs while the gateway connects
+    self.sync_task = asyncio.create_task(self.sync_commands())
+    self.setup_done = time.perf_counter()
+
+  async def sync_commands(self):
+    """Sync the global command tree, unless Discord already has this exact one."""
+    with self.startup_phase("sync"):
+      digest = command_tree_hash(self.tree)
+      try:
+        with open(COMMAND_TREE_STATE, "r") as f:
+          synced = json.load(f)
+      except (FileNotFoundError, ValueError):
+        synced = {}
+      key = str(self.application_id)
+      if synced.get(key) == digest:
+        logging.info("Command tree unchanged since the last sync; not syncing")
+        return
+
+      try:
+        registered = await self.tree.sync()
+      except discord.HTTPException:
+        # Left unrecorded, so the next start tries again
+        logging.exception("Syncing the command tree failed")
+        return
+      synced[key] = digest
+      with open(COMMAND_TREE_STATE + ".tmp", "w") as f:
+        json.dump(synced, f)
+      os.replace(COMMAND_TREE_STATE + ".tmp", COMMAND_TREE_STATE)
+      logging.info(f"Synced {len(registered)} global commands")
+
+  def report_startup(self):
+    """Log how long each phase of startup took; once, on the first READY."""
+    if self.setup_done is None:
+      return
+    self.startup["connect"] = time.perf_counter() - self.setup_done
+    STARTUP.observe(self.startup["connect"], phase="connect")
+    self.setup_done = None
+    phases = ", ".join(f"{phase} {seconds:.2f}s" for phase, seconds in self.startup.items())
+    logging.info(f"Ready {time.perf_counter() - _started:.2f}s after start ({phases})")
+
+  async def close(self):
+    if self.sync_task:
+      self.sync_task.cancel()
+    await asyncio.gather(*(roleplay.stop_round(channel_id) for channel_id in list(roleplay.rounds)))
+    await roleplay.summarizer.close()
+    await roleplay.pool.close()
+    if roleplay.workers:
+      await roleplay.workers.close()
+    if self.metrics_server:
+      await self.metrics_server.cleanup()
+    await outbox.close()
+    await super().close()
+    await db.stop()
+    async_db.close()
 
 intents = discord.Intents.default()
 intents.message_content = True
@@ -26,9 +126,11 @@ intents.dm_messages = True
 intents.guild_messages = True
 intents.messages = True
 discord_bot = NymphoBot(command_prefix="!", intents=intents)
+discord_bot.startup["import"] = time.perf_counter() - _started
+STARTUP.observe(discord_bot.startup["import"], phase="import")
 
 @discord_bot.event
 async def on_ready():
+    # Fires again on every reconnect; the command tree is synced in setup_hook
     print(f'Bot connected as {discord_bot.user}')
-    synced = await discord_bot.tree.sync()
-    print(f"Synced {len(synced)} global commands")
\ No newline at end of file
+    discord_bot.report_startup()
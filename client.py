@@ -1,9 +1,9 @@
+import asyncio
+import json as jsonlib
 import logging
-from typing import Any, Dict, Optional
+from typing import Any, AsyncIterator, Dict, List, Optional
 
-import requests
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
+import aiohttp
 
 
 class AgentClient:
@@ -23,6 +23,11 @@ class AgentClient:
         :param status_forcelist: HTTP status codes that should trigger a retry
         :param timeout: default socket timeout for connect/read (in seconds)
         """
+        # Imported here so the bot, which only uses AsyncAgentClient, doesn't pay for requests
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+
         self.base_url = base_url.rstrip("/")
         self.timeout = timeout
         status_forcelist = status_forcelist or [429, 500, 502, 503, 504]
@@ -51,6 +56,8 @@ class AgentClient:
         headers: Optional[Dict[str, str]] = None,
         timeout: Optional[float] = None,
     ) -> Any:
+        import requests
+
         url = f"{self.base_url}/{path.lstrip('/')}"
         try:
             resp = self.session.request(
@@ -90,3 +97,213 @@ class AgentClient:
 
     def delete(self, path: str, **kwargs) -> Any:
         return self.request("DELETE", path, **kwargs)
+
+
+class AsyncAgentClient:
+    """
+    asyncio-native counterpart of AgentClient.
+
+    One instance owns a single aiohttp connection pool, so create it once per
+    process and share it; every coroutine awaiting a request yields back to the
+    event loop, letting many channels' generations be in flight at once.
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        *,
+        retries: int = 3,
+        backoff_factor: float = 0.3,
+        status_forcelist: Optional[list] = None,
+        timeout: float = 360.0,
+        max_connections: int = 100,
+    ):
+        """
+        :param base_url: root URL for your API (e.g. "https://api.example.com/v1")
+        :param retries: number of total retry attempts
+        :param backoff_factor: sleep multiplier between retries (e.g. 0.3s, 0.6s, 1.2s…)
+        :param status_forcelist: HTTP status codes that should trigger a retry
+        :param timeout: default total timeout for a request (in seconds)
+        :param max_connections: size of the shared connection pool
+        """
+        self.base_url = base_url.rstrip("/")
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self.status_forcelist = set(status_forcelist or [429, 500, 502, 503, 504])
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        # The session has to be created from inside a running loop, so build it
+        # lazily on first use rather than at import time.
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.max_connections),
+            )
+        return self._session
+
+    def _backoff(self, attempt: int, resp: Optional[aiohttp.ClientResponse] = None) -> float:
+        # Honour Retry-After like urllib3 does, otherwise back off exponentially
+        if resp is not None:
+            retry_after = resp.headers.get("Retry-After")
+            if retry_after:
+                try:
+                    return float(retry_after)
+                except ValueError:
+                    pass
+        return self.backoff_factor * (2 ** attempt)
+
+    async def _send(
+        self,
+        method: str,
+        url: str,
+        *,
+        client_timeout: aiohttp.ClientTimeout,
+        read_body: bool,
+        **kwargs,
+    ) -> aiohttp.ClientResponse:
+        """
+        Issue a request with the retry policy applied and return the response.
+
+        With read_body the whole body is read inside the retry loop (so read
+        timeouts are retried too); otherwise the response is handed back with
+        its body unread and the caller must release it.
+        """
+        session = self._get_session()
+        for attempt in range(self.retries + 1):
+            last_attempt = attempt == self.retries
+            resp = None
+            try:
+                resp = await session.request(method, url, timeout=client_timeout, **kwargs)
+                if resp.status in self.status_forcelist and not last_attempt:
+                    logging.warning(f"HTTP {resp.status} for {url}, retrying ({attempt + 1}/{self.retries})")
+                    resp.release()
+                    await asyncio.sleep(self._backoff(attempt, resp))
+                    continue
+                if resp.status >= 400:
+                    body = await resp.text()
+                    logging.error(f"HTTP error {resp.status} for {url}: {body}")
+                    resp.raise_for_status()
+                if read_body:
+                    await resp.read()
+                return resp
+            except asyncio.TimeoutError:
+                if resp is not None:
+                    resp.release()
+                if last_attempt:
+                    logging.exception(f"Timeout when calling {url}")
+                    raise
+                logging.warning(f"Timeout when calling {url}, retrying ({attempt + 1}/{self.retries})")
+            except aiohttp.ClientResponseError:
+                raise
+            except aiohttp.ClientError:
+                if resp is not None:
+                    resp.release()
+                if last_attempt:
+                    logging.exception(f"Error during request to {url}")
+                    raise
+                logging.warning(f"Error during request to {url}, retrying ({attempt + 1}/{self.retries})")
+            await asyncio.sleep(self._backoff(attempt))
+
+    async def request(
+        self,
+        method: str,
+        path: str,
+        *,
+        params: Optional[Dict[str, Any]] = None,
+        json: Optional[Dict[str, Any]] = None,
+        headers: Optional[Dict[str, str]] = None,
+        timeout: Optional[float] = None,
+    ) -> Any:
+        url = f"{self.base_url}/{path.lstrip('/')}"
+        resp = await self._send(
+            method,
+            url,
+            params=params,
+            json=json,
+            headers=headers,
+            client_timeout=aiohttp.ClientTimeout(total=timeout or self.timeout),
+            read_body=True,
+        )
+
+        # parse JSON (or return text if not JSON)
+        try:
+            return await resp.json(content_type=None)
+        except ValueError:
+            return await resp.text()
+
+    async def stream(
+        self,
+        method: str,
+        path: str,
+        *,
+        params: Optional[Dict[str, Any]] = None,
+        json: Optional[Dict[str, Any]] = None,
+        headers: Optional[Dict[str, str]] = None,
+        timeout: Optional[float] = None,
+    ) -> AsyncIterator[Any]:
+        """
+        Yield the `data:` events of a server-sent-events response as they
+        arrive, JSON-decoded when possible. Stops at the OpenAI-style
+        `[DONE]` sentinel. Retries only apply until the response headers are
+        in; once tokens are flowing a failure is raised to the caller.
+
+        :param timeout: maximum gap between two chunks (in seconds)
+        """
+        url = f"{self.base_url}/{path.lstrip('/')}"
+        resp = await self._send(
+            method,
+            url,
+            params=params,
+            json=json,
+            headers=headers,
+            client_timeout=aiohttp.ClientTimeout(total=None, sock_read=timeout or self.timeout),
+            read_body=False,
+        )
+
+        def decode(lines: List[str]) -> Any:
+            payload = "\n".join(lines)
+            try:
+                return jsonlib.loads(payload)
+            except ValueError:
+                return payload
+
+        try:
+            data: List[str] = []
+            async for raw in resp.content:
+                line = raw.decode("utf-8").rstrip("\r\n")
+                if not line:
+                    # A blank line terminates the event
+                    if data:
+                        if data == ["[DONE]"]:
+                            return
+                        yield decode(data)
+                        data = []
+                    continue
+                if line.startswith(":"):
+                    continue  # SSE comment / keep-alive
+                field, _, value = line.partition(":")
+                if field == "data":
+                    data.append(value[1:] if value.startswith(" ") else value)
+            if data and data != ["[DONE]"]:
+                yield decode(data)
+        finally:
+            resp.release()
+
+    async def get(self, path: str, **kwargs) -> Any:
+        return await self.request("GET", path, **kwargs)
+
+    async def post(self, path: str, **kwargs) -> Any:
+        return await self.request("POST", path, **kwargs)
+
+    async def put(self, path: str, **kwargs) -> Any:
+        return await self.request("PUT", path, **kwargs)
+
+    async def delete(self, path: str, **kwargs) -> Any:
+        return await self.request("DELETE", path, **kwargs)
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
@@ -2,10 +2,12 @@ from discord import Interaction, app_commands
 from discord.ext import commands
 from narrative.models import CharacterTemplate, Scene, Setting
 from typing import Any, Mapping, Type
-from db import db
+from db import async_db
+from narrative.template_cache import template_cache
+from utils.metrics import report
 
 ALLOWED_FIELDS: Mapping[Type[Any], set[str]] = {
-    CharacterTemplate: {"personality", "physical_description", "author_notes"},
+    CharacterTemplate: {"personality", "physical_description", "author_notes", "nicknames"},
     # Scene:             {"summary", "notes"},          # example – adjust
     # Setting:           {"value"},                     # example – adjust
 }
@@ -30,7 +32,7 @@ async def set_model_field(
     # ------------------------------------------------------------------
     # 1. Locate the record.  (Characters first, then others)
     # ------------------------------------------------------------------
-    target: Any | None = db.get_character_template_by_id_or_name(
+    target: Any | None = await async_db.get_character_template_by_id_or_name(
         user_id, id_or_name
     )
     model_cls: Type[Any] | None = CharacterTemplate if target else None
@@ -38,7 +40,7 @@ async def set_model_field(
     # Add more resolvers if you want to support other types via name/ID:
     if target is None:  # maybe it's a Scene ID?
         from narrative.models import Scene
-        target = db.get_by_id(Scene, id_or_name)
+        target = await async_db.get_by_id(Scene, id_or_name)
         if target:
             model_cls = Scene
 
@@ -65,12 +67,29 @@ async def set_model_field(
     # 3. Mutate & persist
     # ------------------------------------------------------------------
     setattr(target, field, value)
-    db.update(target)
+    await async_db.update(target)
+    if model_cls is CharacterTemplate:
+        # Characters in live scenes read through the shared template cache;
+        # replacing the entry keeps them from reloading it on the event loop
+        template_cache.put(target)
 
     await interaction.response.send_message(
         f"✅ **{field}** updated on *{getattr(target, 'name', target.id)}*.",
         ephemeral=True,
     )
 
+@app_commands.command(
+    name="stats",
+    description="Show latency and cache statistics for the bot."
+)
+@app_commands.default_permissions(administrator=True)
+async def show_stats(interaction: Interaction):
+    text = report() or "No statistics collected yet."
+    # Keep within Discord's 2000 character message limit
+    if len(text) > 1990 - 8:
+        text = text[:1990 - 8 - 2] + "\n…"
+    await interaction.response.send_message(f"```\n{text}\n```", ephemeral=True)
+
 async def setup(bot: commands.Bot):
-  bot.tree.add_command(set_model_field, guild=None)
\ No newline at end of file
+  bot.tree.add_command(set_model_field, guild=None)
+  bot.tree.add_command(show_stats, guild=None)
\ No newline at end of file
@@ -1,20 +1,61 @@
+import asyncio
+import logging
 import random
-import re
-from typing import List
-from discord import Interaction, app_commands
+from typing import Any, AsyncIterator, Dict, List
+from discord import HTTPException, Interaction, app_commands
 from discord.ext import commands
-import yaml
-from client import AgentClient
-from db import db
+from inference.pool import NoBackendAvailable, pool_from_config
+from inference.scheduler import InferenceScheduler, QueueFull, Ticket
+from inference.workers import WorkerCrashed, workers_from_config
+from db import async_db
+from narrative.mentions import mention_index
 from narrative.models import Character, Message, Scene
-from narrative.session_state import PoseRoundInfo, SessionModel, get_session
+from narrative.session_state import PoseRoundInfo, SessionModel, SessionState, get_session, session_cache
+from narrative.prompt import completion_request, pose_context, prompt_builder_from_config
+from narrative.summarizer import SceneSummarizer
+from outbound import outbox
 from template import Template
+from utils.config import load_config
+from utils.text import trim_pose
+from utils.metrics import PROMPT_RENDER, PROMPT_TOKENS, metrics
 
-with open("model.yml", "r") as f:
-    cfg = yaml.safe_load(f)
+cfg = load_config()
 template = Template.from_file("default_template.txt")
 
-WORD_RE = re.compile(r"\w+")
+# Fit the history to the model's context window, leaving room for the reply
+prompt_builder = prompt_builder_from_config(cfg, template)
+
+# Every completion waits its turn here, round-robin across guilds and channels
+scheduler = InferenceScheduler(**cfg.get("scheduler", {}))
+# The completion backends, shared by the whole process. The scheduler lets
+# through as many generations as the healthy backends can take.
+pool = pool_from_config(cfg, on_capacity_change=scheduler.set_capacity)
+metrics.collector(scheduler.collect)
+metrics.collector(pool.collect)
+# With `workers:` enabled, prompts are rendered in separate processes
+workers = workers_from_config(cfg, messages_root=async_db.message_log.root)
+if workers:
+  metrics.collector(workers.collect)
+streaming = {"enabled": False, "edit_interval": 1.5, **cfg.get("streaming", {})}
+
+rounds_cfg = {"max_parallel": 4, **cfg.get("rounds", {})}
+
+summary_cfg = {"enabled": False, **cfg.get("summary", {})}
+summarizer = SceneSummarizer(
+  pool,
+  scheduler=scheduler,
+  **{k: v for k, v in summary_cfg.items() if k != "enabled"}
+)
+
+async def completion_chunks(events: AsyncIterator[Any]) -> AsyncIterator[str]:
+  """Pull the generated text out of streamed /v1/completions events."""
+  async for event in events:
+    if isinstance(event, dict) and event.get("choices"):
+      text = event["choices"][0].get("text")
+      if text:
+        yield text
+
+
 def activate_natural_order(scene: Scene, last_messages: List[Message]) -> List[Character]:
   """
   Decide which characters in *scene* will speak this turn.
@@ -22,10 +63,6 @@ def activate_natural_order(scene: Scene, last_messages: List[Message]) -> List[C
   The function returns a list of **Character** objects, in the order they
   should speak.
   """
-  def _extract_all_words(text: str) -> List[str]:
-    """Split text into lower-case words (same rule the JS used)."""
-    return WORD_RE.findall(text.lower())
-  
   characters = []
   for member in scene.characters:        # or whatever list of Character objects you have
     if member.played_by is None:
@@ -41,18 +78,11 @@ def activate_natural_order(scene: Scene, last_messages: List[Message]) -> List[C
   # ──────────────────────────────────────────────────────────────────────────
   # 2.  Mention-based activation 
   # ──────────────────────────────────────────────────────────────────────────
+  mentions = mention_index(scene, characters)
   for message in last_messages:
     #  if not message.is_player:
     #     continue
-     input_text = message.content
-     for word in _extract_all_words(input_text):
-        for char in characters:
-          if char.id == message.character_id:
-            continue # Don't check NPC messages to see if they refer to themselves
-          if word in _extract_all_words(char.name):
-            activated.append(char)
-            break
-      
+    activated.extend(mentions.mentioned(message))
 
   # ──────────────────────────────────────────────────────────────────────────
   # 3.  Talkativeness-based activation  (each member gets a random roll)
@@ -90,6 +120,220 @@ def activate_natural_order(scene: Scene, last_messages: List[Message]) -> List[C
   return unique_characters
 
 
+def build_request(scene: Scene, character: Character) -> dict:
+  """
+  The /v1/completions body for *character*'s next pose in *scene*. May page
+  history in from disk, so handlers run it on the storage thread.
+  """
+  # await set_status('```Generating a response...```')
+  prompt = prompt_builder.build(scene, pose_context(scene, character))
+  logging.debug(prompt)
+  return completion_request(scene, prompt, cfg["generation"])
+
+async def render_request(scene: Scene, character: Character) -> dict:
+  """build_request, on a worker process if there are any, otherwise on the storage thread."""
+  if workers:
+    try:
+      reply = await workers.render(scene, character)
+      PROMPT_RENDER.observe(reply["seconds"])
+      PROMPT_TOKENS.observe(reply["tokens"])
+      return reply["request"]
+    except WorkerCrashed as e:
+      # Don't lose the round over it
+      logging.warning(f"{e}; rendering in-process instead")
+  return await async_db.run(build_request, scene, character)
+
+async def show_queue_position(channel, ticket: Ticket):
+  """Keep a status line with the queue position up while a generation waits."""
+  key = f"queue-{id(ticket)}"
+  try:
+    outbox.set_status(channel, key, f"⏳ Waiting for the storyteller... (position {ticket.position} in queue)")
+    while True:
+      await asyncio.sleep(5)
+      outbox.set_status(channel, key, f"⏳ Waiting for the storyteller... (position {ticket.position} in queue, {ticket.wait_time:.0f}s so far)")
+  finally:
+    outbox.clear_status(channel, key)
+
+async def generate(channel, guild_id, request: dict) -> str:
+  async with scheduler.slot(channel.id, guild_id, on_queued=lambda ticket: show_queue_position(channel, ticket)):
+    response = await pool.post('/v1/completions', json=request)
+  return trim_pose(response['choices'][0]['text'])
+
+async def generate_streamed(channel, guild_id, character: Character, request: dict, placeholder) -> str:
+  """Stream *character*'s pose into *placeholder*. If this fails, the caller takes the placeholder down."""
+  from messages import stream_emote
+  async with scheduler.slot(channel.id, guild_id, on_queued=lambda ticket: show_queue_position(channel, ticket)):
+    chunks = completion_chunks(pool.stream('POST', '/v1/completions', json={**request, "stream": True}))
+    text = await stream_emote(channel, character.name, chunks, message=placeholder,
+                              edit_interval=streaming["edit_interval"], transform=trim_pose)
+  return trim_pose(text)
+
+
+def last_round(scene: Scene) -> List[Message]:
+  """
+  Return the tail of the scene's history consisting of:
+    • the most-recent contiguous block of player messages (is_player == True)
+    • followed by any contiguous NPC messages after them (is_player == False)
+  Stop before the next earlier player message.
+
+  The returned list keeps chronological order.
+  """
+  collected: List[Message] = []
+  seen_npc = False            # flips to True once we hit the first NPC line
+
+  # walk backward through the log
+  for msg in scene.iter_messages_reversed():
+    if msg.is_player:
+      if seen_npc:        # we hit an earlier player turn → done
+        break
+      collected.append(msg)
+    else:                   # NPC / system message
+      seen_npc = True
+      collected.append(msg)
+  collected.reverse()         # restore chronological order
+  return collected
+
+
+# channel id -> the AI characters' round being played out there
+rounds: Dict[int, asyncio.Task] = {}
+
+def start_round(channel, guild_id, session: SessionState, scene: Scene) -> asyncio.Task:
+  """
+  Play the AI characters' turns in *channel* in the background. If a round
+  is already running there, that one is returned and no other is started.
+  """
+  task = rounds.get(channel.id)
+  if task is not None and not task.done():
+    logging.warning(f"A round is already running in channel {channel.id}; not starting another")
+    return task
+  task = asyncio.get_running_loop().create_task(play_round(channel, guild_id, session, scene))
+  rounds[channel.id] = task
+  # The round holds on to this session; it has to stay the cached one
+  session_cache.pin(channel.id)
+  return task
+
+async def stop_round(channel_id: int) -> bool:
+  """Cancel the round running in a channel and wait for it to wind down; False if none was."""
+  task = rounds.pop(channel_id, None)
+  if task is None or task.done():
+    return False
+  task.cancel()
+  await asyncio.gather(task, return_exceptions=True)
+  return True
+
+async def play_turns(channel, guild_id, session: SessionState, active_scene: Scene):
+  """Generate, post and record the AI characters' poses for this round."""
+  from messages import placeholder_emote, send_pose
+  # Walking back through the history may page it in from disk
+  activated = activate_natural_order(active_scene, await async_db.run(last_round, active_scene))
+  try:
+    if active_scene.generation_mode == "parallel" and len(activated) > 1:
+      # Everyone answers the same snapshot of the round at once; poses are
+      # still posted and recorded in activation order.
+      requests = await asyncio.gather(*(render_request(active_scene, character) for character in activated))
+      limit = asyncio.Semaphore(rounds_cfg["max_parallel"])
+
+      async def limited(coro):
+        async with limit:
+          return await coro
+
+      placeholders = []
+      if streaming["enabled"]:
+        placeholders = [await placeholder_emote(channel, character.name) for character in activated]
+        generations = [
+          asyncio.ensure_future(limited(generate_streamed(channel, guild_id, character, request, placeholder)))
+          for character, request, placeholder in zip(activated, requests, placeholders)
+        ]
+      else:
+        generations = [asyncio.ensure_future(limited(generate(channel, guild_id, request))) for request in requests]
+
+      posted = 0
+      try:
+        for character, generation in zip(activated, generations):
+          message = Message(character_id=character.id, character_name=character.name, content=await generation, is_player=False)
+          if not streaming["enabled"]:
+            await send_pose(channel, message)
+          await async_db.append_message(active_scene, message)
+          await async_db.update(active_scene)
+          session.last_bot_message = message
+          posted += 1
+      finally:
+        for generation in generations:
+          generation.cancel()
+        # Collect every outcome so the ones that failed after the first
+        # failure aren't logged as "Task exception was never retrieved"
+        await asyncio.gather(*generations, return_exceptions=True)
+        # Poses that didn't make it into the scene: still coming, cancelled,
+        # failed (g.exception() is not None), or finished after one that failed
+        unfinished = placeholders[posted:]
+        await asyncio.gather(*(outbox.delete(channel, p) for p in unfinished), return_exceptions=True)
+    else:
+      # Each character sees the poses of the ones before it
+      for character in activated:
+        request = await render_request(active_scene, character)
+        if streaming["enabled"]:
+          # Post a placeholder right away and fill it in as tokens arrive
+          placeholder = await placeholder_emote(channel, character.name)
+          try:
+            full_text = await generate_streamed(channel, guild_id, character, request, placeholder)
+          except BaseException:
+            # Failed or cancelled; nothing is coming for this placeholder
+            await asyncio.gather(outbox.delete(channel, placeholder), return_exceptions=True)
+            raise
+          message = Message(character_id=character.id, character_name=character.name, content=full_text, is_player=False)
+        else:
+          full_text = await generate(channel, guild_id, request)
+          message = Message(character_id=character.id, character_name=character.name, content=full_text, is_player=False)
+          await send_pose(channel, message)
+
+        await async_db.append_message(active_scene, message)
+        await async_db.update(active_scene)
+        session.last_bot_message = message
+  except QueueFull as e:
+    # Shed the round rather than queueing without bound
+    await outbox.send(channel, f"⚠️ The storyteller is overloaded right now ({e.reason}). Please pose again in a little while.")
+  except NoBackendAvailable:
+    await outbox.send(channel, "⚠️ The storyteller is unreachable right now. Please pose again in a little while.")
+
+
+async def play_round(channel, guild_id, session: SessionState, active_scene: Scene):
+  """
+  The AI characters' turns after the last player posed: their poses go to
+  *channel* through the outbox, and the next round opens once they're in.
+  Cancelled by /scene stop, which also takes down poses still on their way.
+  """
+  try:
+    try:
+      await play_turns(channel, guild_id, session, active_scene)
+    except Exception:
+      # Whatever went wrong, the players must be able to pose again
+      logging.exception(f"The round in channel {channel.id} failed")
+      try:
+        await outbox.send(channel, "⚠️ Something went wrong while the storyteller was posing. Please pose again.")
+      except HTTPException:
+        logging.exception(f"Failed to report the failed round in channel {channel.id}")
+
+    # We're done responding so now we can reset the new pose round, unless
+    # the scene was stopped in the meantime (cancelling never gets here)
+    if session.round is not None:
+      session.round = PoseRoundInfo()
+      for c in active_scene.characters:
+        if c.played_by:
+          session.round.waiting_for_users.append(c.played_by)
+      await async_db.update(SessionModel(**session.model_dump()))
+    # End of the round: write everything it touched in one batch
+    await async_db.flush()
+
+    # Use the lull before the next round to fold old history into the summary
+    if summary_cfg["enabled"]:
+      summarizer.schedule(active_scene)
+  finally:
+    if rounds.get(channel.id) is asyncio.current_task():
+      del rounds[channel.id]
+    if channel.id not in rounds:
+      session_cache.unpin(channel.id)
+
+
 @app_commands.command(
     name="emote",
     description="Do an action as your character."
@@ -103,8 +347,12 @@ async def emote(
   interaction: Interaction,
   pose: str
 ):
-  session = get_session(interaction.channel_id)
+  # Discord gives up on an interaction that isn't answered within 3 seconds;
+  # the pose itself follows up on this
+  await interaction.response.defer()
+  session = await get_session(interaction.channel_id)
   if not session.round:
+      await interaction.delete_original_response()
       return
   
   # We are in a running scene and someone may have just posed.
@@ -112,83 +360,31 @@ async def emote(
   char = session.get_user_character(interaction.user.id)
   if not char:
     print(f"{interaction.user.name} does not currently have a character; ignoring...")
+    await interaction.delete_original_response()
     return # They don't have a character; ignore them
   
   if interaction.user.id not in session.round.waiting_for_users:
       print(f"{interaction.user.name} already has made a pose this order; ignoring...")
+      await interaction.delete_original_response()
       return
   
+  # Claim the pose, and the round if it's the last one, before anything is
+  # awaited: two last poses at once must not both start the AI turns
+  session.round.waiting_for_users.remove(interaction.user.id)
+  last_pose = not session.round.waiting_for_users
+
   active_scene = session.active_scene()
   new_message = Message(character_id=char.id, character_name=char.name, content=pose, is_player=True)
-  active_scene.messages.append(new_message)
+  await async_db.append_message(active_scene, new_message)
   await send_emote(interaction, new_message)
-  session.round.waiting_for_users.remove(interaction.user.id)
-
-  db.update(active_scene)
+  await async_db.update(active_scene)
 
-  if session.round.waiting_for_users:
+  if not last_pose:
     return
   
-  # Time for the AIs to respond
-  def last_round(messages: List[Message]) -> List[Message]:
-    """
-    Return the tail of *messages* consisting of:
-      • the most-recent contiguous block of player messages (is_player == True)
-      • followed by any contiguous NPC messages after them (is_player == False)
-    Stop before the next earlier player message.
-
-    The returned list keeps chronological order.
-    """
-    collected: List[Message] = []
-    seen_npc = False            # flips to True once we hit the first NPC line
-
-    # walk backward through the log
-    for msg in reversed(messages):
-      if msg.is_player:
-        if seen_npc:        # we hit an earlier player turn → done
-          break
-        collected.append(msg)
-      else:                   # NPC / system message
-        seen_npc = True
-        collected.append(msg)
-    collected.reverse()         # restore chronological order
-    return collected
-  
-  client = AgentClient("http://192.168.1.50:5000", retries=5, backoff_factor=0.5)
-  for character in activate_natural_order(active_scene, last_round(active_scene.messages)):
-    # await set_status('```Generating a response...```')
-    users = "Lily"
-    prompt = template.render({
-      "characters": active_scene.characters,
-      "acting_character": character,
-      "messages": active_scene.messages,
-      "users": users
-    })
-
-    stopping_strings = ['###', '\n***', '<END_POSE>', '\n\n']
-    for c in active_scene.characters:
-      stopping_strings.append(f'{c.name}:')
-    print(prompt)
-
-    response = client.post('/v1/completions', headers={"x-api-key": '<your token here>'}, json={
-      "prompt": prompt,
-      "stopping_strings": stopping_strings,
-      "model": "Eurydice-24b-v2",
-      **cfg["generation"]
-    })
-
-    full_text = trim_pose(response['choices'][0]['text'])
-    message = Message(character_id=character.id, character_name=character.name, content=full_text, is_player=False)
-    active_scene.messages.append(message)
-    db.update(active_scene)
-    session.last_bot_message = send_emote(interaction, message)
-  
-  # We're done responding so now we can reset the new pose round
-  session.round = PoseRoundInfo()
-  for c in active_scene.characters:
-    if c.played_by:
-      session.round.waiting_for_users.append(c.played_by)
-  db.update(SessionModel(**session.model_dump()))
+  # Time for the AIs to respond. That takes far longer than an interaction
+  # lives, so it happens in the channel, in the background.
+  start_round(interaction.channel, interaction.guild_id, session, active_scene)
   
   
 async def setup(bot: commands.Bot):
@@ -6,18 +6,20 @@ from narrative.session_state import PoseRoundInfo, get_session
 
 from discord import app_commands, Interaction
 from discord.ext import commands
-from db import db
+from commands.roleplay import stop_round
+from db import async_db
+from narrative.template_cache import template_cache
 
 class SceneCommands(app_commands.Group):
   @app_commands.command(name="info", description="Shows current scene information")
   async def info(self, interaction: Interaction):
-    session = get_session(interaction.channel.id)
+    session = await get_session(interaction.channel.id)
     scene = session.active_scene()
     await interaction.response.send_message(embed=scene_embed(session, scene), ephemeral=True)
 
   @app_commands.command(name="start", description="Starts recording for the scene")
   async def start(self, interaction: Interaction):
-    session = get_session(interaction.channel.id)
+    session = await get_session(interaction.channel.id)
     if session.round:
       await interaction.response.send_message(f"The scene is already running.", ephemeral=True)
       return
@@ -26,27 +28,47 @@ class SceneCommands(app_commands.Group):
     for c in session.active_scene().characters:
       if c.played_by:
         session.round.waiting_for_users.append(c.played_by)
-    db.update(session)
+    await async_db.update(session)
     await interaction.response.send_message(f"The scene is now running.")    
 
   @app_commands.command(name="stop", description="Stops recording the current scene")
   async def stop(self, interaction: Interaction):
-    session = get_session(interaction.channel.id)
+    session = await get_session(interaction.channel.id)
     if not session.round:
         await interaction.response.send_message(f"The scene is not currently running.", ephemeral=True)
         return
 
+    # The AI characters may be mid-pose and take a moment to stop
+    await interaction.response.defer()
+    # Before the round is cleared, so a round finishing meanwhile can't reopen it
+    await stop_round(interaction.channel.id)
     session.round = None
-    db.update(session)
-    await interaction.response.send_message(f"The scene is now stopped.")
+    await async_db.update(session)
+    await interaction.followup.send(f"The scene is now stopped.")
+
+  @app_commands.command(name="mode", description="Choose how AI characters take their turns")
+  @app_commands.describe(mode="sequential: each sees the previous pose; parallel: all answer at once")
+  @app_commands.choices(mode=[
+    app_commands.Choice(name="sequential", value="sequential"),
+    app_commands.Choice(name="parallel", value="parallel"),
+  ])
+  async def mode(self, interaction: Interaction, mode: app_commands.Choice[str]):
+    session = await get_session(interaction.channel.id)
+    active_scene = session.active_scene()
+    if not active_scene:
+      await interaction.response.send_message("❌ There is no currently active scene.", ephemeral=True)
+      return
+    active_scene.generation_mode = mode.value
+    await async_db.update(active_scene)
+    await interaction.response.send_message(f"AI characters now take their turns in **{mode.value}** mode.")
 
   @app_commands.command(name="add", description="Adds a character to the scene")
   async def add(self, interaction: Interaction, name_or_id: str):
-    char_template = db.get_character_template_by_id_or_name(interaction.user.id, name_or_id)
+    char_template = await async_db.get_character_template_by_id_or_name(interaction.user.id, name_or_id)
     if not char_template:
       await interaction.response.send_message(f"❌ Character **{name_or_id}** not found.", ephemeral=True)
       return
-    session = get_session(interaction.channel.id)
+    session = await get_session(interaction.channel.id)
     active_scene = session.active_scene()
     if not active_scene:
       await interaction.response.send_message(f"❌ There is no currently active scene.", ephemeral=True)
@@ -54,9 +76,10 @@ class SceneCommands(app_commands.Group):
     # if char in active_scene.active_characters:
     #   await interaction.response.send_message(f"❌ Character **{char.name}** is already in the scene.", ephemeral=True)
     #   return
+    template_cache.put(char_template)
     char = Character(template_id=char_template.id)
     active_scene.characters.append(char)
-    db.update(active_scene)
+    await async_db.update(active_scene)
     await interaction.response.send_message(f"Added **{char_template.name}** to current scene.")
 
 
@@ -1,6 +1,16 @@
-from typing import Optional, Type, TypeVar, List
+import json
+import os
+import sqlite3
+import threading
+from typing import Dict, Optional, Set, Type, TypeVar, List
 from tinydb import TinyDB, Query
 from narrative.models import Character, CharacterTemplate, DatabaseModel
+from storage.async_storage import AsyncStorage
+from storage.message_log import MessageLog
+from storage.serialization import Codec, Stored, format_of, get_codec, load_document, load_model
+from storage.tables import TABLE_NAMES, table_name_for
+from storage.write_behind import WriteBehindProvider
+from utils.config import load_config
 
 T = TypeVar('T', bound=DatabaseModel)
 
@@ -12,33 +22,20 @@ class DatabaseProvider:
       "settings": TinyDB('data/settings.json'),
       "sessions": TinyDB('data/sessions.json'),
       "narratives": TinyDB('data/narratives.json')
-    }        
+    }
 
   def _get_table(self, model_cls: Type[T]) -> TinyDB:
-    match model_cls.__name__:
-      case "CharacterTemplate":
-        return self.tables["characters"]
-      case "Scene":
-        return self.tables["scenes"]
-      case "Setting":
-        return self.tables["settings"]
-      case "SessionModel":
-        return self.tables["sessions"]
-      case "SessionState":
-        return self.tables["sessions"]
-      case "Narrative":
-        return self.tables["narratives"]
-    raise ValueError(f"No table registered for model: {model_cls.__name__}")
+    return self.tables[table_name_for(model_cls)]
 
   def insert(self, model: T) -> str:
     table = self._get_table(type(model))
     table.insert(model.model_dump())
     return model.id
-  
+
   def get_available_characters(self, user_id: int) -> List[T]:
     Q = Query()
     return [CharacterTemplate(**doc) for doc in self.tables["characters"].search((Q.creator_id == user_id))]
-  
+
   def get_character_template_by_id_or_name(self, user_id: int, user_name_id: str) -> Optional[T]:
     Q = Query()
     doc = self.tables["characters"].get((Q.creator_id == user_id) & ((Q.id == user_name_id) | (Q.name == user_name_id)))
@@ -50,15 +47,233 @@ class DatabaseProvider:
       doc = table.get(Q.id == uuid_val)
       if doc:
         return model_cls(**doc)
-  
+
+  def get_many_by_id(self, model_cls: Type[T], uuid_vals: List[str]) -> List[T]:
+    Q = Query()
+    return [model_cls(**doc) for doc in self._get_table(model_cls).search(Q.id.one_of(uuid_vals))]
+
+  def get_by_channel(self, model_cls: Type[T], channel_id: int) -> Optional[T]:
+    Q = Query()
+    doc = self._get_table(model_cls).get(Q.channel_id == channel_id)
+    return model_cls(**doc) if doc else None
+
   def update(self, model: T) -> bool:
     Q = Query()
     table = self._get_table(type(model))
     return bool(table.update(model.model_dump(), Q.id == model.id))
 
-  def insert(self, model: T) -> int:
-    table = self._get_table(type(model))
-    table.insert(model.model_dump())
+
+class SqliteDatabaseProvider:
+  """
+  SQLite-backed drop-in for DatabaseProvider.
+
+  Every table shares one layout: the model document plus a few columns
+  pulled out of it purely so they can be indexed. Updates rewrite a single
+  row instead of the whole file, and lookups hit an index instead of
+  scanning every document.
+
+  Documents are stored in each table's format (see storage.serialization);
+  any format can be read back, so changing a table's format needs no
+  migration step: rows switch over as they are rewritten, or all at once
+  with `reencode()`.
+  """
+
+  SCHEMA = """
+    CREATE TABLE IF NOT EXISTS {table} (
+      id         TEXT PRIMARY KEY,
+      channel_id INTEGER,
+      creator_id INTEGER,
+      name       TEXT,
+      doc        TEXT NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS {table}_channel_id ON {table} (channel_id);
+    CREATE INDEX IF NOT EXISTS {table}_creator_id ON {table} (creator_id);
+    CREATE INDEX IF NOT EXISTS {table}_creator_name ON {table} (creator_id, name);
+  """
+
+  def __init__(self, path: str = 'data/storyteller.db', *, formats: Optional[Dict[str, str]] = None, default_format: str = 'json'):
+    """
+    :param formats: table name -> storage format, e.g. {"scenes": "orjson+zlib"};
+                    tables not listed use *default_format*
+    """
+    self.path = path
+    # A single connection guarded by a lock; callers may come from more than
+    # one thread, so sqlite's own same-thread check is turned off.
+    self.lock = threading.RLock()
+    self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+    self.conn.execute("PRAGMA journal_mode=WAL")
+    self.conn.execute("PRAGMA synchronous=NORMAL")
+    tables = sorted(set(TABLE_NAMES.values()))
+    for table in tables:
+      self.conn.executescript(self.SCHEMA.format(table=table))
+    formats = formats or {}
+    self.codecs: Dict[str, Codec] = {table: get_codec(formats.get(table, default_format)) for table in tables}
+
+  def _row(self, table: str, doc: dict) -> tuple:
+    return (doc["id"], doc.get("channel_id"), doc.get("creator_id"), doc.get("name"), self.codecs[table].encode(doc))
+
+  def _fetch_one(self, sql: str, params: tuple) -> Optional[Stored]:
+    with self.lock:
+      row = self.conn.execute(sql, params).fetchone()
+    return row[0] if row else None
+
+  def insert(self, model: T) -> str:
+    table = table_name_for(type(model))
+    with self.lock:
+      self.conn.execute(f"INSERT INTO {table} (id, channel_id, creator_id, name, doc) VALUES (?, ?, ?, ?, ?)", self._row(table, model.model_dump()))
     return model.id
 
-db = DatabaseProvider()
\ No newline at end of file
+  def get_available_characters(self, user_id: int) -> List[T]:
+    with self.lock:
+      rows = self.conn.execute("SELECT doc FROM characters WHERE creator_id = ? ORDER BY rowid", (user_id,)).fetchall()
+    return [load_model(CharacterTemplate, doc) for (doc,) in rows]
+
+  def get_character_template_by_id_or_name(self, user_id: int, user_name_id: str) -> Optional[T]:
+    # Two indexed probes (primary key, then creator+name) instead of an OR
+    # that sqlite can only answer with the creator_id index plus a filter.
+    doc = self._fetch_one(
+      "SELECT doc FROM characters WHERE rowid IN ("
+      "  SELECT rowid FROM characters WHERE id = ? AND creator_id = ?"
+      "  UNION ALL"
+      "  SELECT rowid FROM characters WHERE creator_id = ? AND name = ?"
+      ") ORDER BY rowid LIMIT 1",
+      (user_name_id, user_id, user_id, user_name_id)
+    )
+    return load_model(CharacterTemplate, doc) if doc else None
+
+  def get_by_id(self, model_cls: Type[T], uuid_val: str) -> Optional[T]:
+    doc = self._fetch_one(f"SELECT doc FROM {table_name_for(model_cls)} WHERE id = ?", (uuid_val,))
+    return load_model(model_cls, doc) if doc else None
+
+  def get_many_by_id(self, model_cls: Type[T], uuid_vals: List[str]) -> List[T]:
+    if not uuid_vals:
+      return []
+    placeholders = ", ".join("?" for _ in uuid_vals)
+    with self.lock:
+      rows = self.conn.execute(
+        f"SELECT doc FROM {table_name_for(model_cls)} WHERE id IN ({placeholders})",
+        tuple(uuid_vals)
+      ).fetchall()
+    return [load_model(model_cls, doc) for (doc,) in rows]
+
+  def get_by_channel(self, model_cls: Type[T], channel_id: int) -> Optional[T]:
+    doc = self._fetch_one(
+      f"SELECT doc FROM {table_name_for(model_cls)} WHERE channel_id = ? ORDER BY rowid LIMIT 1",
+      (channel_id,)
+    )
+    return load_model(model_cls, doc) if doc else None
+
+  def existing_ids(self, table: str, uuid_vals: List[str]) -> Set[str]:
+    """Which of *uuid_vals* are stored in *table*."""
+    if not uuid_vals:
+      return set()
+    placeholders = ", ".join("?" for _ in uuid_vals)
+    with self.lock:
+      rows = self.conn.execute(f"SELECT id FROM {table} WHERE id IN ({placeholders})", tuple(uuid_vals)).fetchall()
+    return {id for (id,) in rows}
+
+  def update(self, model: T) -> bool:
+    return self.update_documents(table_name_for(type(model)), [model.model_dump()]) > 0
+
+  def update_documents(self, table: str, docs: List[dict]) -> int:
+    """Rewrite existing documents of *table* in one transaction; returns how many matched."""
+    touched = 0
+    with self.lock:
+      self.conn.execute("BEGIN")
+      try:
+        for doc in docs:
+          id, channel_id, creator_id, name, raw = self._row(table, doc)
+          cur = self.conn.execute(
+            f"UPDATE {table} SET channel_id = ?, creator_id = ?, name = ?, doc = ? WHERE id = ?",
+            (channel_id, creator_id, name, raw, id)
+          )
+          touched += cur.rowcount
+        self.conn.execute("COMMIT")
+      except:
+        self.conn.execute("ROLLBACK")
+        raise
+    return touched
+
+  def import_tinydb(self, data_dir: str = 'data') -> int:
+    """
+    One-shot import of the legacy TinyDB files (data/<table>.json).
+    Documents whose id already exists are replaced. Returns the number of
+    documents imported.
+    """
+    count = 0
+    with self.lock:
+      self.conn.execute("BEGIN")
+      try:
+        for table in sorted(set(TABLE_NAMES.values())):
+          path = os.path.join(data_dir, f"{table}.json")
+          if not os.path.exists(path) or os.path.getsize(path) == 0:
+            continue
+          with open(path, "r", encoding="utf-8") as f:
+            raw = json.load(f)
+          # TinyDB layout: {"<table name>": {"<doc id>": {...}, ...}, ...}
+          for docs in raw.values():
+            for doc in docs.values():
+              self.conn.execute(
+                f"INSERT OR REPLACE INTO {table} (id, channel_id, creator_id, name, doc) VALUES (?, ?, ?, ?, ?)",
+                self._row(table, doc)
+              )
+              count += 1
+        self.conn.execute("COMMIT")
+      except:
+        self.conn.execute("ROLLBACK")
+        raise
+    return count
+
+
+  def reencode(self, table: Optional[str] = None) -> int:
+    """
+    Rewrite every document of *table* (or of all tables) that isn't stored in
+    its table's current format. Returns how many were rewritten.
+    """
+    count = 0
+    for name in [table] if table else sorted(self.codecs):
+      codec = self.codecs[name]
+      with self.lock:
+        rows = self.conn.execute(f"SELECT doc FROM {name}").fetchall()
+      docs = [load_document(doc) for (doc,) in rows if format_of(doc) != codec.family]
+      if docs:
+        count += self.update_documents(name, docs)
+    return count
+
+def storage_config(path: str = 'model.yml') -> dict:
+  """The `storage:` section of model.yml, if there is one."""
+  try:
+    return load_config(path).get("storage") or {}
+  except FileNotFoundError:
+    return {}
+
+def open_database(path: str = 'data/storyteller.db') -> SqliteDatabaseProvider:
+  # Pull in the old JSON files the first time the database is created
+  is_new = not os.path.exists(path)
+  cfg = storage_config()
+  provider = SqliteDatabaseProvider(path, formats=cfg.get("formats"), default_format=cfg.get("default_format", "json"))
+  if is_new:
+    try:
+      provider.import_tinydb(os.path.dirname(path) or '.')
+    except BaseException:
+      # Otherwise the half-made database would be taken as done next start
+      # and the import never tried again
+      provider.conn.close()
+      for leftover in (path, path + "-wal", path + "-shm"):
+        if os.path.exists(leftover):
+          os.remove(leftover)
+      raise
+  return provider
+
+# Updates are buffered and journaled, then written in batches every couple of
+# seconds or when a round ends (db.flush()).
+_storage_cfg = storage_config()
+db = WriteBehindProvider(
+  open_database(),
+  journal_path=_storage_cfg.get("journal_path", 'data/journal.jsonl'),
+  flush_interval=_storage_cfg.get("flush_interval", 2.0),
+)
+message_log = MessageLog('data/messages', fsync=True)
+# What async code (the command handlers) should use: the same storage, with
+# every call run on the storage thread instead of the event loop.
+async_db = AsyncStorage(db, message_log)
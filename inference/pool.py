@@ -0,0 +1,271 @@
+import asyncio
+import logging
+import random
+import time
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional
+
+import aiohttp
+
+from client import AsyncAgentClient
+from utils.metrics import GENERATION, TIME_TO_FIRST_TOKEN
+
+
+class NoBackendAvailable(Exception):
+  """Every completion backend is down or has its circuit open."""
+
+
+def _is_backend_failure(e: BaseException) -> bool:
+  # 4xx means we sent something wrong; that's not the backend's fault
+  if isinstance(e, aiohttp.ClientResponseError):
+    return e.status >= 500 or e.status == 429
+  return isinstance(e, (asyncio.TimeoutError, aiohttp.ClientError))
+
+
+class Backend:
+  """One completion endpoint plus its health and load bookkeeping."""
+
+  def __init__(
+    self,
+    url: str,
+    *,
+    model: Optional[str] = None,
+    api_key: Optional[str] = None,
+    weight: float = 1.0,
+    max_inflight: int = 2,
+    retries: int = 1,
+    backoff_factor: float = 0.5,
+    timeout: float = 360.0,
+  ):
+    self.url = url
+    self.model = model
+    self.api_key = api_key
+    self.weight = weight
+    self.max_inflight = max_inflight
+    self.client = AsyncAgentClient(url, retries=retries, backoff_factor=backoff_factor, timeout=timeout)
+    self.outstanding = 0
+    self.failures = 0        # consecutive
+    self.open_until = 0.0    # circuit open (skipped) until this monotonic time
+    self.healthy = True      # whether the last health probe got through
+    self.requests = 0
+    self.errors = 0
+
+  @property
+  def available(self) -> bool:
+    return time.monotonic() >= self.open_until
+
+  @property
+  def load(self) -> float:
+    return (self.outstanding + 1) / self.weight
+
+  def headers(self, headers: Optional[Dict[str, str]]) -> Optional[Dict[str, str]]:
+    if not self.api_key:
+      return headers
+    return {"x-api-key": self.api_key, **(headers or {})}
+
+  def body(self, json: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    if json is None or not self.model:
+      return json
+    return {**json, "model": self.model}
+
+  def stats(self) -> dict:
+    return {
+      "url": self.url,
+      "available": self.available,
+      "healthy": self.healthy,
+      "outstanding": self.outstanding,
+      "consecutive_failures": self.failures,
+      "requests": self.requests,
+      "errors": self.errors,
+    }
+
+
+class BackendPool:
+  """
+  Spreads completions over several backends.
+
+  Requests go to the available backend with the fewest outstanding requests
+  relative to its weight. A backend that fails (5xx, 429, timeout, connection
+  error) *failure_threshold* times in a row has its circuit opened for
+  *cooldown* seconds; failed health probes count towards that too, and a
+  passing one closes the circuit again. After the cooldown the next request
+  is let through to try it, and a single failure reopens it. A failed request is retried on another backend, except for a
+  stream that has already produced tokens; once there is none left to try,
+  NoBackendAvailable is raised.
+
+  *on_capacity_change* is called with the summed max_inflight of the
+  available backends whenever that changes, so the scheduler can size its
+  in-flight limit to what the pool can actually serve.
+  """
+
+  def __init__(
+    self,
+    backends: List[Backend],
+    *,
+    health_path: str = '/v1/models',
+    health_interval: float = 15.0,
+    health_timeout: float = 5.0,
+    failure_threshold: int = 3,
+    cooldown: float = 30.0,
+    on_capacity_change: Optional[Callable[[int], None]] = None,
+  ):
+    if not backends:
+      raise ValueError("BackendPool needs at least one backend")
+    self.backends = backends
+    self.health_path = health_path
+    self.health_interval = health_interval
+    self.health_timeout = health_timeout
+    self.failure_threshold = failure_threshold
+    self.cooldown = cooldown
+    self.on_capacity_change = on_capacity_change
+    self._capacity: Optional[int] = None
+    self._health_task: Optional[asyncio.Task] = None
+    self._notify_capacity()
+
+  # ──────────────────────────────────────────────────────────────────────────
+  # Health
+  # ──────────────────────────────────────────────────────────────────────────
+  def capacity(self) -> int:
+    return sum(b.max_inflight for b in self.backends if b.available)
+
+  def _notify_capacity(self):
+    capacity = self.capacity()
+    if capacity != self._capacity:
+      self._capacity = capacity
+      if self.on_capacity_change:
+        self.on_capacity_change(capacity)
+
+  def record_success(self, backend: Backend):
+    backend.failures = 0
+    backend.healthy = True
+    backend.open_until = 0.0
+    self._notify_capacity()
+
+  def record_failure(self, backend: Backend):
+    backend.failures += 1
+    backend.errors += 1
+    if backend.failures >= self.failure_threshold:
+      if backend.available:
+        logging.warning(f"Opening circuit for {backend.url} after {backend.failures} consecutive failures")
+      backend.open_until = time.monotonic() + self.cooldown
+      # The capacity comes back when the cooldown is over, probes or not
+      asyncio.get_running_loop().call_later(self.cooldown, self._notify_capacity)
+    self._notify_capacity()
+
+  async def probe(self, backend: Backend):
+    try:
+      await backend.client.get(self.health_path, headers=backend.headers(None), timeout=self.health_timeout)
+    except Exception as e:
+      if backend.healthy:
+        logging.warning(f"Health check failed for {backend.url}: {e!r}")
+      backend.healthy = False
+      self.record_failure(backend)
+    else:
+      if not backend.available or not backend.healthy:
+        logging.info(f"{backend.url} is healthy again")
+      self.record_success(backend)
+
+  async def _run_health_checks(self):
+    while True:
+      await asyncio.gather(*(self.probe(b) for b in self.backends))
+      # Reopened circuits may have expired since the last change
+      self._notify_capacity()
+      await asyncio.sleep(self.health_interval)
+
+  def start(self):
+    """Start the periodic health probes on the running event loop."""
+    if self._health_task is None or self._health_task.done():
+      self._health_task = asyncio.get_running_loop().create_task(self._run_health_checks())
+
+  async def close(self):
+    if self._health_task is not None:
+      self._health_task.cancel()
+      self._health_task = None
+    for backend in self.backends:
+      await backend.client.close()
+
+  # ──────────────────────────────────────────────────────────────────────────
+  # Routing
+  # ──────────────────────────────────────────────────────────────────────────
+  def pick(self, exclude: Optional[set] = None) -> Backend:
+    candidates = [b for b in self.backends if b.available and b not in (exclude or ())]
+    if not candidates:
+      raise NoBackendAvailable("No completion backend is available")
+    best = min(b.load for b in candidates)
+    return random.choice([b for b in candidates if b.load == best])
+
+  async def request(self, method: str, path: str, *, json: Optional[Dict[str, Any]] = None, headers: Optional[Dict[str, str]] = None, **kwargs) -> Any:
+    tried: set = set()
+    while True:
+      backend = self.pick(tried)
+      backend.outstanding += 1
+      backend.requests += 1
+      started = time.perf_counter()
+      try:
+        result = await backend.client.request(method, path, json=backend.body(json), headers=backend.headers(headers), **kwargs)
+      except Exception as e:
+        if not _is_backend_failure(e):
+          raise
+        self.record_failure(backend)
+        tried.add(backend)
+        if not any(b.available and b not in tried for b in self.backends):
+          raise NoBackendAvailable(f"Every available completion backend failed; last was {backend.url}: {e!r}") from e
+        logging.warning(f"{backend.url} failed ({e!r}); retrying on another backend")
+        continue
+      finally:
+        backend.outstanding -= 1
+        GENERATION.observe(time.perf_counter() - started, backend=backend.url)
+      self.record_success(backend)
+      return result
+
+  async def post(self, path: str, **kwargs) -> Any:
+    return await self.request("POST", path, **kwargs)
+
+  async def stream(self, method: str, path: str, *, json: Optional[Dict[str, Any]] = None, headers: Optional[Dict[str, str]] = None, **kwargs) -> AsyncIterator[Any]:
+    tried: set = set()
+    while True:
+      backend = self.pick(tried)
+      backend.outstanding += 1
+      backend.requests += 1
+      started = False
+      requested = time.perf_counter()
+      try:
+        async for event in backend.client.stream(method, path, json=backend.body(json), headers=backend.headers(headers), **kwargs):
+          if not started:
+            started = True
+            TIME_TO_FIRST_TOKEN.observe(time.perf_counter() - requested, backend=backend.url)
+          yield event
+      except Exception as e:
+        if not _is_backend_failure(e):
+          raise
+        self.record_failure(backend)
+        tried.add(backend)
+        # Tokens already reached the user; we can't splice in another backend
+        if started:
+          raise NoBackendAvailable(f"{backend.url} failed mid-stream: {e!r}") from e
+        if not any(b.available and b not in tried for b in self.backends):
+          raise NoBackendAvailable(f"Every available completion backend failed; last was {backend.url}: {e!r}") from e
+        logging.warning(f"{backend.url} failed ({e!r}); retrying on another backend")
+        continue
+      finally:
+        backend.outstanding -= 1
+        GENERATION.observe(time.perf_counter() - requested, backend=backend.url)
+      self.record_success(backend)
+      return
+
+  def collect(self):
+    """Samples for utils.metrics."""
+    for b in self.backends:
+      labels = {"backend": b.url}
+      yield ("storyteller_backend_up", "gauge", "Whether a backend is taking requests", labels, int(b.available))
+      yield ("storyteller_backend_outstanding", "gauge", "Requests in flight to a backend", labels, b.outstanding)
+      yield ("storyteller_backend_requests_total", "counter", "Requests sent to a backend", labels, b.requests)
+      yield ("storyteller_backend_errors_total", "counter", "Failed requests to a backend", labels, b.errors)
+
+  def stats(self) -> List[dict]:
+    return [b.stats() for b in self.backends]
+
+
+def pool_from_config(cfg: dict, **kwargs) -> BackendPool:
+  """Build a pool from the `backends:` list and `pool:` section of model.yml."""
+  backends = [Backend(**entry) for entry in cfg.get("backends", [])]
+  return BackendPool(backends, **cfg.get("pool", {}), **kwargs)
@@ -0,0 +1,222 @@
+import asyncio
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable, Deque, Hashable, Optional
+
+from inference.pool import NoBackendAvailable
+from utils.metrics import QUEUE_WAIT
+
+
+class QueueFull(Exception):
+  """Raised when a generation can't be queued because the scheduler is saturated."""
+
+  def __init__(self, queued: int, reason: str):
+    super().__init__(reason)
+    self.queued = queued
+    self.reason = reason
+
+
+class Ticket:
+  """One generation waiting for (or holding) an inference slot."""
+
+  def __init__(self, scheduler: "InferenceScheduler", channel_id: Hashable, guild_id: Hashable):
+    self.scheduler = scheduler
+    self.channel_id = channel_id
+    self.guild_id = guild_id
+    self.enqueued_at = time.monotonic()
+    self.started_at: Optional[float] = None
+    self.granted = asyncio.get_running_loop().create_future()
+
+  @property
+  def position(self) -> int:
+    """1-based place in line; 0 once the generation is running."""
+    return self.scheduler.position(self)
+
+  @property
+  def wait_time(self) -> float:
+    """Seconds spent queued so far (or in total, once started)."""
+    return (self.started_at or time.monotonic()) - self.enqueued_at
+
+
+class InferenceScheduler:
+  """
+  Sits between the handlers and the completion backend.
+
+  At most *max_inflight* generations run at once; the rest wait in a bounded
+  queue. Waiting generations are granted round-robin, first across guilds,
+  then across the channels within a guild, so a few busy channels can't
+  starve everybody else. When the queue is full, new work is rejected with
+  QueueFull instead of piling up.
+  """
+
+  def __init__(self, *, max_inflight: int = 2, max_queue: int = 64, max_queue_per_channel: int = 8):
+    self.max_inflight = max_inflight
+    self.max_queue = max_queue
+    self.max_queue_per_channel = max_queue_per_channel
+    self.inflight = 0
+    # guild -> channel -> waiting tickets; both levels rotate for fairness
+    self.queues: OrderedDict[Hashable, OrderedDict[Hashable, Deque[Ticket]]] = OrderedDict()
+    self.queued = 0
+    # diagnostics
+    self.granted_total = 0
+    self.rejected_total = 0
+    self.wait_total = 0.0
+
+  # ──────────────────────────────────────────────────────────────────────────
+  # Queueing
+  # ──────────────────────────────────────────────────────────────────────────
+  def submit(self, channel_id: Hashable, guild_id: Hashable = None) -> Ticket:
+    if self.max_inflight <= 0:
+      raise NoBackendAvailable("No completion backend is available")
+    channel_queue = self.queues.get(guild_id, {}).get(channel_id)
+    if self.queued >= self.max_queue:
+      self.rejected_total += 1
+      raise QueueFull(self.queued, f"{self.queued} generations are already queued")
+    if channel_queue is not None and len(channel_queue) >= self.max_queue_per_channel:
+      self.rejected_total += 1
+      raise QueueFull(self.queued, f"this channel already has {len(channel_queue)} generations queued")
+
+    ticket = Ticket(self, channel_id, guild_id)
+    self.queues.setdefault(guild_id, OrderedDict()).setdefault(channel_id, deque()).append(ticket)
+    self.queued += 1
+    self._dispatch()
+    return ticket
+
+  def _remove(self, ticket: Ticket):
+    channels = self.queues.get(ticket.guild_id)
+    if not channels or ticket.channel_id not in channels:
+      return
+    queue = channels[ticket.channel_id]
+    try:
+      queue.remove(ticket)
+    except ValueError:
+      return
+    self.queued -= 1
+    if not queue:
+      del channels[ticket.channel_id]
+    if not channels:
+      del self.queues[ticket.guild_id]
+
+  def _next(self) -> Optional[Ticket]:
+    if not self.queues:
+      return None
+    # Serve the guild at the front, then send it (and its channel) to the back
+    guild_id, channels = next(iter(self.queues.items()))
+    channel_id, queue = next(iter(channels.items()))
+    ticket = queue.popleft()
+    self.queued -= 1
+    if queue:
+      channels.move_to_end(channel_id)
+    else:
+      del channels[channel_id]
+    if channels:
+      self.queues.move_to_end(guild_id)
+    else:
+      del self.queues[guild_id]
+    return ticket
+
+  def _dispatch(self):
+    while self.inflight < self.max_inflight:
+      ticket = self._next()
+      if ticket is None:
+        return
+      if ticket.granted.done():
+        continue  # cancelled while waiting
+      ticket.started_at = time.monotonic()
+      self.inflight += 1
+      self.granted_total += 1
+      self.wait_total += ticket.wait_time
+      ticket.granted.set_result(None)
+
+  def set_capacity(self, max_inflight: int):
+    """
+    Change the in-flight limit, e.g. when backends come and go. At 0 nothing
+    could ever be granted, so everyone waiting gets NoBackendAvailable.
+    """
+    self.max_inflight = max_inflight
+    if max_inflight <= 0:
+      while (ticket := self._next()) is not None:
+        if not ticket.granted.done():
+          ticket.granted.set_exception(NoBackendAvailable("No completion backend is available"))
+    self._dispatch()
+
+  def release(self, ticket: Ticket):
+    if ticket.started_at is not None:
+      self.inflight -= 1
+    self._dispatch()
+
+  def position(self, ticket: Ticket) -> int:
+    if ticket.started_at is not None:
+      return 0
+    # Replay the round-robin order on a copy of the queues
+    queues = OrderedDict((g, OrderedDict((c, deque(q)) for c, q in channels.items())) for g, channels in self.queues.items())
+    position = 0
+    while queues:
+      guild_id, channels = next(iter(queues.items()))
+      channel_id, queue = next(iter(channels.items()))
+      position += 1
+      if queue.popleft() is ticket:
+        return position
+      if queue:
+        channels.move_to_end(channel_id)
+      else:
+        del channels[channel_id]
+      if channels:
+        queues.move_to_end(guild_id)
+      else:
+        del queues[guild_id]
+    return 0
+
+  # ──────────────────────────────────────────────────────────────────────────
+  # Public API
+  # ──────────────────────────────────────────────────────────────────────────
+  @asynccontextmanager
+  async def slot(
+    self,
+    channel_id: Hashable,
+    guild_id: Hashable = None,
+    *,
+    on_queued: Optional[Callable[[Ticket], Awaitable[Any]]] = None,
+  ):
+    """
+    Hold an inference slot for the duration of the block. Raises QueueFull if
+    the request can't even be queued, and NoBackendAvailable while there are
+    no backends to run it on. *on_queued* is started (as a task) when
+    the request has to wait, and cancelled once the slot is granted.
+    """
+    ticket = self.submit(channel_id, guild_id)
+    watcher = None
+    if not ticket.granted.done() and on_queued:
+      watcher = asyncio.ensure_future(on_queued(ticket))
+    try:
+      try:
+        await ticket.granted
+      finally:
+        if watcher:
+          watcher.cancel()
+      QUEUE_WAIT.observe(ticket.wait_time)
+      yield ticket
+    finally:
+      if ticket.started_at is None:
+        ticket.granted.cancel()
+        self._remove(ticket)
+      self.release(ticket)
+
+  def collect(self):
+    """Samples for utils.metrics."""
+    yield ("storyteller_inference_inflight", "gauge", "Generations running against the backends", {}, self.inflight)
+    yield ("storyteller_inference_queued", "gauge", "Generations waiting for a slot", {}, self.queued)
+    yield ("storyteller_inference_granted_total", "counter", "Generations granted a slot", {}, self.granted_total)
+    yield ("storyteller_inference_rejected_total", "counter", "Generations turned away because the queue was full", {}, self.rejected_total)
+
+  def stats(self) -> dict:
+    return {
+      "inflight": self.inflight,
+      "max_inflight": self.max_inflight,
+      "queued": self.queued,
+      "max_queue": self.max_queue,
+      "granted": self.granted_total,
+      "rejected": self.rejected_total,
+      "mean_wait": self.wait_total / self.granted_total if self.granted_total else 0.0,
+    }
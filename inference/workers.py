@@ -0,0 +1,313 @@
+"""
+Prompt rendering in separate worker processes.
+
+Rendering a prompt is the CPU-heavy part of a round: walking the history,
+running the template and counting tokens. With `workers:` enabled in
+model.yml, the bot hands each pose's render to one of a few worker
+processes instead of doing it on its own storage thread. That keeps that
+work from competing with gateway handling, and uses more than one core.
+
+A job carries the scene document, the cast's templates and the acting
+character; the worker reads the history straight from the message log. Each
+scene always goes to the same worker, so its rendered-history cache stays
+warm between poses. Completions, Discord sends and persistence stay in the
+bot, where the scheduler, the backend pool and the write-behind buffer live.
+
+If a worker dies, it is restarted and the jobs it had are sent again; a job
+that keeps killing workers fails with WorkerCrashed so the caller can render
+it in-process instead. Run as `python -m inference.workers` to be a worker;
+nothing in this module may import db, since the bot owns the database.
+"""
+import asyncio
+import itertools
+import json
+import logging
+import os
+import sys
+import time
+import traceback
+import zlib
+from typing import Dict, List, Optional
+
+from narrative.models import Character, CharacterTemplate, Scene
+from storage.serialization import json_dumps
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class WorkerError(Exception):
+  """A worker couldn't render a job."""
+
+
+class WorkerCrashed(WorkerError):
+  """A job's worker died every time it was tried."""
+
+
+class _Job:
+  __slots__ = ("id", "line", "future", "attempts")
+
+  def __init__(self, id: int, line: bytes, future: asyncio.Future):
+    self.id = id
+    self.line = line
+    self.future = future
+    self.attempts = 0
+
+
+class _Worker:
+  """One worker process, restarted whenever it exits, and the jobs sent to it."""
+
+  def __init__(self, index: int, command: List[str], env: Dict[str, str], *, max_attempts: int, restart_delay: float):
+    self.index = index
+    self.command = command
+    self.max_attempts = max_attempts
+    self.restart_delay = restart_delay
+    self.env = env
+    self.process: Optional[asyncio.subprocess.Process] = None
+    self.pending: Dict[int, _Job] = {}
+    # Jobs are written straight away only while a process is up and has been
+    # sent everything pending; otherwise the next start sends them.
+    self.running = False
+    self.closing = False
+    self.task: Optional[asyncio.Task] = None
+    self.crashes = 0         # consecutive, reset by a finished job
+    self.restarts = 0
+    self.completed = 0
+
+  def start(self):
+    self.task = asyncio.get_running_loop().create_task(self._run())
+
+  def submit(self, job: _Job):
+    self.pending[job.id] = job
+    if self.running:
+      self._write(job)
+
+  def _write(self, job: _Job):
+    job.attempts += 1
+    try:
+      self.process.stdin.write(job.line)
+    except (BrokenPipeError, ConnectionResetError):
+      pass  # it's exiting; _run sends the job again
+
+  def kill(self):
+    if self.process and self.process.returncode is None:
+      self.process.kill()
+
+  async def _run(self):
+    while not self.closing:
+      self.process = await asyncio.create_subprocess_exec(
+        *self.command,
+        stdin=asyncio.subprocess.PIPE,
+        stdout=asyncio.subprocess.PIPE,
+        env=self.env,
+        # A rendered prompt is one line; the default 64 KiB limit is too small
+        limit=64 * 1024 * 1024,
+      )
+      for job in list(self.pending.values()):
+        self._write(job)
+      self.running = True
+
+      await self._read()
+      self.running = False
+      code = await self.process.wait()
+      if self.closing:
+        break
+
+      self.crashes += 1
+      self.restarts += 1
+      logging.warning(f"Generation worker {self.index} exited with code {code}; restarting it with {len(self.pending)} jobs")
+      for job in list(self.pending.values()):
+        if job.attempts >= self.max_attempts:
+          del self.pending[job.id]
+          if not job.future.done():
+            job.future.set_exception(WorkerCrashed(f"Generation worker {self.index} died {job.attempts} times on this job"))
+      # Don't spin if it dies on startup
+      await asyncio.sleep(min(self.restart_delay * 2 ** (self.crashes - 1), 30.0))
+
+  async def _read(self):
+    while True:
+      try:
+        line = await self.process.stdout.readline()
+      except (ValueError, asyncio.LimitOverrunError):
+        logging.exception(f"Generation worker {self.index} sent an unreadable reply")
+        self.kill()
+        return
+      if not line:
+        return
+      reply = json.loads(line)
+      job = self.pending.pop(reply["id"], None)
+      if job is None or job.future.done():
+        continue
+      self.crashes = 0
+      self.completed += 1
+      if "error" in reply:
+        job.future.set_exception(WorkerError(reply["error"]))
+      else:
+        job.future.set_result(reply)
+
+  async def close(self):
+    self.closing = True
+    self.running = False
+    if self.process and self.process.returncode is None:
+      # End of input tells it to exit
+      self.process.stdin.close()
+      try:
+        await asyncio.wait_for(self.process.wait(), 5.0)
+      except asyncio.TimeoutError:
+        self.process.kill()
+    if self.task:
+      self.task.cancel()
+      await asyncio.gather(self.task, return_exceptions=True)
+    for job in self.pending.values():
+      job.future.cancel()
+    self.pending.clear()
+
+  def stats(self) -> dict:
+    return {
+      "alive": self.running,
+      "pending": len(self.pending),
+      "completed": self.completed,
+      "restarts": self.restarts,
+    }
+
+
+class GenerationWorkers:
+  """
+  A fixed set of worker processes that render completion requests.
+
+  `render()` is awaited from handlers just like `async_db.run(build_request,
+  ...)` would be; a job that runs past *timeout* gets its worker killed, and
+  so retried on the restarted one. If it runs past *timeout* there as well,
+  it fails with WorkerCrashed.
+  """
+
+  def __init__(self, processes: int = 2, *, messages_root: str = 'data/messages', max_attempts: int = 2, timeout: float = 60.0, restart_delay: float = 0.5):
+    self.timeout = timeout
+    command = [sys.executable, "-m", "inference.workers", messages_root]
+    # Same source as the bot, whatever directory it runs in (model.yml and
+    # data/ are found relative to it, like in the bot)
+    env = {**os.environ, "PYTHONPATH": os.pathsep.join(filter(None, [ROOT, os.environ.get("PYTHONPATH")]))}
+    self.workers = [_Worker(i, command, env, max_attempts=max_attempts, restart_delay=restart_delay) for i in range(processes)]
+    self.ids = itertools.count()
+
+  def start(self):
+    for worker in self.workers:
+      worker.start()
+
+  async def close(self):
+    await asyncio.gather(*(worker.close() for worker in self.workers))
+
+  def worker_for(self, scene_id: str) -> _Worker:
+    return self.workers[zlib.crc32(scene_id.encode()) % len(self.workers)]
+
+  async def render(self, scene: Scene, character: Character) -> dict:
+    """
+    Render *character*'s next pose in *scene* on the scene's worker. Returns
+    the reply: the completion `request`, plus the `seconds` the render took
+    and the prompt's `tokens`.
+    """
+    templates = [c._template for c in scene.characters]
+    payload = {
+      "scene": scene.model_dump(),
+      "templates": [t.model_dump() for t in templates if t is not None],
+      "character_id": character.id,
+    }
+    job_id = next(self.ids)
+    job = _Job(job_id, (json_dumps({"id": job_id, **payload}) + "\n").encode(), asyncio.get_running_loop().create_future())
+    worker = self.worker_for(scene.id)
+    worker.submit(job)
+    try:
+      try:
+        return await asyncio.wait_for(asyncio.shield(job.future), self.timeout)
+      except asyncio.TimeoutError:
+        logging.warning(f"Generation worker {worker.index} took over {self.timeout}s on a job; restarting it")
+        worker.kill()
+      # Resent to the restarted worker; if it hangs there too, give up on it
+      try:
+        return await asyncio.wait_for(asyncio.shield(job.future), self.timeout)
+      except asyncio.TimeoutError:
+        worker.kill()
+        raise WorkerCrashed(f"Generation worker {worker.index} hung twice on a job") from None
+    finally:
+      worker.pending.pop(job_id, None)
+
+  def collect(self):
+    """Samples for utils.metrics."""
+    for worker in self.workers:
+      labels = {"worker": str(worker.index)}
+      yield ("storyteller_worker_up", "gauge", "Whether a generation worker process is running", labels, int(worker.running))
+      yield ("storyteller_worker_pending", "gauge", "Jobs sent to a generation worker and not answered yet", labels, len(worker.pending))
+      yield ("storyteller_worker_jobs_total", "counter", "Jobs a generation worker finished", labels, worker.completed)
+      yield ("storyteller_worker_restarts_total", "counter", "Times a generation worker had to be restarted", labels, worker.restarts)
+
+  def stats(self) -> List[dict]:
+    return [worker.stats() for worker in self.workers]
+
+
+def workers_from_config(cfg: dict, **kwargs) -> Optional[GenerationWorkers]:
+  """Build the workers from model.yml's `workers:` section; None unless it's enabled."""
+  workers_cfg = {"enabled": False, **cfg.get("workers", {})}
+  if not workers_cfg.pop("enabled"):
+    return None
+  return GenerationWorkers(**workers_cfg, **kwargs)
+
+
+# ──────────────────────────────────────────────────────────────────────────
+# The worker process
+# ──────────────────────────────────────────────────────────────────────────
+class _ShippedOnly:
+  """Template storage for a worker: whatever a job didn't ship doesn't exist."""
+
+  def get_by_id(self, model_cls, uuid_val):
+    return None
+
+  def get_many_by_id(self, model_cls, uuid_vals):
+    return []
+
+
+def serve(messages_root: str):
+  """Answer render jobs from stdin, one JSON line each, until stdin closes."""
+  from narrative.models import use_message_log
+  from narrative.prompt import completion_request, pose_context, prompt_builder_from_config
+  from narrative.template_cache import template_cache
+  from storage.message_log import MessageLog
+  from template import Template
+  from utils.config import load_config
+
+  # stdout carries replies; anything else printed goes to stderr
+  out, sys.stdout = sys.stdout, sys.stderr
+
+  cfg = load_config()
+  builder = prompt_builder_from_config(cfg, Template.from_file("default_template.txt"))
+  # Read-only; the bot does all the appending
+  log = MessageLog(messages_root)
+  use_message_log(log)
+  template_cache.storage = _ShippedOnly()
+
+  for line in sys.stdin:
+    job = json.loads(line)
+    try:
+      for doc in job["templates"]:
+        template_cache.put(CharacterTemplate.model_validate(doc))
+      # The bot's count is the truth; this also keeps the read-only log from
+      # ever touching a segment the bot may be appending to
+      log.counts[job["scene"]["id"]] = job["scene"]["message_count"]
+      scene = Scene.model_validate(job["scene"])
+      character = next(c for c in scene.characters if c.id == job["character_id"])
+
+      started = time.perf_counter()
+      prompt, tokens = builder.render(scene, pose_context(scene, character))
+      reply = {
+        "id": job["id"],
+        "request": completion_request(scene, prompt, cfg["generation"]),
+        "seconds": time.perf_counter() - started,
+        "tokens": tokens,
+      }
+    except Exception:
+      reply = {"id": job["id"], "error": traceback.format_exc()}
+    out.write(json_dumps(reply) + "\n")
+    out.flush()
+
+
+if __name__ == "__main__":
+  logging.basicConfig(level=logging.INFO)
+  serve(sys.argv[1] if len(sys.argv) > 1 else 'data/messages')
@@ -1,6 +1,14 @@
+import asyncio
+import logging
+import time
+from typing import AsyncIterator, Callable, List, Optional
+
 import discord
 from narrative.models import CharacterTemplate, Message, Scene
-from narrative.session_state import SessionState, get_session
+from narrative.session_state import SessionState
+from outbound import outbox
+from utils.metrics import DISCORD_SEND
+from utils.text import chunk_by_words
 
 
 def scene_embed(session: SessionState, scene: Scene, *, color: int = 0x5865F2) -> discord.Embed:
@@ -56,22 +64,106 @@ def character_embed(char: CharacterTemplate, *, color: int = 0x5865F2) -> discor
 
     return embed
 
-async def send_emote(interaction: discord.Interaction, message: Message):
-  embed = discord.Embed(
-    title=message.character_name,
-    # description=message.content
-    # description=f"```{message.content}```"
-  )
-
-  embed.add_field(name="Content", value=f"{message.content}", inline=False)
+# Discord caps an embed field at 1024 characters and a message's embeds at
+# 6000 in total, so a pose is split at word boundaries into fields, five to
+# an embed, and an embed to a message.
+FIELD_LIMIT = 1024
+FIELDS_PER_EMBED = 5
+MESSAGE_LIMIT = 2000
+
+def emote_embeds(character_name: str, content: str) -> List[discord.Embed]:
+  chunks = chunk_by_words(content, FIELD_LIMIT) or [STREAM_PLACEHOLDER]
+  embeds = []
+  for start in range(0, len(chunks), FIELDS_PER_EMBED):
+    embed = discord.Embed(
+      title=character_name if start == 0 else f"{character_name} (cont.)",
+      # description=message.content
+      # description=f"```{message.content}```"
+    )
+    for i, chunk in enumerate(chunks[start:start + FIELDS_PER_EMBED]):
+      # Field names can't be empty; continuations get a zero-width space
+      embed.add_field(name="Content" if start + i == 0 else "\u200b", value=chunk, inline=False)
+    # embed.set_thumbnail(url="https://cataas.com/cat")
+    embeds.append(embed)
+  return embeds
 
-  # embed.set_thumbnail(url="https://cataas.com/cat")
-  return await interaction.response.send_message(embed=embed, ephemeral=False)
+async def send_emote(interaction: discord.Interaction, message: Message):
+  """
+  Answer a player's /emote with their pose, as the follow-up if the
+  interaction was deferred; any continuation follows in the channel.
+  """
+  embeds = emote_embeds(message.character_name, message.content)
+  if interaction.response.is_done():
+    with DISCORD_SEND.time(op="followup"):
+      await interaction.followup.send(embed=embeds[0])
+  else:
+    with DISCORD_SEND.time(op="respond"):
+      await interaction.response.send_message(embed=embeds[0], ephemeral=False)
+  for embed in embeds[1:]:
+    await outbox.send(interaction.channel, embed=embed)
+
+async def send_pose(channel: discord.abc.Messageable, message: Message) -> discord.Message:
+  """Post an NPC's pose to *channel*, in order with everything else going there."""
+  sends = [outbox.send(channel, embed=embed) for embed in emote_embeds(message.character_name, message.content)]
+  return (await asyncio.gather(*sends))[0]
+
+# Discord allows roughly five message edits per 5 seconds per channel, so
+# streamed text is coalesced into at most one edit per interval.
+STREAM_PLACEHOLDER = "*…*"
+STREAM_EDIT_INTERVAL = 1.5
+
+async def placeholder_emote(channel: discord.abc.Messageable, character_name: str) -> discord.Message:
+  return await outbox.send(channel, embed=emote_embeds(character_name, "")[0])
+
+async def stream_emote(
+  channel: discord.abc.Messageable,
+  character_name: str,
+  chunks: AsyncIterator[str],
+  *,
+  message: Optional[discord.Message] = None,
+  edit_interval: float = STREAM_EDIT_INTERVAL,
+  transform: Callable[[str], str] = lambda text: text,
+) -> str:
+  """
+  Post a placeholder emote for *character_name* (or reuse *message*) and
+  progressively edit it as *chunks* arrive. *transform* is applied to the
+  accumulated text before it is shown (e.g. to hide stop tags). Whatever
+  doesn't fit the one message is posted after it once the stream ends.
+  Returns the full, untransformed text.
+  """
+  msg = message or await placeholder_emote(channel, character_name)
+  text = ""
+  shown = ""
+  # Allow the first tokens to show up right away rather than a full interval
+  # after the placeholder went out.
+  last_edit = 0.0
+
+  async def edit(content: str):
+    nonlocal shown, last_edit
+    last_edit = time.monotonic()
+    if content == shown:
+      return
+    shown = content
+    try:
+      await outbox.edit(channel, msg, embed=emote_embeds(character_name, content)[0])
+    except discord.HTTPException:
+      logging.exception(f"Failed to edit streamed emote for {character_name}")
+
+  async for chunk in chunks:
+    text += chunk
+    if time.monotonic() - last_edit >= edit_interval:
+      await edit(transform(text))
+
+  await edit(transform(text))
+  for embed in emote_embeds(character_name, transform(text))[1:]:
+    await outbox.send(channel, embed=embed)
+  return text
 
 async def send(channel_id: int, text: any):
   """
-  Send a plain message to the channel designated by channel_id.
-  Uses the cache when possible; falls back to a REST fetch.
+  Send a plain message to the channel designated by channel_id, split at
+  word boundaries if it's over Discord's length limit. Uses the cache when
+  possible; falls back to a REST fetch. Returns the first message sent.
   """
 
   from bot import discord_bot
@@ -81,29 +173,7 @@ async def send(channel_id: int, text: any):
   # 2) Cache miss?  Do a REST call (one request, rate-limited).
   if channel is None:
     channel = await discord_bot.fetch_channel(channel_id)   # raises NotFound if invalid
-    
-  session = get_session(channel_id)
-  async def clear_status():
-    # delete old status if present
-    if session.status_message:
-      try:
-        await session.status_message.delete()
-        session.status_message = None
-      except:
-        pass
-
-  # Helper to set a new status
-  async def set_status(content: str):
-    # delete old status if present
-    await clear_status()
-    session.status_message = await channel.send(content)
-
-  # 3) Send the message.
-  msg = await channel.send(text)
-
-  # Move our status message back to the bottom
-  if session.status_message:
-    set_status(session.status_message.content)
-
-  return msg
-  
\ No newline at end of file
+
+  # 3) Send the message; the outbox keeps any status message below it.
+  sends = [outbox.send(channel, chunk) for chunk in chunk_by_words(str(text), MESSAGE_LIMIT) or [str(text)]]
+  return (await asyncio.gather(*sends))[0]
@@ -0,0 +1,66 @@
+import re
+from typing import Dict, Iterable, List, Tuple
+
+from narrative.models import Character, Message, Scene
+
+WORD_RE = re.compile(r"\w+")
+
+
+def extract_words(text: str) -> List[str]:
+  """Split text into lower-case words (same rule the JS used)."""
+  return WORD_RE.findall(text.lower())
+
+
+def character_aliases(character: Character) -> List[str]:
+  """The name plus any comma-separated nicknames the character goes by."""
+  aliases = [character.name]
+  nicknames = getattr(character, "nicknames", None)
+  if nicknames:
+    aliases.extend(n.strip() for n in nicknames.split(",") if n.strip())
+  return aliases
+
+
+class MentionIndex:
+  """
+  Word -> characters lookup for one cast.
+
+  A character is mentioned by any word of its name or nicknames, so
+  "Mary Anne" answers to both "mary" and "anne". Candidates for a word are
+  kept in cast order, which keeps the old first-match-wins behaviour when
+  several characters share a word.
+  """
+
+  def __init__(self, characters: Iterable[Character]):
+    self.words: Dict[str, List[Character]] = {}
+    for character in characters:
+      for alias in character_aliases(character):
+        for word in extract_words(alias):
+          candidates = self.words.setdefault(word, [])
+          if character not in candidates:
+            candidates.append(character)
+
+  def mentioned(self, message: Message) -> List[Character]:
+    """
+    One character per word of *message* that names someone, in order. The
+    author of the message is never counted as mentioning itself.
+    """
+    found: List[Character] = []
+    for word in extract_words(message.content):
+      for character in self.words.get(word, ()):
+        if character.id != message.character_id:
+          found.append(character)
+          break
+    return found
+
+
+def _cast_signature(characters: List[Character]) -> Tuple:
+  return tuple((c.id, c.name, getattr(c, "nicknames", None)) for c in characters)
+
+
+def mention_index(scene: Scene, characters: List[Character]) -> MentionIndex:
+  """The scene's index for *characters*, rebuilt only when the cast (or a name) changes."""
+  signature = _cast_signature(characters)
+  cached = scene._mentions
+  if cached is None or cached[0] != signature:
+    cached = scene._mentions = (signature, MentionIndex(characters))
+  return cached[1]
@@ -1,8 +1,7 @@
-from functools import cached_property
 import uuid
 from datetime import datetime
-from typing import Any, List, Optional, Dict
-from pydantic import BaseModel, Field
+from typing import Any, Iterator, List, Optional, Dict
+from pydantic import BaseModel, Field, PrivateAttr, model_validator
 
 
 class DatabaseModel(BaseModel):
@@ -16,6 +15,9 @@ class Message(BaseModel):
   internal_thought: Optional[str] = None
   is_player: bool = False
 
+  # tokenizer name -> token count, filled in by narrative.prompt.PromptBuilder
+  _token_counts: Dict[str, int] = PrivateAttr(default_factory=dict)
+
 
 class CharacterTemplate(DatabaseModel):
   creator_session_id: int
@@ -25,6 +27,8 @@ class CharacterTemplate(DatabaseModel):
   author_notes: Optional[str] = None
   personality: Optional[str] = None
   display_picture: Optional[str] = None
+  # Comma-separated other names the character answers to in poses
+  nicknames: Optional[str] = None
 
 
 class Character(DatabaseModel):
@@ -34,11 +38,11 @@ class Character(DatabaseModel):
   # talkativeness: int = 0.0
   character_data: Dict[str, str] = Field(default_factory=dict)
 
-  # lazy-load; cached after first use
-  @cached_property
+  # lazy-load through the shared template cache (see narrative.template_cache)
+  @property
   def _template(self) -> CharacterTemplate | None:
-    from db import db
-    return db.get_by_id(CharacterTemplate, self.template_id)
+    from narrative.template_cache import template_cache
+    return template_cache.get(self.template_id)
 
   def __getattr__(self, item: str) -> Any:           # called *after* normal lookup
     if item in CharacterTemplate.model_fields:     # pydantic-v2 attribute
@@ -54,13 +58,136 @@ class Setting(DatabaseModel):
   picture: Optional[str] = None
 
 
+# How many messages Scene pages in from the log at a time
+MESSAGE_PAGE_SIZE = 64
+
+# The log scene histories live in: db.message_log, unless use_message_log()
+# picked another. Generation worker processes must not open the database, so
+# they read the log through their own.
+_message_log = None
+
+def scene_message_log():
+  global _message_log
+  if _message_log is None:
+    from db import message_log
+    _message_log = message_log
+  return _message_log
+
+def use_message_log(log):
+  global _message_log
+  _message_log = log
+
 class Scene(DatabaseModel):
+  """
+  Loading a scene only reads its metadata and cast; the history is paged in
+  from the message log by `tail`, `iter_messages_reversed` or `messages`, so
+  commands that just look at the cast cost the same however long the scene
+  has run.
+  """
   name: str
   characters: List[Character] = Field(default_factory=list)
-  messages: List[Message] = Field(default_factory=list)
+  # The history itself lives in the per-scene message log (storage.message_log);
+  # the document only records how long it is.
+  message_count: int = 0
+  # Rolling summary of the first `summarized_count` messages, kept up to date
+  # by narrative.summarizer; prompts carry it plus the history after it.
+  summary: Optional[str] = None
+  summarized_count: int = 0
+  # "sequential": each NPC sees the poses of the NPCs before it this round.
+  # "parallel": all NPCs answer the same snapshot of the round concurrently.
+  generation_mode: str = "sequential"
   # start_date: datetime = Field(default_factory=datetime.utcnow)
   current_setting: Optional[Setting] = None
 
+  # Messages from documents written before the log existed, left as raw
+  # dicts: they're only validated if they still have to be moved into the
+  # log, and are never written back.
+  legacy_messages: Optional[List[Dict[str, Any]]] = Field(default=None, exclude=True)
+
+  # The newest part of the history that has been read so far, covering
+  # message indexes [_window_start, message_count). Older messages are paged
+  # in from the log only when something walks back that far.
+  _window: List[Message] = PrivateAttr(default_factory=list)
+  _window_start: Optional[int] = PrivateAttr(default=None)
+  # (cast signature, MentionIndex), see narrative.mentions
+  _mentions: Optional[Any] = PrivateAttr(default=None)
+  # Set when the stored document still carries inline messages; saving it
+  # once drops them, so later loads don't parse that history again.
+  _needs_rewrite: bool = PrivateAttr(default=False)
+
+  @model_validator(mode="before")
+  @classmethod
+  def _rename_inline_messages(cls, data: Any) -> Any:
+    if isinstance(data, dict) and "messages" in data:
+      data = dict(data)
+      data["legacy_messages"] = data.pop("messages")
+    return data
+
+  def model_post_init(self, __context: Any) -> None:
+    # Resolve every character's template in one query up front
+    if self.characters:
+      from narrative.template_cache import template_cache
+      template_cache.preload(c.template_id for c in self.characters)
+
+    if self.legacy_messages is None:
+      return
+    message_log = scene_message_log()
+    # The document may not have been rewritten yet, or an earlier migration
+    # may have stopped part way: only move what the log is still missing
+    for message in self.legacy_messages[message_log.count(self.id):]:
+      message_log.append(self.id, Message.model_validate(message))
+    self.message_count = message_log.count(self.id)
+    self.legacy_messages = None
+    self._needs_rewrite = True
+
+  def _load_before(self, count: int):
+    """Page up to *count* older messages into the window."""
+    message_log = scene_message_log()
+    if self._window_start is None:
+      self._window_start = message_log.count(self.id)
+    start = max(self._window_start - count, 0)
+    if start < self._window_start:
+      self._window[:0] = message_log.read(self.id, start, self._window_start)
+      self._window_start = start
+
+  @property
+  def messages(self) -> List[Message]:
+    """Full history, paged in from the log on first access."""
+    if self._window_start is None:
+      self._load_before(0)
+    self._load_before(self._window_start)
+    return self._window
+
+  def tail(self, count: int) -> List[Message]:
+    """The newest *count* messages without loading the whole history."""
+    if count <= 0:
+      return []
+    if self._window_start is None or (len(self._window) < count and self._window_start > 0):
+      self._load_before(count - len(self._window))
+    return self._window[-count:]
+
+  def iter_messages_reversed(self) -> Iterator[Message]:
+    """Walk the history newest to oldest, paging older messages in as needed."""
+    if self._window_start is None:
+      self._load_before(MESSAGE_PAGE_SIZE)
+    index = self._window_start + len(self._window)
+    while index > 0:
+      index -= 1
+      if index < self._window_start:
+        self._load_before(MESSAGE_PAGE_SIZE)
+      yield self._window[index - self._window_start]
+
+  def append_message(self, message: Message):
+    message_log = scene_message_log()
+    self._record_append(message, message_log.append(self.id, message))
+
+  def _record_append(self, message: Message, count: int):
+    """Account for *message* having been written to the log as message number *count*."""
+    if self._window_start is None:
+      self._window_start = count - 1
+    self.message_count = count
+    self._window.append(message)
+
 
 class Narrative(DatabaseModel):
   name: str
@@ -0,0 +1,193 @@
+from typing import Any, Dict, List, Optional, Tuple
+
+from narrative.models import Character, Message, Scene
+from template import Template
+from utils.lru import LRUCache
+from utils.metrics import PROMPT_RENDER, PROMPT_TOKENS, cache_collector
+from utils.tokens import Tokenizer, load_tokenizer
+
+
+class _HistoryBlock:
+  """The rendered history of one scene, valid for one rendered prefix."""
+  __slots__ = ("prefix", "start", "end", "parts", "tokens")
+
+  def __init__(self, prefix: str, start: int):
+    self.prefix = prefix
+    # messages [start, end) are rendered, one entry of (text, tokens) each
+    self.start = start
+    self.end = start
+    self.parts: List[Tuple[str, int]] = []
+    self.tokens = 0
+
+  def append(self, text: str, tokens: int):
+    self.parts.append((text, tokens))
+    self.end += 1
+    self.tokens += tokens
+
+  def drop_front(self, count: int):
+    self.tokens -= sum(tokens for _, tokens in self.parts[:count])
+    del self.parts[:count]
+    self.start += count
+
+  def render(self) -> str:
+    return "".join(text for text, _ in self.parts)
+
+
+class PromptBuilder:
+  """
+  Renders the prompt template with as much recent history as fits the model's
+  context window.
+
+  The budget is the context length minus the tokens reserved for the reply,
+  minus whatever the rest of the template (instructions, character list and
+  details, scene summary, next-pose section) costs. Per-message counts are
+  cached on the Message objects, so only new messages get tokenized.
+
+  The template is split around its `messages` loop. For each scene the
+  rendered prefix and the rendered history are kept; later prompts only
+  render the messages added since, then swap in the tail for the acting
+  character. So consecutive prompts for a scene share a byte-identical
+  beginning, which the inference server's prefix (KV) cache can reuse. When
+  the history outgrows the budget, a whole *trim_slack* fraction of it is
+  dropped at once rather than one message per prompt, so the start of the
+  history stays put for many generations in between.
+  """
+
+  def __init__(self, template: Template, tokenizer: Tokenizer, *, context_length: int, reserve_tokens: int, trim_slack: float = 0.25):
+    self.template = template
+    self.tokenizer = tokenizer
+    self.context_length = context_length
+    self.reserve_tokens = reserve_tokens
+    self.trim_slack = trim_slack
+    self.split = template.split_at_loop("messages")
+    # rendered fixed section -> token count; the fixed part only changes
+    # when the cast or acting character does.
+    self._fixed_counts: Dict[str, int] = {}
+    # scene id -> rendered history
+    self.blocks: LRUCache[str, _HistoryBlock] = LRUCache(capacity=256)
+    cache_collector("prompt_history", self.blocks.stats)
+
+  def message_tokens(self, message: Message) -> int:
+    key = self.tokenizer.name
+    count = message._token_counts.get(key)
+    if count is None:
+      # Same shape as one iteration of the template's history loop
+      count = self.tokenizer.count(f"\n{message.character_name}: {message.content}\n")
+      message._token_counts[key] = count
+    return count
+
+  def _fixed_tokens(self, rendered: str) -> int:
+    count = self._fixed_counts.get(rendered)
+    if count is None:
+      if len(self._fixed_counts) > 256:
+        self._fixed_counts.clear()
+      count = self._fixed_counts[rendered] = self.tokenizer.count(rendered)
+    return count
+
+  def fit_history(self, scene: Scene, budget: int) -> List[Message]:
+    """
+    The newest messages of *scene* whose combined cost fits *budget*, oldest
+    first. Messages already folded into the scene summary are never included.
+    """
+    history: List[Message] = []
+    used = 0
+    unsummarized = scene.message_count - scene.summarized_count
+    for message in scene.iter_messages_reversed():
+      if len(history) >= unsummarized:
+        break
+      cost = self.message_tokens(message)
+      if used + cost > budget:
+        break
+      history.append(message)
+      used += cost
+    history.reverse()
+    return history
+
+  def _render_message(self, block: _HistoryBlock, message: Message, context: Dict[str, Any]):
+    _, loop_var, body, _ = self.split
+    block.append(Template.render_loop_item(body, loop_var, message, context), self.message_tokens(message))
+
+  def _history(self, scene: Scene, context: Dict[str, Any], prefix: str, budget: int) -> _HistoryBlock:
+    block: Optional[_HistoryBlock] = self.blocks.get(scene.id)
+    if block is None or block.prefix != prefix or block.end > scene.message_count or block.start < scene.summarized_count:
+      # Start over, filled only part way so the next few messages fit
+      # without moving the start
+      history = self.fit_history(scene, int(budget * (1 - self.trim_slack)))
+      block = _HistoryBlock(prefix, scene.message_count - len(history))
+      for message in history:
+        self._render_message(block, message, context)
+      self.blocks.put(scene.id, block)
+      return block
+
+    if block.end < scene.message_count:
+      for message in scene.tail(scene.message_count - block.end):
+        self._render_message(block, message, context)
+    if block.tokens > budget:
+      target = int(budget * (1 - self.trim_slack))
+      drop = 0
+      tokens = block.tokens
+      while drop < len(block.parts) and tokens > target:
+        tokens -= block.parts[drop][1]
+        drop += 1
+      block.drop_front(drop)
+    return block
+
+  def build(self, scene: Scene, context: Dict[str, Any]) -> str:
+    with PROMPT_RENDER.time():
+      prompt, tokens = self.render(scene, context)
+    PROMPT_TOKENS.observe(tokens)
+    return prompt
+
+  def render(self, scene: Scene, context: Dict[str, Any]) -> Tuple[str, int]:
+    """`build` without recording metrics; returns the prompt and its size in tokens."""
+    context = {"summary": scene.summary, **context}
+    if self.split is None:
+      # No top-level history loop to split around; render it in one go
+      fixed = self.template.render({**context, "messages": []})
+      fixed_tokens = self._fixed_tokens(fixed)
+      budget = self.context_length - self.reserve_tokens - fixed_tokens
+      history = self.fit_history(scene, max(budget, 0))
+      prompt = self.template.render({**context, "messages": history})
+      return prompt, fixed_tokens + sum(self.message_tokens(m) for m in history)
+
+    before, _, _, after = self.split
+    prefix = Template.render_plan(before, context)
+    suffix = Template.render_plan(after, context)
+    fixed_tokens = self._fixed_tokens(prefix) + self._fixed_tokens(suffix)
+    budget = self.context_length - self.reserve_tokens - fixed_tokens
+    block = self._history(scene, context, prefix, max(budget, 0))
+    return prefix + block.render() + suffix, fixed_tokens + block.tokens
+
+
+def prompt_builder_from_config(cfg: dict, template: Template) -> PromptBuilder:
+  """A PromptBuilder for model.yml's `prompt:` and `generation:` sections."""
+  prompt_cfg = cfg.get("prompt", {})
+  return PromptBuilder(
+    template,
+    load_tokenizer(prompt_cfg.get("tokenizer", "approximate"), chars_per_token=prompt_cfg.get("chars_per_token", 3.5)),
+    context_length=prompt_cfg.get("context_length", cfg["generation"]["truncation_length"]),
+    reserve_tokens=prompt_cfg.get("reserve_tokens", cfg["generation"]["max_new_tokens"]),
+    trim_slack=prompt_cfg.get("trim_slack", 0.25),
+  )
+
+
+def pose_context(scene: Scene, character: Character) -> Dict[str, Any]:
+  """What the template is rendered with for *character*'s next pose."""
+  users = "Lily"
+  return {
+    "characters": scene.characters,
+    "acting_character": character,
+    "users": users
+  }
+
+
+def completion_request(scene: Scene, prompt: str, generation: dict) -> dict:
+  """The /v1/completions body for *prompt*, stopping before anyone else speaks."""
+  stopping_strings = ['###', '\n***', '<END_POSE>', '\n\n']
+  for c in scene.characters:
+    stopping_strings.append(f'{c.name}:')
+  return {
+    "prompt": prompt,
+    "stopping_strings": stopping_strings,
+    **generation
+  }
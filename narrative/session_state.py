@@ -1,9 +1,11 @@
+import asyncio
 from typing import Optional, Dict, List
-from pydantic import BaseModel, Field
-from tinydb import Query
+from pydantic import BaseModel, Field, PrivateAttr
 
 from narrative.models import Character, DatabaseModel, Narrative, Message, Scene
-from db import db
+from db import async_db, db, storage_config
+from utils.lru import LRUCache
+from utils.metrics import cache_collector
 
 
 class PoseRoundInfo(BaseModel):
@@ -21,16 +23,31 @@ class SessionModel(DatabaseModel):
 
 
 class SessionState(SessionModel):
-  last_bot_message: Optional[Message] = None
-  status_message: Optional[Message] = None
+  # Live Discord objects; only meaningful while the session stays cached.
+  last_bot_message: Optional[Message] = Field(default=None, exclude=True)
 
-  def active_scene(self) -> Optional[Scene]:
+  # The narrative and scene this session last resolved, kept alongside it in
+  # the session cache so repeat lookups don't touch storage.
+  _narrative: Optional[Narrative] = PrivateAttr(default=None)
+  _scene: Optional[Scene] = PrivateAttr(default=None)
+
+  def active_narrative(self) -> Optional[Narrative]:
     if not self.active_narrative_id:
       return None
-    narrative = db.get_by_id(Narrative, self.active_narrative_id)
-    if not narrative.active_scene_id:
+    if self._narrative is None or self._narrative.id != self.active_narrative_id:
+      self._narrative = db.get_by_id(Narrative, self.active_narrative_id)
+    return self._narrative
+
+  def active_scene(self) -> Optional[Scene]:
+    narrative = self.active_narrative()
+    if not narrative or not narrative.active_scene_id:
       return None
-    return db.get_by_id(Scene, narrative.active_scene_id)
+    if self._scene is None or self._scene.id != narrative.active_scene_id:
+      self._scene = db.get_by_id(Scene, narrative.active_scene_id)
+      if self._scene and self._scene._needs_rewrite:
+        db.update(self._scene)
+        self._scene._needs_rewrite = False
+    return self._scene
   
   def get_user_character(self, user_id) -> Optional[Character]:
     scene = self.active_scene()
@@ -43,16 +60,27 @@ class SessionState(SessionModel):
     if not scene:
       return None
     return next((c for c in scene.characters if c.template_id == name_or_id or c.name == name_or_id), None)
-     
 
-# Helper to get session per channel or DM
-def get_session(channel_id) -> SessionModel:
-  
+
+# Live sessions by channel id. Everything that changes a session, its
+# narrative or its scene mutates these same objects and then calls db.update,
+# so the cache never disagrees with storage. Channels with a round running
+# are pinned (see commands.roleplay.start_round): evicting one would let the
+# next command load a second copy that the round doesn't see.
+session_cache: LRUCache[int, SessionState] = LRUCache(capacity=storage_config().get("session_cache_size", 512))
+cache_collector("sessions", session_cache.stats)
+
+def load_session(channel_id) -> SessionState:
+  """
+  Blocking: fetch the channel's session from storage, or create a new one,
+  with its active narrative and scene already resolved. Leaves the cache
+  alone; run it on the storage thread.
+  """
   # Okay we need to maybe pull from storage?
-  Q = Query()
-  doc = db.tables["sessions"].get(Q.channel_id == channel_id)
-  if doc:
-    session = SessionState(**doc)
+  session = db.get_by_channel(SessionState, channel_id)
+  if session:
+    # Resolve these now, so later active_scene() calls don't touch storage
+    session.active_scene()
     return session
   
   # Nope this is a new session
@@ -72,4 +100,33 @@ def get_session(channel_id) -> SessionModel:
   db.insert(narrative)
   db.insert(scene)
 
-  return session
\ No newline at end of file
+  session._narrative = narrative
+  session._scene = scene
+  return session
+
+# channel id -> load in progress, so concurrent lookups of an uncached
+# channel share one load (and one new session)
+_loading: Dict[int, "asyncio.Future[SessionState]"] = {}
+
+# Helper to get session per channel or DM
+async def get_session(channel_id) -> SessionState:
+  session = session_cache.get(channel_id)
+  if session:
+    return session
+
+  loading = _loading.get(channel_id)
+  if loading is None:
+    loading = _loading[channel_id] = asyncio.ensure_future(async_db.run(load_session, channel_id))
+    loading.add_done_callback(lambda _: _loading.pop(channel_id, None))
+  # A handler giving up shouldn't abandon the load for everyone else
+  session = await asyncio.shield(loading)
+  session_cache.put(channel_id, session)
+  return session
+
+def get_session_blocking(channel_id) -> SessionState:
+  """get_session for synchronous callers (scripts, benchmarks); does storage I/O on this thread."""
+  session = session_cache.get(channel_id)
+  if session is None:
+    session = load_session(channel_id)
+    session_cache.put(channel_id, session)
+  return session
@@ -0,0 +1,109 @@
+import asyncio
+import logging
+from typing import Any, Dict, Optional
+
+from inference.pool import NoBackendAvailable
+from inference.scheduler import InferenceScheduler, QueueFull
+from narrative.models import Scene
+
+SUMMARY_PROMPT = """### Instructions:
+You are keeping the running summary of a collaborative story. Rewrite the summary so it also covers the new passage. Keep every plot point, relationship, promise and unresolved thread; drop flowery wording. Write in past tense, as plain prose.
+
+### Summary So Far:
+{summary}
+
+### New Passage:
+{transcript}
+
+### Updated Summary:
+"""
+
+
+class SceneSummarizer:
+  """
+  Folds old scene history into `Scene.summary` in the background.
+
+  Once more than *keep_recent* messages sit beyond what the summary already
+  covers, the oldest *span* of them is handed to the completion backend along
+  with the current summary, and the result becomes the new summary. Only spans
+  that haven't been summarized yet are ever sent, never the whole log.
+  """
+
+  def __init__(
+    self,
+    client: Any,
+    *,
+    model: Optional[str] = None,
+    headers: Optional[Dict[str, str]] = None,
+    keep_recent: int = 64,
+    span: int = 32,
+    max_tokens: int = 768,
+    temperature: float = 0.3,
+    scheduler: Optional[InferenceScheduler] = None,
+  ):
+    self.client = client
+    self.model = model
+    self.headers = headers
+    self.keep_recent = keep_recent
+    self.span = span
+    self.max_tokens = max_tokens
+    self.temperature = temperature
+    self.scheduler = scheduler
+    # scene id -> running summarization task
+    self.tasks: Dict[str, asyncio.Task] = {}
+
+  def pending(self, scene: Scene) -> bool:
+    return scene.message_count - scene.summarized_count - self.keep_recent >= self.span
+
+  def schedule(self, scene: Scene):
+    """Summarize *scene* in the background if it has fallen far enough behind."""
+    if not self.pending(scene):
+      return
+    task = self.tasks.get(scene.id)
+    if task and not task.done():
+      return
+    self.tasks[scene.id] = asyncio.get_running_loop().create_task(self._run(scene))
+
+  async def _run(self, scene: Scene):
+    from db import async_db
+    try:
+      while self.pending(scene):
+        start = scene.summarized_count
+        end = start + self.span
+        messages = await async_db.read_messages(scene.id, start, end)
+        transcript = "\n".join(f"{m.character_name}: {m.content}" for m in messages)
+        request = {
+          "prompt": SUMMARY_PROMPT.format(summary=scene.summary or "(The story has just begun.)", transcript=transcript),
+          "max_tokens": self.max_tokens,
+          "temperature": self.temperature,
+          "stopping_strings": ["###"],
+        }
+        if self.model:
+          request["model"] = self.model
+        if self.scheduler:
+          # Summaries queue like everyone else, under their own key
+          async with self.scheduler.slot("summarizer"):
+            response = await self.client.post('/v1/completions', headers=self.headers, json=request)
+        else:
+          response = await self.client.post('/v1/completions', headers=self.headers, json=request)
+        summary = response['choices'][0]['text'].strip()
+        if not summary:
+          logging.warning(f"Empty summary for scene {scene.id}; will retry after the next round")
+          return
+        scene.summary = summary
+        scene.summarized_count = end
+        await async_db.update(scene)
+    except asyncio.CancelledError:
+      raise
+    except (QueueFull, NoBackendAvailable):
+      logging.info(f"No inference capacity; summarizing scene {scene.id} later")
+    except Exception:
+      logging.exception(f"Summarizing scene {scene.id} failed")
+    finally:
+      self.tasks.pop(scene.id, None)
+
+  async def close(self):
+    for task in list(self.tasks.values()):
+      task.cancel()
+    await asyncio.gather(*self.tasks.values(), return_exceptions=True)
+    self.tasks.clear()
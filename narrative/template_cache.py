@@ -0,0 +1,80 @@
+import threading
+from typing import Dict, Iterable, Optional
+
+from narrative.models import CharacterTemplate
+from utils.metrics import cache_collector
+
+
+class CharacterTemplateCache:
+  """
+  Process-wide cache of CharacterTemplates keyed by id.
+
+  Every Character in a scene resolves its name, description, etc. through its
+  template; scenes preload all of theirs with a single query when they are
+  built, so rendering a scene doesn't cost one lookup per character.
+  Anything that edits a template must `put()` the edited one (or
+  `invalidate()` it, if it doesn't have it at hand).
+  """
+
+  def __init__(self):
+    self.lock = threading.Lock()
+    self.templates: Dict[str, CharacterTemplate] = {}
+    self.hits = 0
+    self.misses = 0
+    # Where misses are loaded from; db.db unless set. Generation worker
+    # processes, which get templates shipped with each job, set their own.
+    self.storage = None
+
+  def _storage(self):
+    if self.storage is None:
+      from db import db
+      return db
+    return self.storage
+
+  def get(self, template_id: str) -> Optional[CharacterTemplate]:
+    with self.lock:
+      template = self.templates.get(template_id)
+      if template is None:
+        self.misses += 1
+      else:
+        self.hits += 1
+    if template is None:
+      template = self._storage().get_by_id(CharacterTemplate, template_id)
+      if template is not None:
+        with self.lock:
+          self.templates[template_id] = template
+    return template
+
+  def preload(self, template_ids: Iterable[str]):
+    with self.lock:
+      template_ids = list(template_ids)
+      missing = {tid for tid in template_ids if tid not in self.templates}
+      self.misses += len(missing)
+      self.hits += len(template_ids) - len(missing)
+    if not missing:
+      return
+    templates = self._storage().get_many_by_id(CharacterTemplate, list(missing))
+    with self.lock:
+      for template in templates:
+        self.templates[template.id] = template
+
+  def put(self, template: CharacterTemplate):
+    """Remember a template that was just loaded or edited elsewhere."""
+    with self.lock:
+      self.templates[template.id] = template
+
+  def invalidate(self, template_id: str):
+    with self.lock:
+      self.templates.pop(template_id, None)
+
+  def clear(self):
+    with self.lock:
+      self.templates.clear()
+
+  def stats(self) -> dict:
+    with self.lock:
+      return {"size": len(self.templates), "hits": self.hits, "misses": self.misses}
+
+
+template_cache = CharacterTemplateCache()
+cache_collector("character_templates", template_cache.stats)
@@ -0,0 +1,218 @@
+"""
+Everything the bot posts, edits or deletes in a channel goes through here.
+
+Each channel gets an ordered queue, worked off by one task, so poses show up
+in the order they were handed over however many NPCs produce them at once.
+Sends are paced to stay inside Discord's rate limits instead of running into
+them: at most *channel_rate* calls per *channel_per* seconds in a channel
+(Discord allows 5 per 5s) and *global_rate* per *global_per* seconds overall
+(Discord allows 50/s). Edits to a message that are still waiting are merged
+into one, so a streamed pose costs one edit per turn of the queue at most.
+
+A channel can also have a status line (queue positions and the like) that is
+kept below everything else. It is moved once after each burst of sends, not
+after every one.
+"""
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Optional
+
+import discord
+
+from utils.config import load_config
+from utils.metrics import DISCORD_SEND, metrics
+
+
+class RateLimiter:
+  """At most *rate* acquisitions in any *per*-second window."""
+
+  def __init__(self, rate: int, per: float):
+    self.rate = rate
+    self.per = per
+    self.recent: Deque[float] = deque()
+
+  async def acquire(self):
+    while True:
+      now = time.monotonic()
+      while self.recent and now - self.recent[0] >= self.per:
+        self.recent.popleft()
+      if len(self.recent) < self.rate:
+        self.recent.append(now)
+        return
+      await asyncio.sleep(self.per - (now - self.recent[0]))
+
+
+class _Op:
+  __slots__ = ("kind", "message", "kwargs", "future")
+
+  def __init__(self, kind: str, message: Optional[discord.Message], kwargs: Dict[str, Any]):
+    self.kind = kind
+    self.message = message
+    self.kwargs = kwargs
+    self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+
+
+class ChannelOutbox:
+  """The queue, status line and rate limit of one channel."""
+
+  def __init__(self, channel: discord.abc.Messageable, outbox: "Outbox"):
+    self.channel = channel
+    self.outbox = outbox
+    self.limiter = RateLimiter(outbox.channel_rate, outbox.channel_per)
+    self.ops: Deque[_Op] = deque()
+    self.wakeup = asyncio.Event()
+    self.task: Optional[asyncio.Task] = None
+    # key -> line; all lines are shown together in one status message
+    self.status_lines: Dict[str, str] = {}
+    self.status: Optional[discord.Message] = None
+    self.status_shown: Optional[str] = None
+    # Whether anything was posted below the status message since it went up
+    self.status_buried = False
+
+  def submit(self, op: _Op) -> asyncio.Future:
+    if op.kind == "edit":
+      # A newer edit of a message makes a waiting one pointless
+      for queued in self.ops:
+        if queued.kind == "edit" and queued.message is op.message:
+          queued.kwargs = op.kwargs
+          return queued.future
+    self.ops.append(op)
+    self.kick()
+    return op.future
+
+  def kick(self):
+    self.wakeup.set()
+    if self.task is None or self.task.done():
+      self.task = asyncio.get_running_loop().create_task(self._run())
+
+  async def _run(self):
+    while True:
+      while self.ops:
+        await self._perform(self.ops.popleft())
+      await self._sync_status()
+      if self.ops:
+        continue
+      self.wakeup.clear()
+      try:
+        await asyncio.wait_for(self.wakeup.wait(), self.outbox.idle_timeout)
+      except asyncio.TimeoutError:
+        if not self.ops:
+          self.outbox._retire(self)
+          return
+
+  async def _call(self, kind: str, call):
+    """Make one Discord API call once the rate limits allow it."""
+    await self.limiter.acquire()
+    await self.outbox.limiter.acquire()
+    while True:
+      try:
+        with DISCORD_SEND.time(op=kind):
+          return await call()
+      except discord.RateLimited as e:
+        # Only raised when discord.py won't wait on its own
+        await asyncio.sleep(e.retry_after)
+
+  async def _perform(self, op: _Op):
+    if op.future.done():
+      return  # whoever wanted it gave up
+    try:
+      if op.kind == "send":
+        result = await self._call("send", lambda: self.channel.send(**op.kwargs))
+        self.status_buried = True
+      elif op.kind == "edit":
+        result = await self._call("edit", lambda: op.message.edit(**op.kwargs))
+      else:
+        result = await self._call("delete", lambda: op.message.delete())
+    except Exception as e:
+      if not op.future.done():
+        op.future.set_exception(e)
+      return
+    if not op.future.done():
+      op.future.set_result(result)
+
+  async def _sync_status(self):
+    content = "\n".join(self.status_lines.values())
+    try:
+      if not content:
+        if self.status is not None:
+          status, self.status, self.status_shown = self.status, None, None
+          await self._call("status", lambda: status.delete())
+      elif self.status is None or self.status_buried:
+        # Repost below everything, then take the old one down
+        old = self.status
+        self.status = await self._call("status", lambda: self.channel.send(content))
+        self.status_shown = content
+        self.status_buried = False
+        if old is not None:
+          await self._call("status", lambda: old.delete())
+      elif content != self.status_shown:
+        await self._call("status", lambda: self.status.edit(content=content))
+        self.status_shown = content
+    except discord.HTTPException:
+      logging.exception(f"Failed to update the status message in channel {getattr(self.channel, 'id', '?')}")
+
+
+class Outbox:
+  def __init__(self, *, channel_rate: int = 5, channel_per: float = 5.0, global_rate: int = 45, global_per: float = 1.0, idle_timeout: float = 30.0):
+    self.channel_rate = channel_rate
+    self.channel_per = channel_per
+    self.limiter = RateLimiter(global_rate, global_per)
+    self.idle_timeout = idle_timeout
+    self.channels: Dict[int, ChannelOutbox] = {}
+
+  def _channel(self, channel: discord.abc.Messageable) -> ChannelOutbox:
+    outbox = self.channels.get(channel.id)
+    if outbox is None:
+      outbox = self.channels[channel.id] = ChannelOutbox(channel, self)
+    return outbox
+
+  def _retire(self, outbox: ChannelOutbox):
+    # Idle with nothing on screen to keep track of
+    if not outbox.status_lines and outbox.status is None and self.channels.get(outbox.channel.id) is outbox:
+      del self.channels[outbox.channel.id]
+
+  async def send(self, channel: discord.abc.Messageable, content: Optional[str] = None, **kwargs) -> discord.Message:
+    """channel.send, in order behind everything already queued for *channel*."""
+    return await self._channel(channel).submit(_Op("send", None, {"content": content, **kwargs}))
+
+  async def edit(self, channel: discord.abc.Messageable, message: discord.Message, **kwargs):
+    """message.edit; if an edit of *message* is still waiting, this one replaces it."""
+    return await self._channel(channel).submit(_Op("edit", message, kwargs))
+
+  async def delete(self, channel: discord.abc.Messageable, message: discord.Message):
+    return await self._channel(channel).submit(_Op("delete", message, {}))
+
+  def set_status(self, channel: discord.abc.Messageable, key: str, line: str):
+    """Show *line* in *channel*'s status message until `clear_status` with the same *key*."""
+    outbox = self._channel(channel)
+    outbox.status_lines[key] = line
+    outbox.kick()
+
+  def clear_status(self, channel: discord.abc.Messageable, key: str):
+    outbox = self.channels.get(channel.id)
+    if outbox and outbox.status_lines.pop(key, None) is not None:
+      outbox.kick()
+
+  async def close(self):
+    tasks = [outbox.task for outbox in self.channels.values() if outbox.task]
+    for task in tasks:
+      task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    self.channels.clear()
+
+  def collect(self):
+    """Samples for utils.metrics."""
+    yield ("storyteller_outbound_channels", "gauge", "Channels with an active outbound queue", {}, len(self.channels))
+    yield ("storyteller_outbound_queued", "gauge", "Discord calls waiting in channel queues", {}, sum(len(outbox.ops) for outbox in self.channels.values()))
+
+  def stats(self) -> dict:
+    return {
+      "channels": len(self.channels),
+      "queued": sum(len(outbox.ops) for outbox in self.channels.values()),
+    }
+
+
+outbox = Outbox(**load_config().get("outbound", {}))
+metrics.collector(outbox.collect)
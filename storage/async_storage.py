@@ -0,0 +1,83 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, List, Optional, Type, TypeVar
+
+from narrative.models import DatabaseModel, Message, Scene
+from storage.message_log import MessageLog
+from storage.tables import table_name_for
+
+T = TypeVar('T', bound=DatabaseModel)
+
+
+class AsyncStorage:
+  """
+  Awaitable front for the (blocking) database provider and message log.
+
+  Every call runs on a dedicated storage thread, so slash-command handlers
+  never read or write a file on the event loop. With the default single
+  thread, storage work is also serialized: one file or SQLite operation at a
+  time, in the order it was requested. At most *max_pending* calls may be
+  waiting; callers beyond that wait on the loop until one finishes, so a
+  burst can't build an unbounded backlog.
+
+  Updated documents are serialized on the calling (loop) thread before they
+  are handed over, so a live model that handlers keep mutating is never read
+  from the storage thread while it changes.
+  """
+
+  def __init__(self, provider, message_log: MessageLog, *, io_threads: int = 1, max_pending: int = 256):
+    self.provider = provider
+    self.message_log = message_log
+    self.executor = ThreadPoolExecutor(max_workers=io_threads, thread_name_prefix="storage-io")
+    self.pending = asyncio.Semaphore(max_pending)
+
+  async def run(self, fn: Callable[..., Any], *args, **kwargs) -> Any:
+    """Run any blocking storage-bound callable on the storage thread."""
+    async with self.pending:
+      return await asyncio.get_running_loop().run_in_executor(self.executor, functools.partial(fn, *args, **kwargs))
+
+  def close(self):
+    self.executor.shutdown(wait=True)
+
+  # ──────────────────────────────────────────────────────────────────────────
+  # Documents
+  # ──────────────────────────────────────────────────────────────────────────
+  async def get(self, model_cls: Type[T], uuid_val: str) -> Optional[T]:
+    return await self.run(self.provider.get_by_id, model_cls, uuid_val)
+
+  get_by_id = get
+
+  async def get_many_by_id(self, model_cls: Type[T], uuid_vals: List[str]) -> List[T]:
+    return await self.run(self.provider.get_many_by_id, model_cls, uuid_vals)
+
+  async def get_by_channel(self, model_cls: Type[T], channel_id: int) -> Optional[T]:
+    return await self.run(self.provider.get_by_channel, model_cls, channel_id)
+
+  async def get_available_characters(self, user_id: int) -> List[T]:
+    return await self.run(self.provider.get_available_characters, user_id)
+
+  async def get_character_template_by_id_or_name(self, user_id: int, user_name_id: str) -> Optional[T]:
+    return await self.run(self.provider.get_character_template_by_id_or_name, user_id, user_name_id)
+
+  async def insert(self, model: T) -> str:
+    return await self.run(self.provider.insert, model)
+
+  async def update(self, model: T) -> bool:
+    table = table_name_for(type(model))
+    doc = model.model_dump()
+    return await self.run(self.provider.update_documents, table, [doc]) > 0
+
+  async def flush(self) -> int:
+    return await self.run(self.provider.flush)
+
+  # ──────────────────────────────────────────────────────────────────────────
+  # Message history
+  # ──────────────────────────────────────────────────────────────────────────
+  async def append_message(self, scene: Scene, message: Message):
+    """Scene.append_message, with the log write done on the storage thread."""
+    count = await self.run(self.message_log.append, scene.id, message)
+    scene._record_append(message, count)
+
+  async def read_messages(self, scene_id: str, start: int = 0, end: Optional[int] = None) -> List[Message]:
+    return await self.run(self.message_log.read, scene_id, start, end)
@@ -0,0 +1,122 @@
+import os
+import threading
+from typing import Dict, Iterator, List
+
+from narrative.models import Message
+from utils.metrics import STORAGE_READ, STORAGE_WRITE
+
+
+class MessageLog:
+  """
+  Segmented, append-only message history, one directory per scene:
+
+    <root>/<scene id>/000000.jsonl
+    <root>/<scene id>/000001.jsonl
+    ...
+
+  Each segment holds *segment_size* messages, one JSON document per line.
+  Appending writes a single line to the newest segment, so it costs the same
+  no matter how long the scene has run; reads only open the segments that
+  cover the requested range.
+  """
+
+  def __init__(self, root: str = 'data/messages', segment_size: int = 256, fsync: bool = False):
+    """
+    :param fsync: force every append to disk before returning, so an
+                  acknowledged message survives a power loss, not just a crash
+    """
+    self.root = root
+    self.segment_size = segment_size
+    self.fsync = fsync
+    self.lock = threading.RLock()
+    # scene id -> number of messages on disk; the log itself is the source of
+    # truth, this just saves re-counting the newest segment on every append.
+    self.counts: Dict[str, int] = {}
+
+  def _scene_dir(self, scene_id: str) -> str:
+    return os.path.join(self.root, scene_id)
+
+  def _segment_path(self, scene_id: str, segment: int) -> str:
+    return os.path.join(self._scene_dir(scene_id), f"{segment:06d}.jsonl")
+
+  def _segments(self, scene_id: str) -> List[int]:
+    try:
+      names = os.listdir(self._scene_dir(scene_id))
+    except FileNotFoundError:
+      return []
+    return sorted(int(name[:-len(".jsonl")]) for name in names if name.endswith(".jsonl"))
+
+  def _read_segment(self, scene_id: str, segment: int) -> List[Message]:
+    try:
+      with open(self._segment_path(scene_id, segment), "r", encoding="utf-8") as f:
+        return [Message.model_validate_json(line) for line in f if line.endswith("\n")]
+    except FileNotFoundError:
+      return []
+
+  def count(self, scene_id: str) -> int:
+    with self.lock:
+      if scene_id in self.counts:
+        return self.counts[scene_id]
+
+      segments = self._segments(scene_id)
+      if not segments:
+        total = 0
+      else:
+        last = segments[-1]
+        path = self._segment_path(scene_id, last)
+        with open(path, "rb+") as f:
+          data = f.read()
+          # A crash mid-append can leave a torn last line; drop it.
+          if data and not data.endswith(b"\n"):
+            f.truncate(data.rfind(b"\n") + 1)
+            data = data[:data.rfind(b"\n") + 1]
+        total = last * self.segment_size + data.count(b"\n")
+      self.counts[scene_id] = total
+      return total
+
+  @STORAGE_WRITE.time(op="message_log.append")
+  def append(self, scene_id: str, message: Message) -> int:
+    """Append *message* to the scene's log and return the new message count."""
+    with self.lock:
+      index = self.count(scene_id)
+      path = self._segment_path(scene_id, index // self.segment_size)
+      os.makedirs(os.path.dirname(path), exist_ok=True)
+      with open(path, "a", encoding="utf-8") as f:
+        f.write(message.model_dump_json() + "\n")
+        if self.fsync:
+          f.flush()
+          os.fsync(f.fileno())
+      self.counts[scene_id] = index + 1
+      return index + 1
+
+  @STORAGE_READ.time(op="message_log.read")
+  def read(self, scene_id: str, start: int = 0, end: int | None = None) -> List[Message]:
+    """Messages with index in [start, end), oldest first."""
+    total = self.count(scene_id)
+    end = total if end is None else min(end, total)
+    start = max(start, 0)
+    if start >= end:
+      return []
+
+    messages: List[Message] = []
+    first, last = start // self.segment_size, (end - 1) // self.segment_size
+    for segment in range(first, last + 1):
+      messages.extend(self._read_segment(scene_id, segment))
+    offset = first * self.segment_size
+    return messages[start - offset:end - offset]
+
+  def tail(self, scene_id: str, count: int) -> List[Message]:
+    """The newest *count* messages, oldest first."""
+    total = self.count(scene_id)
+    return self.read(scene_id, total - count, total)
+
+  def iter_reversed(self, scene_id: str) -> Iterator[Message]:
+    """Walk the history newest to oldest, one segment at a time."""
+    total = self.count(scene_id)
+    if not total:
+      return
+    for segment in range((total - 1) // self.segment_size, -1, -1):
+      messages = self._read_segment(scene_id, segment)
+      # Ignore anything appended after we took the count
+      messages = messages[:total - segment * self.segment_size]
+      yield from reversed(messages)
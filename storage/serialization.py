@@ -0,0 +1,145 @@
+import json
+import logging
+import zlib
+from typing import Any, Callable, Dict, Type, TypeVar, Union
+
+from pydantic import BaseModel
+
+try:
+  import orjson
+except ImportError:  # optional; stdlib json is used instead
+  orjson = None
+
+try:
+  import msgpack
+except ImportError:  # optional; only needed for the msgpack format
+  msgpack = None
+
+M = TypeVar('M', bound=BaseModel)
+Stored = Union[str, bytes]
+
+# Binary payloads start with one of these; JSON is stored as plain text, the
+# same way documents were stored before formats existed.
+MSGPACK_TAG = b"M"
+ZLIB_TAG = b"Z"
+
+
+def json_dumps(obj: Any) -> str:
+  """Compact JSON text, through orjson when it's installed."""
+  if orjson is not None:
+    return orjson.dumps(obj).decode()
+  return json.dumps(obj, separators=(",", ":"))
+
+
+class Codec:
+  """Turns a document into what is stored in the `doc` column."""
+  name = "json"
+  # What format_of() reports for documents this codec wrote
+  family = "json"
+
+  def encode(self, doc: dict) -> Stored:
+    return json.dumps(doc, separators=(",", ":"))
+
+
+class OrjsonCodec(Codec):
+  name = "orjson"
+
+  def encode(self, doc: dict) -> Stored:
+    return orjson.dumps(doc).decode()
+
+
+class MsgpackCodec(Codec):
+  name = "msgpack"
+  family = "msgpack"
+
+  def encode(self, doc: dict) -> Stored:
+    return MSGPACK_TAG + msgpack.packb(doc, use_bin_type=True)
+
+
+class CompressedCodec(Codec):
+  """Any other format, zlib-compressed; for big documents that are rarely written."""
+
+  def __init__(self, inner: Codec, level: int = 6):
+    self.inner = inner
+    self.level = level
+    self.name = f"{inner.name}+zlib"
+    self.family = f"{inner.family}+zlib"
+
+  def encode(self, doc: dict) -> Stored:
+    payload = self.inner.encode(doc)
+    if isinstance(payload, str):
+      payload = payload.encode()
+    return ZLIB_TAG + zlib.compress(payload, self.level)
+
+
+_FORMATS: Dict[str, Callable[[], Codec]] = {
+  "json": Codec,
+  "orjson": lambda: OrjsonCodec() if orjson is not None else _fallback("orjson"),
+  "msgpack": lambda: MsgpackCodec() if msgpack is not None else _fallback("msgpack"),
+}
+
+
+def _fallback(name: str) -> Codec:
+  logging.warning(f"Storage format '{name}' needs the {name} package, which isn't installed; using json")
+  return Codec()
+
+
+def get_codec(spec: str) -> Codec:
+  """
+  A codec for *spec*: "json", "orjson" or "msgpack", optionally followed by
+  "+zlib" for compression (e.g. "orjson+zlib").
+  """
+  name, _, compression = spec.partition("+")
+  if name not in _FORMATS or compression not in ("", "zlib"):
+    raise ValueError(f"Unknown storage format '{spec}'")
+  codec = _FORMATS[name]()
+  return CompressedCodec(codec) if compression else codec
+
+
+def load_model(model_cls: Type[M], stored: Stored) -> M:
+  """
+  Rebuild a model from a stored document, whatever format it was written in.
+  JSON goes straight through pydantic's `model_validate_json`.
+  """
+  if isinstance(stored, str):
+    return model_cls.model_validate_json(stored)
+  tag, payload = stored[:1], stored[1:]
+  if tag == ZLIB_TAG:
+    payload = zlib.decompress(payload)
+    if payload[:1] != MSGPACK_TAG:
+      return model_cls.model_validate_json(payload)
+    tag, payload = payload[:1], payload[1:]
+  if tag == MSGPACK_TAG:
+    if msgpack is None:
+      raise RuntimeError("This document is stored as msgpack; install msgpack to read it")
+    return model_cls.model_validate(msgpack.unpackb(payload, raw=False))
+  # Bytes without a tag are JSON written through a bytes-returning encoder
+  return model_cls.model_validate_json(stored)
+
+
+def load_document(stored: Stored) -> dict:
+  """The raw document behind a stored value, without building a model."""
+  if isinstance(stored, str):
+    return json.loads(stored)
+  tag, payload = stored[:1], stored[1:]
+  if tag == ZLIB_TAG:
+    return load_document(_text_or_tagged(zlib.decompress(payload)))
+  if tag == MSGPACK_TAG:
+    if msgpack is None:
+      raise RuntimeError("This document is stored as msgpack; install msgpack to read it")
+    return msgpack.unpackb(payload, raw=False)
+  return json.loads(stored)
+
+
+def _text_or_tagged(payload: bytes) -> Stored:
+  return payload if payload[:1] == MSGPACK_TAG else payload.decode()
+
+
+def format_of(stored: Stored) -> str:
+  """The format a stored document was written in ("json" covers orjson too)."""
+  if isinstance(stored, str):
+    return "json"
+  if stored[:1] == ZLIB_TAG:
+    inner = zlib.decompress(stored[1:])
+    return ("msgpack" if inner[:1] == MSGPACK_TAG else "json") + "+zlib"
+  return "msgpack" if stored[:1] == MSGPACK_TAG else "json"
@@ -0,0 +1,17 @@
+from typing import Type
+
+# Model class name -> table the documents live in
+TABLE_NAMES = {
+  "CharacterTemplate": "characters",
+  "Scene": "scenes",
+  "Setting": "settings",
+  "SessionModel": "sessions",
+  "SessionState": "sessions",
+  "Narrative": "narratives",
+}
+
+def table_name_for(model_cls: Type) -> str:
+  try:
+    return TABLE_NAMES[model_cls.__name__]
+  except KeyError:
+    raise ValueError(f"No table registered for model: {model_cls.__name__}")
@@ -0,0 +1,198 @@
+import asyncio
+import json
+import logging
+import os
+import threading
+from typing import Any, Dict, List, Optional, Tuple, Type, TypeVar
+
+from narrative.models import DatabaseModel
+from storage.serialization import json_dumps
+from storage.tables import table_name_for
+from utils.metrics import STORAGE_READ, STORAGE_WRITE
+
+T = TypeVar('T', bound=DatabaseModel)
+
+
+class WriteBehindProvider:
+  """
+  Buffers `update()` calls in front of a SqliteDatabaseProvider.
+
+  An update only marks the document dirty and appends it to a small journal
+  file; the dirty set is written to the real store in one batch on every
+  `flush()` (on an interval, at the end of a round, and at shutdown).
+  Several updates of the same document in between collapse into one write.
+
+  The journal is replayed on startup, so anything `update()` returned True
+  for survives a crash. Reads see buffered documents; queries that can't be
+  answered from the buffer flush first.
+  """
+
+  def __init__(self, provider, *, journal_path: str = 'data/journal.jsonl', flush_interval: float = 2.0, fsync: bool = True):
+    self.provider = provider
+    self.journal_path = journal_path
+    self.flush_interval = flush_interval
+    self.fsync = fsync
+    self.lock = threading.RLock()
+    # (table, id) -> latest document
+    self.dirty: Dict[Tuple[str, str], dict] = {}
+    self._flusher: Optional[asyncio.Task] = None
+
+    self._replay_journal()
+    self.journal = open(journal_path, "a", encoding="utf-8")
+
+  def __getattr__(self, item: str) -> Any:
+    # Anything we don't buffer goes straight to the wrapped provider
+    return getattr(self.provider, item)
+
+  # ──────────────────────────────────────────────────────────────────────────
+  # Journal
+  # ──────────────────────────────────────────────────────────────────────────
+  def _replay_journal(self):
+    if not os.path.exists(self.journal_path):
+      return
+    pending: Dict[Tuple[str, str], dict] = {}
+    with open(self.journal_path, "r", encoding="utf-8") as f:
+      for line in f:
+        if not line.endswith("\n"):
+          break  # torn write; it was never acknowledged
+        record = json.loads(line)
+        pending[(record["table"], record["doc"]["id"])] = record["doc"]
+    if pending:
+      logging.warning(f"Replaying {len(pending)} journaled updates")
+      self._write(pending)
+    os.truncate(self.journal_path, 0)
+
+  def _journal(self, table: str, doc: dict):
+    self.journal.write(json_dumps({"table": table, "doc": doc}) + "\n")
+    self.journal.flush()
+    if self.fsync:
+      os.fsync(self.journal.fileno())
+
+  def _compact_journal(self):
+    # Only what is still dirty needs to survive a crash
+    self.journal.close()
+    tmp_path = self.journal_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+      for (table, _), doc in self.dirty.items():
+        f.write(json_dumps({"table": table, "doc": doc}) + "\n")
+      f.flush()
+      if self.fsync:
+        os.fsync(f.fileno())
+    os.replace(tmp_path, self.journal_path)
+    self.journal = open(self.journal_path, "a", encoding="utf-8")
+
+  # ──────────────────────────────────────────────────────────────────────────
+  # Writes
+  # ──────────────────────────────────────────────────────────────────────────
+  def _write(self, batch: Dict[Tuple[str, str], dict]):
+    by_table: Dict[str, List[dict]] = {}
+    for (table, _), doc in batch.items():
+      by_table.setdefault(table, []).append(doc)
+    for table, docs in by_table.items():
+      self.provider.update_documents(table, docs)
+
+  @STORAGE_WRITE.time(op="insert")
+  def insert(self, model: T) -> str:
+    return self.provider.insert(model)
+
+  def update(self, model: T) -> bool:
+    return self.update_documents(table_name_for(type(model)), [model.model_dump()]) > 0
+
+  @STORAGE_WRITE.time(op="update")
+  def update_documents(self, table: str, docs: List[dict]) -> int:
+    """
+    Buffer already-serialized documents; same contract as the provider's:
+    ones that aren't stored are skipped, and the count is of those taken.
+    """
+    with self.lock:
+      # Buffered documents are known to be stored; ask about the rest
+      unknown = [doc["id"] for doc in docs if (table, doc["id"]) not in self.dirty]
+      stored = self.provider.existing_ids(table, unknown)
+      taken = 0
+      for doc in docs:
+        if (table, doc["id"]) in self.dirty or doc["id"] in stored:
+          self._journal(table, doc)
+          self.dirty[(table, doc["id"])] = doc
+          taken += 1
+    return taken
+
+  @STORAGE_WRITE.time(op="flush")
+  def flush(self) -> int:
+    """Write every dirty document now. Returns how many were written."""
+    with self.lock:
+      if not self.dirty:
+        return 0
+      batch = self.dirty
+      self.dirty = {}
+      try:
+        self._write(batch)
+      except:
+        # Put the batch back (without clobbering anything newer) and let the
+        # journal keep covering it.
+        self.dirty = {**batch, **self.dirty}
+        raise
+      self._compact_journal()
+      return len(batch)
+
+  def _flush_table(self, table: str):
+    with self.lock:
+      if any(key[0] == table for key in self.dirty):
+        self.flush()
+
+  async def _run_flusher(self):
+    while True:
+      await asyncio.sleep(self.flush_interval)
+      try:
+        await asyncio.to_thread(self.flush)
+      except Exception:
+        logging.exception("Write-behind flush failed")
+
+  def start(self):
+    """Start the periodic flush task on the running event loop."""
+    if self._flusher is None or self._flusher.done():
+      self._flusher = asyncio.get_running_loop().create_task(self._run_flusher())
+
+  async def stop(self):
+    if self._flusher is not None:
+      self._flusher.cancel()
+      self._flusher = None
+    await asyncio.to_thread(self.flush)
+
+  # ──────────────────────────────────────────────────────────────────────────
+  # Reads
+  # ──────────────────────────────────────────────────────────────────────────
+  @STORAGE_READ.time(op="get_by_id")
+  def get_by_id(self, model_cls: Type[T], uuid_val: str) -> Optional[T]:
+    with self.lock:
+      doc = self.dirty.get((table_name_for(model_cls), uuid_val))
+    if doc is not None:
+      return model_cls(**doc)
+    return self.provider.get_by_id(model_cls, uuid_val)
+
+  @STORAGE_READ.time(op="get_many_by_id")
+  def get_many_by_id(self, model_cls: Type[T], uuid_vals: List[str]) -> List[T]:
+    table = table_name_for(model_cls)
+    with self.lock:
+      buffered = {id: self.dirty[(table, id)] for id in uuid_vals if (table, id) in self.dirty}
+    models = [model_cls(**doc) for doc in buffered.values()]
+    rest = [id for id in uuid_vals if id not in buffered]
+    return models + (self.provider.get_many_by_id(model_cls, rest) if rest else [])
+
+  @STORAGE_READ.time(op="get_by_channel")
+  def get_by_channel(self, model_cls: Type[T], channel_id: int) -> Optional[T]:
+    table = table_name_for(model_cls)
+    with self.lock:
+      doc = next((doc for (t, _), doc in self.dirty.items() if t == table and doc.get("channel_id") == channel_id), None)
+    if doc is not None:
+      return model_cls(**doc)
+    return self.provider.get_by_channel(model_cls, channel_id)
+
+  @STORAGE_READ.time(op="get_available_characters")
+  def get_available_characters(self, user_id: int) -> List[T]:
+    self._flush_table("characters")
+    return self.provider.get_available_characters(user_id)
+
+  @STORAGE_READ.time(op="get_character_template_by_id_or_name")
+  def get_character_template_by_id_or_name(self, user_id: int, user_name_id: str) -> Optional[T]:
+    self._flush_table("characters")
+    return self.provider.get_character_template_by_id_or_name(user_id, user_name_id)
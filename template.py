@@ -17,6 +17,7 @@ class Template:
     def __init__(self, template_str: str):
         self.template_str = template_str
         self.tokens = self._parse(template_str)
+        self.plan = self._compile(self.tokens)
 
     def _parse(self, text: str):
         """
@@ -56,43 +57,33 @@ class Template:
             tokens.append(("text", text[pos:]))
         return tokens
 
-    def _resolve(self, varname: str, context: dict):
+    def _compile(self, tokens) -> list:
         """
-        Resolve a possibly-dotted varname from context dict.
-        E.g. "character.name" -> context['character']['name']
-        """
-        parts = varname.split('.')
-        val = context
-        for part in parts:
-            if isinstance(val, dict):
-                val = val.get(part)
-            else:
-                val = getattr(val, part, None)
-            if val is None:
-                return None
-        return val
+        Turn a token list into a render plan: a list of closures, each taking
+        (scope, out) and appending its output to *out*.
 
-    def _render_tokens(self, tokens, context: dict) -> str:
-        output = []
-        stack = []  # for if skip states
-        skip = False
+        Block structure is matched here, once, instead of on every render;
+        attribute paths are split up front, and loop variables are bound in
+        a chained _Scope rather than a copy of the whole context.
+        """
+        nodes = []
+        stack = []  # (condition path, enclosing node list) for open ifs
         i = 0
         while i < len(tokens):
             ttype, val = tokens[i]
             if ttype == "text":
-                if not skip:
-                    output.append(val)
+                nodes.append(_text_node(val))
             elif ttype == "var":
-                if not skip:
-                    resolved = self._resolve(val, context)
-                    output.append(str(resolved) if resolved is not None else "")
+                nodes.append(_var_node(_resolver(val)))
             elif ttype == "if":
-                resolved = self._resolve(val, context)
-                cond = bool(resolved)
-                stack.append(skip)
-                skip = skip or not cond
+                stack.append((val, nodes))
+                nodes = []
             elif ttype == "endif":
-                skip = stack.pop() if stack else False
+                # an unmatched endif is a no-op
+                if stack:
+                    cond, parent = stack.pop()
+                    parent.append(_if_node(_resolver(cond), nodes))
+                    nodes = parent
             elif ttype == "for":
                 loop_var, list_name = val
                 # find matching endfor
@@ -105,22 +96,117 @@ class Template:
                     elif tokens[j][0] == "endfor":
                         depth -= 1
                     j += 1
-                inner_tokens = tokens[inner_start:j-1]
-                if not skip:
-                    iterable = self._resolve(list_name, context) or []
-                    for item in iterable:
-                        new_ctx = context.copy()
-                        new_ctx[loop_var] = item
-                        output.append(self._render_tokens(inner_tokens, new_ctx))
+                body = self._compile(tokens[inner_start:j-1])
+                nodes.append(_for_node(loop_var, list_name, _resolver(list_name), body))
                 i = j - 1
             # endfor is a no-op here
             i += 1
-        return "".join(output)
+        # an unterminated if runs to the end of its block
+        while stack:
+            cond, parent = stack.pop()
+            parent.append(_if_node(_resolver(cond), nodes))
+            nodes = parent
+        return nodes
 
     def render(self, context: dict) -> str:
-        return self._render_tokens(self.tokens, context)
+        return self.render_plan(self.plan, context)
+
+    @staticmethod
+    def render_plan(plan: list, context: dict) -> str:
+        out = []
+        for node in plan:
+            node(context, out)
+        return "".join(out)
+
+    @staticmethod
+    def render_loop_item(body: list, loop_var: str, item, context: dict) -> str:
+        """Render one iteration of a loop body, as the loop itself would."""
+        return Template.render_plan(body, _Scope(loop_var, item, context))
+
+    def split_at_loop(self, list_name: str):
+        """
+        Split the top-level plan around the first `{% for x in <list_name> %}`
+        loop, so the parts before and after it and each iteration can be
+        rendered separately. Returns (before, loop_var, body, after), or None
+        if there is no such loop at the top level.
+        """
+        for i, node in enumerate(self.plan):
+            loop = getattr(node, "loop", None)
+            if loop and loop[1] == list_name:
+                loop_var, _, body = loop
+                return self.plan[:i], loop_var, body, self.plan[i + 1:]
+        return None
 
     @classmethod
     def from_file(cls, filepath: str):
         with open(filepath, "r", encoding="utf-8") as f:
             return cls(f.read())
+
+
+class _Scope:
+    """One loop variable binding, chained onto the enclosing scope."""
+    __slots__ = ("name", "value", "parent")
+
+    def __init__(self, name: str, value, parent):
+        self.name = name
+        self.value = value
+        self.parent = parent
+
+
+def _resolver(varname: str):
+    """
+    Build a function resolving a possibly-dotted varname against a scope.
+    E.g. "character.name" -> scope['character']['name']
+    """
+    head, *rest = varname.split('.')
+
+    def resolve(scope):
+        while type(scope) is _Scope:
+            if scope.name == head:
+                val = scope.value
+                break
+            scope = scope.parent
+        else:
+            val = scope.get(head) if isinstance(scope, dict) else getattr(scope, head, None)
+        for part in rest:
+            if val is None:
+                return None
+            if isinstance(val, dict):
+                val = val.get(part)
+            else:
+                val = getattr(val, part, None)
+        return val
+
+    return resolve
+
+
+def _text_node(text: str):
+    def render(scope, out):
+        out.append(text)
+    return render
+
+
+def _var_node(resolve):
+    def render(scope, out):
+        resolved = resolve(scope)
+        out.append(str(resolved) if resolved is not None else "")
+    return render
+
+
+def _if_node(resolve, body):
+    def render(scope, out):
+        if resolve(scope):
+            for node in body:
+                node(scope, out)
+    return render
+
+
+def _for_node(loop_var: str, list_name: str, resolve, body):
+    def render(scope, out):
+        for item in resolve(scope) or []:
+            item_scope = _Scope(loop_var, item, scope)
+            for node in body:
+                node(item_scope, out)
+    # kept for Template.split_at_loop
+    render.loop = (loop_var, list_name, body)
+    return render
@@ -0,0 +1,56 @@
+import os
+
+import pytest
+
+from narrative.models import CharacterTemplate
+
+
+@pytest.fixture(params=["tinydb", "sqlite"])
+def provider(request, tmp_path, monkeypatch):
+  # Both providers keep their files under data/ relative to the working directory
+  monkeypatch.chdir(tmp_path)
+  os.makedirs("data")
+  from db import DatabaseProvider, SqliteDatabaseProvider
+  if request.param == "tinydb":
+    yield DatabaseProvider()
+    return
+  provider = SqliteDatabaseProvider(os.path.join("data", "test.db"))
+  yield provider
+  provider.conn.close()
+
+
+def template(name: str, creator_id: int = 7) -> CharacterTemplate:
+  return CharacterTemplate(name=name, creator_id=creator_id, creator_session_id=1, personality="Calm.")
+
+
+def test_template_by_id_or_name(provider):
+  ann = template("Ann")
+  provider.insert(ann)
+  provider.insert(template("Ann", creator_id=8))
+
+  by_name = provider.get_character_template_by_id_or_name(7, "Ann")
+  assert by_name == ann
+  assert provider.get_character_template_by_id_or_name(7, ann.id) == ann
+  assert provider.get_character_template_by_id_or_name(7, "Bea") is None
+  # Only the user's own templates
+  assert provider.get_character_template_by_id_or_name(9, "Ann") is None
+
+
+def test_get_by_channel(provider):
+  from narrative.session_state import SessionModel
+  session = SessionModel(channel_id=1234)
+  provider.insert(session)
+
+  assert provider.get_by_channel(SessionModel, 1234) == session
+  assert provider.get_by_channel(SessionModel, 999) is None
+
+
+def test_get_by_id_and_update(provider):
+  ann = template("Ann")
+  provider.insert(ann)
+  assert provider.get_by_id(CharacterTemplate, ann.id) == ann
+  assert provider.get_many_by_id(CharacterTemplate, [ann.id, "missing"]) == [ann]
+
+  ann.personality = "Restless."
+  assert provider.update(ann)
+  assert provider.get_by_id(CharacterTemplate, ann.id).personality == "Restless."
@@ -0,0 +1,33 @@
+from utils.lru import LRUCache
+
+
+def test_evicts_least_recently_used():
+  evicted = []
+  cache = LRUCache(capacity=2, on_evict=lambda k, v: evicted.append(k))
+  cache.put("a", 1)
+  cache.put("b", 2)
+  cache.get("a")
+  cache.put("c", 3)
+  assert evicted == ["b"]
+  assert "a" in cache and "c" in cache
+
+
+def test_pinned_keys_are_not_evicted():
+  cache = LRUCache(capacity=2)
+  cache.put("a", 1)
+  cache.pin("a")
+  cache.put("b", 2)
+  cache.put("c", 3)
+  assert "a" in cache and "b" not in cache
+
+  # Over capacity rather than dropping a pinned entry
+  cache.pin("c")
+  cache.pin("d")
+  cache.put("d", 4)
+  cache.put("e", 5)
+  assert set(cache.entries) == {"a", "c", "d"}
+
+  cache.unpin("a")
+  cache.put("f", 6)
+  assert "a" not in cache
+  assert cache.stats()["pinned"] == 2
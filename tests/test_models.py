@@ -0,0 +1,40 @@
+import pytest
+
+from narrative import models
+from narrative.models import Message, Scene
+from storage.message_log import MessageLog
+
+
+@pytest.fixture
+def message_log(tmp_path):
+  previous = models._message_log
+  log = MessageLog(str(tmp_path / "messages"))
+  models.use_message_log(log)
+  yield log
+  models.use_message_log(previous)
+
+
+def legacy_document(count: int):
+  messages = [{"character_id": "c", "character_name": "Ann", "content": f"Pose {i}."} for i in range(count)]
+  return {"id": "scene-1", "name": "The inn", "messages": messages}
+
+
+def test_legacy_messages_move_into_the_log(message_log):
+  scene = Scene.model_validate(legacy_document(3))
+  assert scene.message_count == 3
+  assert scene.legacy_messages is None
+  assert [m.content for m in message_log.read("scene-1")] == ["Pose 0.", "Pose 1.", "Pose 2."]
+
+  # Loading the not yet rewritten document again doesn't duplicate anything
+  Scene.model_validate(legacy_document(3))
+  assert message_log.count("scene-1") == 3
+
+
+def test_interrupted_migration_is_completed(message_log):
+  # As if the process died after moving the first two messages
+  for i in range(2):
+    message_log.append("scene-1", Message(character_id="c", character_name="Ann", content=f"Pose {i}."))
+
+  scene = Scene.model_validate(legacy_document(5))
+  assert scene.message_count == 5
+  assert [m.content for m in message_log.read("scene-1")] == [f"Pose {i}." for i in range(5)]
@@ -0,0 +1,138 @@
+import asyncio
+
+import pytest
+
+from bench.stub_server import StubCompletionServer
+from inference.pool import Backend, BackendPool, NoBackendAvailable
+from inference.scheduler import InferenceScheduler
+
+REQUEST = {"prompt": "Hello", "max_tokens": 8}
+
+
+def run(coro):
+  return asyncio.run(coro)
+
+
+async def make_pool(stub: StubCompletionServer, *, timeout: float = 5.0, cooldown: float = 0.3):
+  await stub.start()
+  scheduler = InferenceScheduler(max_inflight=0)
+  backend = Backend(stub.url, retries=0, timeout=timeout, max_inflight=2)
+  pool = BackendPool([backend], failure_threshold=2, cooldown=cooldown, health_timeout=timeout, on_capacity_change=scheduler.set_capacity)
+  return pool, backend, scheduler
+
+
+async def generate(pool: BackendPool, scheduler: InferenceScheduler):
+  async with scheduler.slot("channel"):
+    return await pool.post('/v1/completions', json=REQUEST)
+
+
+def test_circuit_trips_half_opens_and_recovers():
+  async def scenario():
+    stub = StubCompletionServer(ttft=0, tokens=3, tokens_per_sec=1000, error_rate=1.0, seed=1)
+    pool, backend, scheduler = await make_pool(stub)
+    try:
+      # Trip: failure_threshold failures in a row open the circuit
+      for _ in range(2):
+        with pytest.raises(NoBackendAvailable):
+          await generate(pool, scheduler)
+      assert not backend.available
+      assert scheduler.max_inflight == 0
+      # Nothing waits on a pool with no capacity
+      with pytest.raises(NoBackendAvailable):
+        await generate(pool, scheduler)
+      assert stub.requests == 2
+
+      # Half-open: after the cooldown one request is let through, and one
+      # more failure opens the circuit straight away
+      await asyncio.sleep(0.35)
+      assert backend.available
+      assert scheduler.max_inflight == 2
+      with pytest.raises(NoBackendAvailable):
+        await generate(pool, scheduler)
+      assert not backend.available
+      assert stub.requests == 3
+
+      # Recovery: a success closes the circuit again
+      stub.error_rate = 0.0
+      await asyncio.sleep(0.35)
+      response = await generate(pool, scheduler)
+      assert response["choices"][0]["text"]
+      assert backend.available and backend.failures == 0
+      assert scheduler.max_inflight == 2
+    finally:
+      await pool.close()
+      await stub.stop()
+
+  run(scenario())
+
+
+def test_timeouts_count_as_failures():
+  async def scenario():
+    stub = StubCompletionServer(ttft=0, tokens=3, tokens_per_sec=1000, stall=1.0)
+    pool, backend, scheduler = await make_pool(stub, timeout=0.2)
+    try:
+      for _ in range(2):
+        with pytest.raises(NoBackendAvailable):
+          await generate(pool, scheduler)
+      assert not backend.available
+    finally:
+      await pool.close()
+      await stub.stop()
+
+  run(scenario())
+
+
+def test_probe_failures_count_towards_the_threshold():
+  async def scenario():
+    stub = StubCompletionServer(error_rate=1.0)
+    pool, backend, scheduler = await make_pool(stub)
+    try:
+      await pool.probe(backend)
+      # One failed probe isn't enough to take it out of rotation
+      assert backend.available and not backend.healthy
+      await pool.probe(backend)
+      assert not backend.available
+      assert scheduler.max_inflight == 0
+
+      stub.error_rate = 0.0
+      await pool.probe(backend)
+      assert backend.available and backend.healthy
+      assert scheduler.max_inflight == 2
+    finally:
+      await pool.close()
+      await stub.stop()
+
+  run(scenario())
+
+
+def test_waiters_fail_when_capacity_drops_to_zero():
+  async def scenario():
+    scheduler = InferenceScheduler(max_inflight=1)
+    granted = asyncio.Event()
+    release = asyncio.Event()
+
+    async def holder():
+      async with scheduler.slot("a"):
+        granted.set()
+        await release.wait()
+
+    async def waiter():
+      async with scheduler.slot("b"):
+        pass
+
+    holding = asyncio.create_task(holder())
+    await granted.wait()
+    waiting = asyncio.create_task(waiter())
+    await asyncio.sleep(0)
+    assert scheduler.queued == 1
+
+    scheduler.set_capacity(0)
+    with pytest.raises(NoBackendAvailable):
+      await waiting
+    assert scheduler.queued == 0
+
+    release.set()
+    await holding
+    assert scheduler.inflight == 0
+
+  run(scenario())
@@ -0,0 +1,119 @@
+import os
+import random
+from types import SimpleNamespace
+
+import pytest
+
+from template import Template
+from tests.reference_template import ReferenceTemplate
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+CORPUS = os.path.join(HERE, "template_corpus")
+DEFAULT_TEMPLATE = os.path.join(os.path.dirname(HERE), "default_template.txt")
+
+
+def corpus_files():
+  return sorted(name for name in os.listdir(CORPUS) if name.endswith(".txt"))
+
+
+def contexts():
+  """The same data once as plain dicts and once as objects, plus near-empty ones."""
+  users = [
+    {"name": "Ann", "profile": {"title": "Captain"}, "tags": ["brave", "tall"]},
+    {"name": "Bea", "profile": {"title": ""}, "tags": []},
+    {"name": "Cid", "profile": None, "tags": ["quiet"]},
+  ]
+  as_dicts = {
+    "name": "Lily",
+    "age": 30,
+    "zero": 0,
+    "empty": "",
+    "no": False,
+    "user": users[0],
+    "users": users,
+    "items": ["one", "two", 3],
+    "empty_list": [],
+    "grid": [["a", "", "b"], [], [0, "c"]],
+  }
+
+  def objects(value):
+    if isinstance(value, dict):
+      return SimpleNamespace(**{k: objects(v) for k, v in value.items()})
+    if isinstance(value, list):
+      return [objects(v) for v in value]
+    return value
+
+  as_objects = {key: objects(value) for key, value in as_dicts.items()}
+  return {
+    "dicts": as_dicts,
+    "objects": as_objects,
+    "empty": {},
+    "name_only": {"name": "Lily"},
+  }
+
+
+CONTEXTS = contexts()
+
+
+@pytest.mark.parametrize("context_name", sorted(CONTEXTS))
+@pytest.mark.parametrize("filename", corpus_files())
+def test_corpus_matches_reference(filename, context_name):
+  with open(os.path.join(CORPUS, filename), "r", encoding="utf-8") as f:
+    source = f.read()
+  context = CONTEXTS[context_name]
+  assert Template(source).render(context) == ReferenceTemplate(source).render(context)
+
+
+def prompt_context(messages: int):
+  characters = [
+    SimpleNamespace(name="Ann", personality="Curious and guarded.", physical_description="Tall.", clothing_description="A coat.", clothing="A coat."),
+    SimpleNamespace(name="Bea", personality="", physical_description=None, clothing_description=None, clothing=None),
+  ]
+  return {
+    "characters": characters,
+    "acting_character": characters[0],
+    "users": "Lily",
+    "summary": "They met at the inn.",
+    "setting": None,
+    "messages": [SimpleNamespace(character_name=characters[i % 2].name, content=f"Pose {i}.\nSecond line.") for i in range(messages)],
+  }
+
+
+def test_default_template_matches_reference():
+  template = Template.from_file(DEFAULT_TEMPLATE)
+  reference = ReferenceTemplate.from_file(DEFAULT_TEMPLATE)
+  for messages in (0, 1, 300):
+    context = prompt_context(messages)
+    assert template.render(context) == reference.render(context)
+
+
+def test_split_at_loop_renders_the_same():
+  # How the prompt builder renders the history one message at a time
+  template = Template.from_file(DEFAULT_TEMPLATE)
+  context = prompt_context(20)
+  before, loop_var, body, after = template.split_at_loop("messages")
+  pieces = [Template.render_plan(before, context)]
+  pieces += [Template.render_loop_item(body, loop_var, message, context) for message in context["messages"]]
+  pieces.append(Template.render_plan(after, context))
+  assert "".join(pieces) == template.render(context)
+
+
+# Random templates, malformed nesting included; generated from a fixed seed
+# so every run checks the same ones
+FRAGMENTS = [
+  "text ", "\n", "{{ name }}", "{{ user.name }}", "{{ user.profile.title }}", "{{ item }}", "{{ nobody }}", "{{ zero }}",
+  "{% if name %}", "{% if zero %}", "{% if user.profile.title %}", "{% if item %}", "{% endif %}",
+  "{% for item in items %}", "{% for user in users %}", "{% for item in nothing %}", "{% for item in grid %}", "{% endfor %}",
+]
+
+
+def random_templates(count: int, seed: int = 2024):
+  rng = random.Random(seed)
+  for _ in range(count):
+    yield "".join(rng.choice(FRAGMENTS) for _ in range(rng.randint(0, 30)))
+
+
+def test_random_templates_match_reference():
+  for source in random_templates(2000):
+    for context in CONTEXTS.values():
+      assert Template(source).render(context) == ReferenceTemplate(source).render(context), source
@@ -0,0 +1,42 @@
+import pytest
+
+from db import SqliteDatabaseProvider
+from narrative.models import CharacterTemplate
+from storage.write_behind import WriteBehindProvider
+
+
+@pytest.fixture
+def store(tmp_path):
+  provider = SqliteDatabaseProvider(str(tmp_path / "test.db"))
+  store = WriteBehindProvider(provider, journal_path=str(tmp_path / "journal.jsonl"), fsync=False)
+  yield store
+  store.journal.close()
+  provider.conn.close()
+
+
+def template(name: str) -> CharacterTemplate:
+  return CharacterTemplate(name=name, creator_id=7, creator_session_id=1)
+
+
+def test_update_is_buffered_until_flush(store):
+  ann = template("Ann")
+  store.insert(ann)
+  ann.personality = "Restless."
+  assert store.update(ann)
+  assert store.get_by_id(CharacterTemplate, ann.id).personality == "Restless."
+  assert store.provider.get_by_id(CharacterTemplate, ann.id).personality is None
+
+  assert store.flush() == 1
+  assert store.provider.get_by_id(CharacterTemplate, ann.id).personality == "Restless."
+
+
+def test_update_of_a_missing_document_is_refused(store):
+  ann = template("Ann")
+  store.insert(ann)
+  ghost = template("Ghost")
+  assert not store.update(ghost)
+  assert store.get_by_id(CharacterTemplate, ghost.id) is None
+
+  # Only the stored one of a batch is taken
+  assert store.update_documents("characters", [ann.model_dump(), ghost.model_dump()]) == 1
+  assert store.flush() == 1
@@ -0,0 +1,18 @@
+import functools
+
+import yaml
+
+try:
+  from yaml import CSafeLoader as SafeLoader
+except ImportError:  # PyYAML built without libyaml
+  from yaml import SafeLoader
+
+
+@functools.lru_cache(maxsize=None)
+def load_config(path: str = 'model.yml') -> dict:
+  """
+  model.yml, parsed once per process and with libyaml when PyYAML has it;
+  every module that reads settings shares this copy, so don't modify it.
+  """
+  with open(path, "r") as f:
+    return yaml.load(f, Loader=SafeLoader) or {}
@@ -0,0 +1,76 @@
+from collections import OrderedDict
+from typing import Callable, Generic, Hashable, Optional, Set, TypeVar
+
+K = TypeVar('K', bound=Hashable)
+V = TypeVar('V')
+
+
+class LRUCache(Generic[K, V]):
+  """
+  Bounded mapping that evicts the least recently used entry once it holds
+  *capacity* items. Pinned keys are never evicted, so the cache may run over
+  capacity by as many entries as are pinned. Keeps hit/miss/eviction
+  counters for diagnostics.
+  """
+
+  def __init__(self, capacity: int = 256, on_evict: Optional[Callable[[K, V], None]] = None):
+    self.capacity = capacity
+    self.on_evict = on_evict
+    self.entries: OrderedDict[K, V] = OrderedDict()
+    self.pinned: Set[K] = set()
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+
+  def __len__(self) -> int:
+    return len(self.entries)
+
+  def __contains__(self, key: K) -> bool:
+    return key in self.entries
+
+  def get(self, key: K) -> Optional[V]:
+    try:
+      value = self.entries[key]
+    except KeyError:
+      self.misses += 1
+      return None
+    self.entries.move_to_end(key)
+    self.hits += 1
+    return value
+
+  def put(self, key: K, value: V):
+    self.entries[key] = value
+    self.entries.move_to_end(key)
+    while len(self.entries) > self.capacity:
+      old_key = next((k for k in self.entries if k not in self.pinned), None)
+      if old_key is None:
+        break
+      old_value = self.entries.pop(old_key)
+      self.evictions += 1
+      if self.on_evict:
+        self.on_evict(old_key, old_value)
+
+  def pin(self, key: K):
+    """Keep *key* cached, whatever else is put, until it is unpinned."""
+    self.pinned.add(key)
+
+  def unpin(self, key: K):
+    self.pinned.discard(key)
+
+  def pop(self, key: K) -> Optional[V]:
+    return self.entries.pop(key, None)
+
+  def clear(self):
+    self.entries.clear()
+
+  def stats(self) -> dict:
+    total = self.hits + self.misses
+    return {
+      "size": len(self.entries),
+      "capacity": self.capacity,
+      "pinned": len(self.pinned),
+      "hits": self.hits,
+      "misses": self.misses,
+      "evictions": self.evictions,
+      "hit_rate": self.hits / total if total else 0.0,
+    }
@@ -0,0 +1,228 @@
+import bisect
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+LabelSet = Tuple[Tuple[str, str], ...]
+# (name, type, help, labels, value), as produced by collectors
+Sample = Tuple[str, str, str, Dict[str, str], float]
+
+SECONDS = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60, 120)
+TOKENS = (256, 512, 1024, 2048, 4096, 8192, 16384, 32768, 65536, 131072)
+
+
+def _labels(labels: Dict[str, object]) -> LabelSet:
+  return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(labels: Iterable[Tuple[str, str]]) -> str:
+  labels = list(labels)
+  if not labels:
+    return ""
+  escape = lambda v: v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+  return "{" + ",".join(f'{k}="{escape(v)}"' for k, v in labels) + "}"
+
+
+class Histogram:
+  """Cumulative-bucket histogram, one series per label set, Prometheus style."""
+
+  def __init__(self, name: str, help: str, buckets: Sequence[float] = SECONDS):
+    self.name = name
+    self.help = help
+    self.buckets = tuple(buckets)
+    self.lock = threading.Lock()
+    # labels -> (per-bucket counts, with a final +Inf slot; sum; count)
+    self.series: Dict[LabelSet, Tuple[List[int], List[float]]] = {}
+
+  def observe(self, value: float, **labels):
+    key = _labels(labels)
+    with self.lock:
+      series = self.series.get(key)
+      if series is None:
+        series = self.series[key] = ([0] * (len(self.buckets) + 1), [0.0, 0])
+      series[0][bisect.bisect_left(self.buckets, value)] += 1
+      series[1][0] += value
+      series[1][1] += 1
+
+  @contextmanager
+  def time(self, **labels) -> Iterator[None]:
+    """Observe how long the block (or decorated function) takes, in seconds."""
+    started = time.perf_counter()
+    try:
+      yield
+    finally:
+      self.observe(time.perf_counter() - started, **labels)
+
+  def quantile(self, q: float, counts: List[int]) -> Optional[float]:
+    """Estimate the *q* quantile from bucket *counts*, interpolating inside the bucket."""
+    total = sum(counts)
+    if not total:
+      return None
+    rank = q * total
+    seen = 0
+    for i, count in enumerate(counts):
+      if seen + count >= rank and count:
+        lower = self.buckets[i - 1] if i > 0 else 0.0
+        if i == len(self.buckets):
+          return lower  # beyond the last bucket; the best we can say
+        return lower + (self.buckets[i] - lower) * (rank - seen) / count
+      seen += count
+    return self.buckets[-1]
+
+  def summary(self) -> List[dict]:
+    with self.lock:
+      series = [(labels, list(counts), list(totals)) for labels, (counts, totals) in self.series.items()]
+    return [
+      {
+        "labels": dict(labels),
+        "count": int(count),
+        "mean": total / count if count else None,
+        "p50": self.quantile(0.5, counts),
+        "p95": self.quantile(0.95, counts),
+      }
+      for labels, counts, (total, count) in series
+    ]
+
+  def render(self) -> List[str]:
+    lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+    with self.lock:
+      series = [(labels, list(counts), list(totals)) for labels, (counts, totals) in self.series.items()]
+    for labels, counts, (total, count) in series:
+      cumulative = 0
+      for bound, bucket in zip(list(self.buckets) + ["+Inf"], counts):
+        cumulative += bucket
+        lines.append(f"{self.name}_bucket{_format_labels(labels + (('le', str(bound)),))} {cumulative}")
+      lines.append(f"{self.name}_sum{_format_labels(labels)} {total}")
+      lines.append(f"{self.name}_count{_format_labels(labels)} {int(count)}")
+    return lines
+
+
+class Counter:
+  def __init__(self, name: str, help: str):
+    self.name = name
+    self.help = help
+    self.lock = threading.Lock()
+    self.values: Dict[LabelSet, float] = {}
+
+  def inc(self, amount: float = 1, **labels):
+    key = _labels(labels)
+    with self.lock:
+      self.values[key] = self.values.get(key, 0) + amount
+
+  def render(self) -> List[str]:
+    lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+    with self.lock:
+      values = list(self.values.items())
+    lines.extend(f"{self.name}{_format_labels(labels)} {value}" for labels, value in values)
+    return lines
+
+
+class MetricsRegistry:
+  """
+  Every histogram and counter in the process, plus collectors that report
+  values owned by someone else (cache and scheduler counters) when scraped.
+  """
+
+  def __init__(self):
+    self.metrics: Dict[str, object] = {}
+    self.collectors: List[Callable[[], Iterable[Sample]]] = []
+
+  def histogram(self, name: str, help: str, buckets: Sequence[float] = SECONDS) -> Histogram:
+    return self.metrics.setdefault(name, Histogram(name, help, buckets))
+
+  def counter(self, name: str, help: str) -> Counter:
+    return self.metrics.setdefault(name, Counter(name, help))
+
+  def collector(self, fn: Callable[[], Iterable[Sample]]):
+    self.collectors.append(fn)
+    return fn
+
+  def collect(self) -> List[Sample]:
+    samples: List[Sample] = []
+    for collector in self.collectors:
+      try:
+        samples.extend(collector())
+      except Exception:
+        logging.exception("Metrics collector failed")
+    return samples
+
+  def render(self) -> str:
+    """Everything in the Prometheus text exposition format."""
+    lines: List[str] = []
+    for metric in self.metrics.values():
+      lines.extend(metric.render())
+    # A family's samples have to be listed together, whichever collector made them
+    families: Dict[str, List[str]] = {}
+    for name, kind, help, labels, value in self.collect():
+      family = families.setdefault(name, [f"# HELP {name} {help}", f"# TYPE {name} {kind}"])
+      family.append(f"{name}{_format_labels(sorted(labels.items()))} {value}")
+    for family in families.values():
+      lines.extend(family)
+    return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+
+# ──────────────────────────────────────────────────────────────────────────
+# The stages of a round
+# ──────────────────────────────────────────────────────────────────────────
+STORAGE_READ = metrics.histogram("storyteller_storage_read_seconds", "Time spent reading from storage, by operation")
+STORAGE_WRITE = metrics.histogram("storyteller_storage_write_seconds", "Time spent writing to storage, by operation")
+PROMPT_RENDER = metrics.histogram("storyteller_prompt_render_seconds", "Time spent rendering a prompt")
+PROMPT_TOKENS = metrics.histogram("storyteller_prompt_tokens", "Size of rendered prompts, in tokens", TOKENS)
+QUEUE_WAIT = metrics.histogram("storyteller_inference_queue_wait_seconds", "Time a generation waited for an inference slot")
+TIME_TO_FIRST_TOKEN = metrics.histogram("storyteller_inference_ttft_seconds", "Time until a streamed completion produced its first event, by backend")
+GENERATION = metrics.histogram("storyteller_inference_generation_seconds", "Total time of a completion request, by backend")
+DISCORD_SEND = metrics.histogram("storyteller_discord_send_seconds", "Time spent on Discord sends and edits, by operation")
+
+# Once per process, by phase; see bot.py
+STARTUP = metrics.histogram("storyteller_startup_seconds", "Time spent in each startup phase")
+
+
+def cache_collector(cache: str, stats: Callable[[], dict]) -> Callable[[], Iterable[Sample]]:
+  """Report a cache's `stats()` (hits, misses, evictions, size) under the *cache* label."""
+  def collect() -> Iterable[Sample]:
+    s = stats()
+    labels = {"cache": cache}
+    yield ("storyteller_cache_hits_total", "counter", "Cache lookups that hit", labels, s.get("hits", 0))
+    yield ("storyteller_cache_misses_total", "counter", "Cache lookups that missed", labels, s.get("misses", 0))
+    yield ("storyteller_cache_evictions_total", "counter", "Entries evicted from a cache", labels, s.get("evictions", 0))
+    yield ("storyteller_cache_entries", "gauge", "Entries currently cached", labels, s.get("size", 0))
+  return metrics.collector(collect)
+
+
+def report() -> str:
+  """A short human-readable digest of every histogram and collected value, for /stats."""
+  lines: List[str] = []
+  for metric in metrics.metrics.values():
+    if not isinstance(metric, Histogram):
+      continue
+    in_seconds = metric.name.endswith("_seconds")
+    fmt = (lambda v: "-" if v is None else f"{v * 1000:.1f}ms") if in_seconds else (lambda v: "-" if v is None else f"{v:.0f}")
+    for series in metric.summary():
+      labels = ",".join(f"{k}={v}" for k, v in series["labels"].items())
+      name = metric.name.removeprefix("storyteller_").removesuffix("_seconds") + (f"[{labels}]" if labels else "")
+      lines.append(f"{name:<44} n={series['count']:<6} mean={fmt(series['mean'])} p50={fmt(series['p50'])} p95={fmt(series['p95'])}")
+  for name, kind, help, labels, value in metrics.collect():
+    labels = ",".join(f"{k}={v}" for k, v in labels.items())
+    name = name.removeprefix("storyteller_") + (f"[{labels}]" if labels else "")
+    lines.append(f"{name:<44} {value:g}")
+  return "\n".join(lines)
+
+
+async def start_metrics_server(host: str = "127.0.0.1", port: int = 9108):
+  """Serve GET /metrics in the Prometheus text format. Returns the aiohttp runner to clean up."""
+  from aiohttp import web
+
+  async def handle(request: web.Request) -> web.Response:
+    return web.Response(text=metrics.render(), content_type="text/plain", charset="utf-8", headers={"X-Content-Type-Options": "nosniff"})
+
+  app = web.Application()
+  app.router.add_get("/metrics", handle)
+  runner = web.AppRunner(app, access_log=None)
+  await runner.setup()
+  await web.TCPSite(runner, host, port).start()
+  logging.info(f"Serving metrics on http://{host}:{port}/metrics")
+  return runner
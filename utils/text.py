@@ -1,23 +1,24 @@
 import re
 
 def chunk_by_words(text: str, limit: int = 1700) -> list[str]:
-  words = text.split()
+  """
+  Split *text* into pieces of at most *limit* characters. Pieces end at a
+  line break if there's one in the second half of the piece, otherwise at a
+  space; a single word longer than *limit* is cut. Line breaks inside a
+  piece are kept.
+  """
   chunks = []
-  current = []
-  length = 0
-
-  for w in words:
-    # +1 for the space
-    if length + len(w) + (1 if current else 0) > limit:
-      chunks.append(" ".join(current))
-      current = [w]
-      length = len(w)
-    else:
-      current.append(w)
-      length += len(w) + (1 if current[:-1] else 0)
-  if current:
-    chunks.append(" ".join(current))
-
+  text = text.strip()
+  while len(text) > limit:
+    cut = text.rfind("\n", 0, limit + 1)
+    if cut < limit // 2:
+      cut = text.rfind(" ", 0, limit + 1)
+    if cut <= 0:
+      cut = limit
+    chunks.append(text[:cut].rstrip())
+    text = text[cut:].lstrip()
+  if text:
+    chunks.append(text)
   return chunks
 
 def trim_pose(text: str) -> str:
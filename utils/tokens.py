@@ -0,0 +1,49 @@
+import logging
+import math
+from typing import Protocol
+
+
+class Tokenizer(Protocol):
+  name: str
+
+  def count(self, text: str) -> int:
+    ...
+
+
+class ApproximateTokenizer:
+  """
+  Estimates token counts from character length. Errs on the high side for
+  English prose so a prompt sized with it still fits the real context.
+  """
+
+  def __init__(self, chars_per_token: float = 3.5):
+    self.chars_per_token = chars_per_token
+    self.name = f"approximate:{chars_per_token}"
+
+  def count(self, text: str) -> int:
+    return math.ceil(len(text) / self.chars_per_token)
+
+
+class HuggingFaceTokenizer:
+  """Exact counts from a local tokenizer.json (needs the `tokenizers` package)."""
+
+  def __init__(self, path: str):
+    from tokenizers import Tokenizer as _Tokenizer
+    self.tokenizer = _Tokenizer.from_file(path)
+    self.name = f"huggingface:{path}"
+
+  def count(self, text: str) -> int:
+    return len(self.tokenizer.encode(text, add_special_tokens=False).ids)
+
+
+def load_tokenizer(spec: str = "approximate", *, chars_per_token: float = 3.5) -> Tokenizer:
+  """
+  *spec* is either "approximate" or the path to a tokenizer.json. Falls back to
+  the approximation if the local tokenizer can't be loaded.
+  """
+  if spec and spec != "approximate":
+    try:
+      return HuggingFaceTokenizer(spec)
+    except Exception:
+      logging.exception(f"Could not load tokenizer {spec}; using the approximate tokenizer")
+  return ApproximateTokenizer(chars_per_token)